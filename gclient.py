@@ -15,6 +15,19 @@
 #   .gclient_entries : A cache constructed by 'update' command.  Format is a
 #                   Python script defining 'entries', a list of the names
 #                   of all modules in the client
+#   .gclient_sync_timings : JSON written by the 'update' command with how long
+#                   each dependency took to sync and what it required. Used to
+#                   start the dependencies on the critical path first.
+#   .gclient_deps_cache : Directory of parsed DEPS files, keyed by their content
+#                   and the variables used to parse them.
+#   .gclient_sync_fingerprints : JSON written by the 'update' command with the
+#                   state of each pinned git dependency after it was synced.
+#                   Dependencies still in that state are not synced again.
+#   .gclient_trash : Directory that dependencies removed from DEPS are moved to
+#                   before being deleted in the background.
+#   .gclient_hook_stamps : JSON written when hooks run with a digest of the
+#                   inputs of each hook that declares them. Hooks whose inputs
+#                   did not change are skipped; 'runhooks --force' runs them.
 #   <module>/DEPS : Python script defining var 'deps' as a map from each
 #                   requisite submodule name to a URL where it can be found (via
 #                   one SCM)
@@ -78,11 +91,28 @@
 # Specifying a target CPU
 #   To specify a target CPU, the variables target_cpu and target_cpu_only
 #   are available and are analogous to target_os and target_os_only.
+#
+# Using a git cache
+#   If a gclient file sets "cache_dir", git checkouts are cloned from mirrors
+#   in that directory. The optional "cache_mode" key says how:
+#     'alternates' (default): checkouts borrow the objects of the mirrors, which
+#         saves disk space and makes clones fast. Checkouts whose mirror has
+#         been deleted are moved away and cloned again.
+#     'copy': checkouts have their own copy of the objects, and keep working
+#         if the cache is deleted. Existing checkouts are converted on sync.
+#
+#   Example:
+#     cache_dir = "/b/git-cache"
+#     cache_mode = "alternates"
 
 __version__ = '0.7'
 
+import collections
+import concurrent.futures
+import contextlib
 import copy
 import hashlib
+import io
 import json
 import logging
 import optparse
@@ -93,10 +123,15 @@ import pprint
 import re
 import sys
 import shutil
+import stat
+import subprocess
 import tarfile
 import tempfile
+import threading
 import time
+import urllib.error
 import urllib.parse
+import urllib.request
 
 from collections.abc import Collection, Mapping, Sequence
 
@@ -114,7 +149,6 @@ import scm as scm_git
 import setup_color
 import subcommand
 import subprocess2
-import upload_to_google_storage_first_class
 from third_party.repo.progress import Progress
 
 # TODO: Should fix these warnings.
@@ -128,6 +162,16 @@ UNSET_CACHE_DIR = object()
 
 PREVIOUS_CUSTOM_VARS_FILE = '.gclient_previous_custom_vars'
 PREVIOUS_SYNC_COMMITS_FILE = '.gclient_previous_sync_commits'
+SYNC_TIMINGS_FILE = '.gclient_sync_timings'
+DEPS_PARSE_CACHE_DIR = '.gclient_deps_cache'
+SYNC_FINGERPRINTS_FILE = '.gclient_sync_fingerprints'
+TRASH_DIR = '.gclient_trash'
+HOOK_STAMPS_FILE = '.gclient_hook_stamps'
+
+# How many bytes of a GCS object are read at a time, and how long to wait for
+# data before giving up on a download.
+GCS_CHUNK_SIZE = 1024 * 1024
+GCS_HTTP_TIMEOUT = 60
 
 PREVIOUS_SYNC_COMMITS = 'GCLIENT_PREVIOUS_SYNC_COMMITS'
 
@@ -169,7 +213,11 @@ class Hook(object):
                  condition=None,
                  variables=None,
                  verbose=False,
-                 cwd_base=None):
+                 cwd_base=None,
+                 requires=None,
+                 inputs=None,
+                 input_vars=None,
+                 owner=None):
         """Constructor.
 
     Arguments:
@@ -179,6 +227,11 @@ class Hook(object):
       cwd (str): working directory to use
       condition (str): condition when to run the hook
       variables (dict): variables for evaluating the condition
+      requires (list of str): names of the hooks that must run before this
+          one; if None, the hook runs after the previous hook of its DEPS file
+      inputs (list of str): files, relative to cwd, the hook depends on
+      input_vars (list of str): variables the hook depends on
+      owner (str): name of the dependency whose DEPS file declares the hook
     """
         self._action = gclient_utils.freeze(action)
         self._pattern = pattern
@@ -188,13 +241,20 @@ class Hook(object):
         self._variables = variables
         self._verbose = verbose
         self._cwd_base = cwd_base
+        self._requires = (None if requires is None else
+                          gclient_utils.freeze(requires))
+        self._inputs = None if inputs is None else gclient_utils.freeze(inputs)
+        self._input_vars = (None if input_vars is None else
+                            gclient_utils.freeze(input_vars))
+        self._owner = owner
 
     @staticmethod
     def from_dict(d,
                   variables=None,
                   verbose=False,
                   conditions=None,
-                  cwd_base=None):
+                  cwd_base=None,
+                  owner=None):
         """Creates a Hook instance from a dict like in the DEPS file."""
         # Merge any local and inherited conditions.
         gclient_eval.UpdateCondition(d, 'and', conditions)
@@ -207,7 +267,11 @@ class Hook(object):
             variables=variables,
             # Always print the header if not printing to a TTY.
             verbose=verbose or not setup_color.IS_TTY,
-            cwd_base=cwd_base)
+            cwd_base=cwd_base,
+            requires=d.get('requires'),
+            inputs=d.get('inputs'),
+            input_vars=d.get('input_vars'),
+            owner=owner)
 
     @property
     def action(self):
@@ -225,6 +289,22 @@ class Hook(object):
     def condition(self):
         return self._condition
 
+    @property
+    def requires(self):
+        return self._requires
+
+    @property
+    def inputs(self):
+        return self._inputs
+
+    @property
+    def input_vars(self):
+        return self._input_vars
+
+    @property
+    def owner(self):
+        return self._owner
+
     @property
     def effective_cwd(self):
         cwd = self._cwd_base
@@ -239,10 +319,58 @@ class Hook(object):
         pattern = re.compile(self._pattern)
         return bool([f for f in file_list if pattern.search(f)])
 
-    def run(self):
-        """Executes the hook's command (provided the condition is met)."""
-        if (self._condition and not gclient_eval.EvaluateCondition(
-                self._condition, self._variables)):
+    def stamp(self):
+        """Returns a digest of the action, inputs and condition variables of
+        the hook, or None if the hook doesn't declare its inputs."""
+        if self._inputs is None and self._input_vars is None:
+            return None
+        names = set(self._input_vars or ())
+        if self._condition:
+            names.update(gclient_eval.GetConditionVariables(self._condition))
+        variables = {}
+        for name in sorted(names):
+            value = (self._variables or {}).get(name)
+            if isinstance(value, gclient_eval.ConstantString):
+                value = value.value
+            variables[name] = value
+        inputs = {}
+        for path in self._inputs or ():
+            try:
+                with open(os.path.join(self.effective_cwd, path), 'rb') as f:
+                    inputs[path] = hashlib.sha256(f.read()).hexdigest()
+            except IOError:
+                inputs[path] = None
+        state = {
+            'action': list(self._action),
+            'cwd': self.effective_cwd,
+            'condition': self._condition,
+            'variables': variables,
+            'inputs': inputs,
+        }
+        return hashlib.sha256(
+            json.dumps(state, sort_keys=True,
+                       default=str).encode('utf-8')).hexdigest()
+
+    def is_enabled(self):
+        """Returns whether the hook's condition is met."""
+        return not self._condition or gclient_eval.EvaluateCondition(
+            self._condition, self._variables)
+
+    def run(self, outbuf=None, stamps=None):
+        """Executes the hook's command (provided the condition is met).
+
+        If |outbuf| is given, the output of the hook is written to it instead of
+        stdout. If |stamps| is given, the hook is skipped when its inputs did
+        not change since it last ran successfully.
+        """
+        if not self.is_enabled():
+            return
+
+        stamp = stamps and self.stamp()
+        if stamp and stamps.is_up_to_date(self, stamp):
+            print("Skipping hook '%s': its inputs did not change." %
+                  (self._name or gclient_utils.CommandToStr(self._action)),
+                  file=outbuf or sys.stdout)
             return
 
         cmd = list(self._action)
@@ -250,15 +378,28 @@ class Hook(object):
         if cmd[0] == 'vpython3' and _detect_host_os() == 'win':
             cmd[0] += '.bat'
 
+        filter_fn = None
+        if outbuf is not None:
+            filter_fn = lambda line: print(line.rstrip('\n'), file=outbuf)
+
         exit_code = 2
         try:
             start_time = time.time()
-            gclient_utils.CheckCallAndFilter(cmd,
-                                             cwd=self.effective_cwd,
-                                             print_stdout=True,
-                                             show_header=True,
-                                             always_show_header=self._verbose)
+            with gclient_utils.TraceSpan(self._name
+                                         or gclient_utils.CommandToStr(cmd),
+                                         'hook',
+                                         action=cmd,
+                                         cwd=self.effective_cwd):
+                gclient_utils.CheckCallAndFilter(
+                    cmd,
+                    cwd=self.effective_cwd,
+                    print_stdout=outbuf is None,
+                    filter_fn=filter_fn,
+                    show_header=True,
+                    always_show_header=self._verbose)
             exit_code = 0
+            if stamp:
+                stamps.record(self, stamp)
         except (gclient_utils.Error, subprocess2.CalledProcessError) as e:
             # Use a discrete exit status code of 2 to indicate that a hook
             # action failed.  Users of this script may wish to treat hook action
@@ -285,7 +426,176 @@ class Hook(object):
                 })
             if elapsed_time > 10:
                 print("Hook '%s' took %.2f secs" %
-                      (gclient_utils.CommandToStr(cmd), elapsed_time))
+                      (gclient_utils.CommandToStr(cmd), elapsed_time),
+                      file=outbuf or sys.stdout)
+
+
+class _HookWorkItem(gclient_utils.WorkItem):
+    """Runs a Hook on an ExecutionQueue, buffering its output."""
+
+    def __init__(self, name, hook, stamps=None):
+        super(_HookWorkItem, self).__init__(name)
+        self.hook = hook
+        self.stamps = stamps
+        self.requirements = []
+        self.exit_code = None
+
+        # Output of the hook alone, without the decorations the
+        # ExecutionQueue adds to outbuf.
+        self.hook_output = io.StringIO()
+
+    def run(self, work_queue):
+        # Hook.run() exits on failure, which would silently end the worker
+        # thread. Turn it into an error to stop the queue.
+        try:
+            self.hook.run(outbuf=self.hook_output, stamps=self.stamps)
+        except SystemExit as e:
+            self.exit_code = e.code
+            raise gclient_utils.Error('Hook \'%s\' failed' % self.name)
+
+
+class _HookOutputPrinter(object):
+    """Prints the buffered output of _HookWorkItems in order.
+
+    The output of an item is printed as soon as it and all the items before it
+    are done. Printing happens on the thread flushing the ExecutionQueue, so
+    that the output isn't annotated with the index of a worker thread.
+    """
+
+    def __init__(self, items):
+        self._items = items
+        self._done = set()
+        self._next = 0
+
+    def done(self, item):
+        self._done.add(item.name)
+        while (self._next < len(self._items)
+               and self._items[self._next].name in self._done):
+            self._print(self._items[self._next])
+
+    def print_remaining(self):
+        while self._next < len(self._items):
+            self._print(self._items[self._next])
+
+    def _print(self, item):
+        sys.stdout.write(item.hook_output.getvalue())
+        sys.stdout.flush()
+        self._next += 1
+
+
+class HookStamps(object):
+    """Digests of the inputs of the hooks when they last ran successfully.
+
+    See Hook.stamp(). Only the stamps of the hooks checked during this run are
+    saved, so stamps of removed hooks don't accumulate.
+    """
+
+    def __init__(self, root_dir, force=False):
+        self._root_dir = root_dir
+        self._force = force
+        self._lock = threading.Lock()
+        self._path = os.path.join(root_dir, HOOK_STAMPS_FILE)
+        try:
+            with open(self._path) as f:
+                self._stamps = json.load(f)
+        except (IOError, ValueError):
+            self._stamps = {}
+        self._checked = {}
+
+    def _key(self, hook):
+        # Hooks of different DEPS files may share a name and a cwd.
+        cwd = os.path.relpath(os.path.normpath(hook.effective_cwd),
+                              self._root_dir)
+        return '%s:%s:%s' % (hook.owner or '', cwd, hook.name
+                             or gclient_utils.CommandToStr(hook.action))
+
+    def is_up_to_date(self, hook, stamp):
+        key = self._key(hook)
+        with self._lock:
+            previous = self._stamps.get(key)
+            if previous is not None:
+                self._checked[key] = previous
+        return not self._force and previous == stamp
+
+    def record(self, hook, stamp):
+        with self._lock:
+            self._checked[self._key(hook)] = stamp
+
+    def save(self):
+        with self._lock:
+            if self._checked == self._stamps:
+                return
+            # Write to a temporary file first so that an interrupted save
+            # doesn't leave a truncated file behind.
+            with tempfile.NamedTemporaryFile('w',
+                                             dir=self._root_dir,
+                                             prefix=HOOK_STAMPS_FILE,
+                                             delete=False) as f:
+                json.dump(self._checked, f, indent=2, sort_keys=True)
+            try:
+                os.replace(f.name, self._path)
+            except OSError:
+                os.remove(f.name)
+                raise
+
+
+def _HookWorkItems(hooks_per_deps_file, stamps=None):
+    """Returns the _HookWorkItems running the enabled hooks.
+
+    A hook runs after the previous enabled hook of its DEPS file, unless it
+    declares which hooks it requires. Required hooks that are not enabled are
+    ignored.
+    """
+    items = []
+    items_by_hook_name = collections.defaultdict(list)
+    implicit_requirements = {}
+    for hooks in hooks_per_deps_file:
+        previous = None
+        for hook in hooks:
+            if not hook.is_enabled():
+                continue
+            name = hook.name or gclient_utils.CommandToStr(hook.action)
+            # ExecutionQueue identifies work items by their name.
+            unique_name = name
+            while unique_name in implicit_requirements:
+                unique_name = '%s (%d)' % (name, len(implicit_requirements))
+            item = _HookWorkItem(unique_name, hook, stamps)
+            implicit_requirements[unique_name] = [previous] if previous else []
+            if hook.name:
+                items_by_hook_name[hook.name].append(item)
+            items.append(item)
+            previous = unique_name
+
+    for item in items:
+        if item.hook.requires is None:
+            item.requirements = implicit_requirements[item.name]
+            continue
+        for required in item.hook.requires:
+            if required not in items_by_hook_name:
+                logging.warning('Hook %r requires %r, which does not run',
+                                item.name, required)
+            item.requirements.extend(
+                i.name for i in items_by_hook_name.get(required, []))
+
+    # A cycle would leave the queue waiting forever.
+    requirements = {item.name: item.requirements for item in items}
+    visited = set()
+    for item in items:
+        path = [item.name]
+        stack = [iter(requirements[item.name])]
+        while stack:
+            required = next(stack[-1], None)
+            if required is None:
+                visited.add(path.pop())
+                stack.pop()
+            elif required in path:
+                cycle = path[path.index(required):] + [required]
+                raise gclient_utils.Error('Hooks require each other: %s' %
+                                          ' -> '.join(cycle))
+            elif required not in visited:
+                path.append(required)
+                stack.append(iter(requirements[required]))
+    return items
 
 
 class DependencySettings(object):
@@ -906,10 +1216,13 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
 
         local_scope = {}
         if deps_content:
+            parse = gclient_eval.Parse
+            parse_cache = self.GetDepsParseCache()
+            if parse_cache:
+                parse = parse_cache.Parse
             try:
-                local_scope = gclient_eval.Parse(deps_content, filepath,
-                                                 self.get_vars(),
-                                                 self.get_builtin_vars())
+                local_scope = parse(deps_content, filepath, self.get_vars(),
+                                    self.get_builtin_vars())
             except SyntaxError as e:
                 gclient_utils.SyntaxErrorToError(filepath, e)
 
@@ -1045,7 +1358,8 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
                                variables=self.get_vars(),
                                verbose=True,
                                conditions=self.condition,
-                               cwd_base=hooks_cwd)
+                               cwd_base=hooks_cwd,
+                               owner=self.name)
                 for hook in local_scope.get('pre_deps_hooks', [])
             ]
 
@@ -1141,7 +1455,8 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
                            variables=self.get_vars(),
                            verbose=self.root._options.verbose,
                            conditions=self.condition,
-                           cwd_base=hooks_cwd) for h in hooks
+                           cwd_base=hooks_cwd,
+                           owner=self.name) for h in hooks
         ])
 
     def findDepsFromNotAllowedHosts(self):
@@ -1192,6 +1507,40 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
             return self.name
         return None
 
+    def _UpdateGitDependency(self, options, args, file_list, patch_refs):
+        """Runs update on the git checkout, unless it is still in the state
+        recorded by the previous sync.
+
+        Returns the revision the checkout is at.
+        """
+        fingerprint = None
+        if not self.FuzzyMatchUrl(patch_refs):
+            fingerprint = self._used_scm.GetSyncFingerprint(options)
+        fast_path = (fingerprint is not None
+                     and fingerprint['head'] == fingerprint['revision']
+                     and fingerprint == self.root.GetSyncFingerprint(self.name))
+        if fast_path and not options.verify_fast_path:
+            logging.info('Dependency(%s): skipping update, checkout is '
+                         'unchanged since the last sync.' % self.name)
+            self.root.RecordSyncFingerprint(self.name, fingerprint)
+            return fingerprint['revision']
+
+        revision = self._used_scm.RunCommand('update', options, args, file_list)
+        if self.FuzzyMatchUrl(patch_refs):
+            return revision
+
+        new_fingerprint = self._used_scm.GetSyncFingerprint(options)
+        if fast_path and (revision != fingerprint['revision'] or file_list
+                          or not new_fingerprint
+                          or new_fingerprint['head'] != fingerprint['head']):
+            raise gclient_utils.Error(
+                'Dependency(%s) would have been skipped by the fast path, but '
+                'syncing it changed the checkout to %s.' %
+                (self.name, revision))
+        if new_fingerprint and new_fingerprint['head'] == revision:
+            self.root.RecordSyncFingerprint(self.name, new_fingerprint)
+        return revision
+
     # Arguments number differs from overridden method
     # pylint: disable=arguments-differ
     def run(
@@ -1248,8 +1597,8 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
                                 path][1]
                         self._used_scm.current_revision = current_revision
 
-                    self._got_revision = self._used_scm.RunCommand(
-                        command, options, args, file_list)
+                    self._got_revision = self._UpdateGitDependency(
+                        options, args, file_list, patch_refs)
                     latest_commit = self._got_revision
                     sync_status = metrics_utils.SYNC_STATUS_SUCCESS
                 finally:
@@ -1332,6 +1681,8 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
         if self.should_recurse:
             if command in ('update', 'revert') and not options.noprehooks:
                 self.RunPreDepsHooks()
+            if command == 'update':
+                self._PrefetchMirrorRevisions()
             # Parse the dependencies of this dependency.
             for s in self.dependencies:
                 if s.should_process:
@@ -1434,6 +1785,32 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
         with open(os.path.join(path_prefix, self._gn_args_file), 'wb') as f:
             f.write('\n'.join(lines).encode('utf-8', 'replace'))
 
+    def _PrefetchMirrorRevisions(self):
+        """Checks in one go which pinned revisions of the git dependencies are
+        already in the git cache.
+
+        The answers are cached by git_cache.Mirror, so that each dependency
+        doesn't have to check its own revision when it syncs. Dependencies
+        that don't sync from the git cache are skipped.
+        """
+        pairs = []
+        for s in self.dependencies:
+            if (not s.should_process or not s.url
+                    or not isinstance(s, GitDependency)):
+                continue
+            _, revision = gclient_utils.SplitUrlRevision(s.url)
+            if not revision or not gclient_utils.IsFullGitSha(revision):
+                continue
+            mirror = s.CreateSCM().GetCacheMirror()
+            if mirror:
+                pairs.append((mirror, revision))
+        if not pairs:
+            return
+        try:
+            git_cache.Mirror.batch_contains_revisions(pairs)
+        except (OSError, subprocess.CalledProcessError) as e:
+            logging.warning('Failed to check the git cache: %s', e)
+
     @gclient_utils.lockedmethod
     def _run_is_done(self, file_list):
         # Both these are kept for hooks that are run as a separate tree
@@ -1444,6 +1821,16 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
     def GetHooks(self, options):
         """Evaluates all hooks, and return them in a flat list.
 
+    RunOnDeps() must have been called before to load the DEPS.
+    """
+        result = []
+        for hooks in self.GetHooksPerDepsFile(options):
+            result.extend(hooks)
+        return result
+
+    def GetHooksPerDepsFile(self, options):
+        """Evaluates all hooks, and return a list of hooks per DEPS file.
+
     RunOnDeps() must have been called before to load the DEPS.
     """
         result = []
@@ -1456,23 +1843,59 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
             # TODO(maruel): If the user is using git, then we don't know
             # what files have changed so we always run all hooks. It'd be nice
             # to fix that.
-            result.extend(self.deps_hooks)
+            result.append(list(self.deps_hooks))
         for s in self.dependencies:
-            result.extend(s.GetHooks(options))
+            result.extend(s.GetHooksPerDepsFile(options))
         return result
 
     def RunHooksRecursively(self, options, progress):
         assert self.hooks_ran == False
         self._hooks_ran = True
-        hooks = self.GetHooks(options)
-        if progress:
-            progress._total = len(hooks)
-        for hook in hooks:
+        stamps = HookStamps(self.root.root_dir,
+                            force=getattr(options, 'force_hooks', False))
+        try:
+            jobs = getattr(options, 'jobs', 1)
+            if jobs > 1:
+                self._RunHooksInParallel(options, progress, jobs, stamps)
+                return
+            hooks = self.GetHooks(options)
             if progress:
-                progress.update(extra=hook.name or '')
-            hook.run()
-        if progress:
-            progress.end()
+                progress._total = len(hooks)
+            for hook in hooks:
+                if progress:
+                    progress.update(extra=hook.name or '')
+                hook.run(stamps=stamps)
+            if progress:
+                progress.end()
+        finally:
+            # Keep the stamps of the hooks that succeeded, even if one failed.
+            stamps.save()
+
+    def _RunHooksInParallel(self, options, progress, jobs, stamps):
+        """Runs the hooks on up to |jobs| threads.
+
+        Hooks from different DEPS files run in parallel. The output of each
+        hook is printed once it and all the hooks before it are done, as if
+        they had run sequentially.
+        """
+        items = _HookWorkItems(self.GetHooksPerDepsFile(options), stamps)
+        printer = _HookOutputPrinter(items)
+        work_queue = gclient_utils.ExecutionQueue(jobs,
+                                                  progress,
+                                                  ignore_requirements=False,
+                                                  verbose=False,
+                                                  on_done=printer.done)
+        for item in items:
+            work_queue.enqueue(item)
+        try:
+            work_queue.flush()
+        except gclient_utils.Error:
+            printer.print_remaining()
+            # Keep the exit code of a failed hook.
+            for item in items:
+                if item.exit_code:
+                    sys.exit(item.exit_code)
+            raise
 
     def RunPreDepsHooks(self):
         assert self.processed
@@ -1499,6 +1922,13 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
             return None
         return self.root.GetGcsRoot()
 
+    def GetDepsParseCache(self):
+        if self.root is self:
+            # Let's not infinitely recurse. If this is root and isn't an
+            # instance of GClient, do nothing.
+            return None
+        return self.root.GetDepsParseCache()
+
     def subtree(self, include_all):
         """Breadth first recursion excluding root node."""
         dependencies = self.dependencies
@@ -1819,6 +2249,11 @@ solutions = %(solution_list)s
         self._root_dir = root_dir
         self._cipd_root = None
         self._gcs_root = None
+        self._deps_parse_cache = None
+        # State of the git dependencies recorded by the previous and current
+        # sync, keyed by name.
+        self._previous_sync_fingerprints = {}
+        self._sync_fingerprints = {}
         self.config_content = None
 
     def _CheckConfig(self):
@@ -1891,6 +2326,9 @@ it or fix the checkout.
 
             git_cache.Mirror.SetCachePath(cache_dir)
 
+        gclient_scm.GitWrapper.SetCacheMode(
+            config_dict.get('cache_mode', 'alternates'))
+
         if not target_os and config_dict.get('target_os_only', False):
             raise gclient_utils.Error(
                 'Can\'t use target_os_only if target_os is '
@@ -2056,6 +2494,64 @@ it or fix the checkout.
             logging.info('Writing to file %s' % f)
             open_f.write(content)
 
+    def GetSyncFingerprint(self, name):
+        """Returns the state of a dependency recorded by the previous sync."""
+        return self._previous_sync_fingerprints.get(name)
+
+    @gclient_utils.lockedmethod
+    def RecordSyncFingerprint(self, name, fingerprint):
+        self._sync_fingerprints[name] = fingerprint
+
+    def _ReadSyncFingerprints(self):
+        try:
+            return self._ExtractFileJsonContents(SYNC_FINGERPRINTS_FILE)
+        except ValueError:
+            logging.warning('Ignoring malformed %s' % SYNC_FINGERPRINTS_FILE)
+            return {}
+
+    def _ReadSyncPriorities(self):
+        # type: () -> Mapping[str, float]
+        """Returns the longest remaining sync time from each dependency, based
+        on the timings recorded by the previous sync."""
+        try:
+            timings = self._ExtractFileJsonContents(SYNC_TIMINGS_FILE)
+        except ValueError:
+            logging.warning('Ignoring malformed %s' % SYNC_TIMINGS_FILE)
+            return {}
+        durations = {
+            name: entry.get('duration', 0)
+            for name, entry in timings.items()
+        }
+        requirements = {
+            name: entry.get('requirements', [])
+            for name, entry in timings.items()
+        }
+        return gclient_utils.CriticalPathLengths(durations, requirements)
+
+    def _SaveSyncTimings(self, work_queue):
+        """Records how long each dependency took to sync, for the next sync to
+        prioritize the critical path."""
+        durations, requirements = work_queue.timings()
+        if not durations:
+            return
+        timings = {
+            name: {
+                'duration': round(duration, 3),
+                'requirements': requirements[name],
+            }
+            for name, duration in durations.items()
+        }
+        self._WriteFileContents(SYNC_TIMINGS_FILE,
+                                json.dumps(timings, indent=2, sort_keys=True))
+
+    def _PrintTimingReport(self, work_queue):
+        durations, requirements = work_queue.timings()
+        path = gclient_utils.CriticalPath(durations, requirements)
+        total = sum(durations[name] for name in path)
+        print('\nCritical path (%.1fs):' % total)
+        for name in path:
+            print('  %8.1fs  %s' % (durations[name], name))
+
     def _EnforceSkipSyncRevisions(self, patch_refs):
         # type: (Mapping[str, str]) -> Mapping[str, str]
         """Checks for and enforces revisions for skipping deps syncing."""
@@ -2226,14 +2722,8 @@ it or fix the checkout.
                 read_entries[path] = f'https://unknown@{v[1]}'
 
 
-        # We process entries sorted in reverse to ensure a child dir is
-        # always deleted before its parent dir.
-        # This is especially important for submodules with pinned revisions
-        # overwritten by a vars or custom_deps. In this case, if a parent
-        # submodule is encountered first in the loop, it cannot tell the
-        # difference between modifications from the vars or actual user
-        # modifications that should be kept. http://crbug/1486677#c9 for
-        # more details.
+        # Collect the entries that were removed from DEPS but are still on disk.
+        stale_entries = []
         for entry in sorted(read_entries, reverse=True):
             prev_url = read_entries[entry]
             if not prev_url:
@@ -2257,124 +2747,236 @@ it or fix the checkout.
                 (not any(path.startswith(entry + '/') for path in entries))
                     and os.path.exists(e_dir)):
                 # The entry has been removed from DEPS.
-                scm = gclient_scm.GitWrapper(prev_url, self.root_dir,
-                                             entry_fixed, self.outbuf)
-
-                # Check to see if this directory is now part of a higher-up
-                # checkout.
-                scm_root = None
-                try:
-                    scm_root = gclient_scm.scm.GIT.GetCheckoutRoot(
-                        scm.checkout_path)
-                except subprocess2.CalledProcessError:
-                    pass
-                if not scm_root:
-                    logging.warning(
-                        'Could not find checkout root for %s. Unable to '
-                        'determine whether it is part of a higher-level '
-                        'checkout, so not removing.' % entry)
-                    continue
-
-                versioned_state = None
-                # Check if this is a submodule or versioned directory.
-                if os.path.abspath(scm_root) == os.path.abspath(e_dir):
-                    e_par_dir = os.path.join(e_dir, os.pardir)
-                    if gclient_scm.scm.GIT.IsInsideWorkTree(e_par_dir):
-                        par_scm_root = gclient_scm.scm.GIT.GetCheckoutRoot(
-                            e_par_dir)
-                        # rel_e_dir : relative path of entry w.r.t. its parent
-                        # repo.
-                        rel_e_dir = os.path.relpath(e_dir, par_scm_root)
-                        versioned_state = gclient_scm.scm.GIT.IsVersioned(
-                            par_scm_root, rel_e_dir)
-                        # This is to handle the case of third_party/WebKit migrating
-                        # from being a DEPS entry to being part of the main project. If
-                        # the subproject is a Git project, we need to remove its .git
-                        # folder. Otherwise git operations on that folder will have
-                        # different effects depending on the current working directory.
-                        if versioned_state == gclient_scm.scm.VERSIONED_DIR:
-                            save_dir = scm.GetGitBackupDirPath()
-                            # Remove any eventual stale backup dir for the same
-                            # project.
-                            if os.path.exists(save_dir):
-                                gclient_utils.rmtree(save_dir)
-                            os.rename(os.path.join(e_dir, '.git'), save_dir)
-                            # When switching between the two states (entry/ is a
-                            # subproject -> entry/ is part of the outer
-                            # project), it is very likely that some files are
-                            # changed in the checkout, unless we are jumping
-                            # *exactly* across the commit which changed just
-                            # DEPS. In such case we want to cleanup any eventual
-                            # stale files (coming from the old subproject) in
-                            # order to end up with a clean checkout.
-                            gclient_scm.scm.GIT.CleanupDir(
-                                par_scm_root, rel_e_dir)
-                            assert not os.path.exists(
-                                os.path.join(e_dir, '.git'))
-                            print(
-                                '\nWARNING: \'%s\' has been moved from DEPS to a higher '
-                                'level checkout. The git folder containing all the local'
-                                ' branches has been saved to %s.\n'
-                                'If you don\'t care about its state you can safely '
-                                'remove that folder to free up space.' %
-                                (entry, save_dir))
-                            continue
-
-                if scm_root in full_entries:
-                    logging.info(
-                        '%s is part of a higher level checkout, not removing',
-                        scm.GetCheckoutRoot())
-                    continue
-
-                file_list = []
-                scm.status(self._options, [], file_list)
-                modified_files = file_list != []
-                if (not self._options.delete_unversioned_trees
-                        or (modified_files and not self._options.force)):
-                    # There are modified files in this entry. Keep warning until
-                    # removed.
-                    self.add_dependency(
-                        GitDependency(
-                            parent=self,
-                            name=entry,
-                            # Update URL with scheme in protocol_override
-                            url=GitDependency.updateProtocol(
-                                prev_url, self.protocol),
-                            managed=False,
-                            custom_deps={},
-                            custom_vars={},
-                            custom_hooks=[],
-                            deps_file=None,
-                            should_process=True,
-                            should_recurse=False,
-                            relative=None,
-                            condition=None,
-                            protocol=self.protocol))
-                    if modified_files and self._options.delete_unversioned_trees:
-                        print(
-                            '\nWARNING: \'%s\' is no longer part of this client.\n'
-                            'Despite running \'gclient sync -D\' no action was taken '
-                            'as there are modifications.\nIt is recommended you revert '
-                            'all changes or run \'gclient sync -D --force\' next '
-                            'time.' % entry_fixed)
-                    else:
-                        print(
-                            '\nWARNING: \'%s\' is no longer part of this client.\n'
-                            'It is recommended that you manually remove it or use '
-                            '\'gclient sync -D\' next time.' % entry_fixed)
-                else:
-                    # Delete the entry
-                    print('\n________ deleting \'%s\' in \'%s\'' %
-                          (entry_fixed, self.root_dir))
-                    gclient_utils.rmtree(e_dir)
-                    # We restore empty directories of submodule paths.
-                    if versioned_state == gclient_scm.scm.VERSIONED_SUBMODULE:
-                        gclient_scm.scm.GIT.Capture(
-                            ['restore', '--', rel_e_dir], cwd=par_scm_root)
+                stale_entries.append(entry)
+
+        results = self._ProcessStaleEntries(stale_entries, read_entries,
+                                            full_entries)
+
+        for entry in stale_entries:
+            keep, message = results[entry]
+            if message:
+                print(message)
+            if keep:
+                # There are modified files in this entry. Keep warning until
+                # removed.
+                self.add_dependency(
+                    GitDependency(
+                        parent=self,
+                        name=entry,
+                        # Update URL with scheme in protocol_override
+                        url=GitDependency.updateProtocol(
+                            read_entries[entry], self.protocol),
+                        managed=False,
+                        custom_deps={},
+                        custom_vars={},
+                        custom_hooks=[],
+                        deps_file=None,
+                        should_process=True,
+                        should_recurse=False,
+                        relative=None,
+                        condition=None,
+                        protocol=self.protocol))
         # record the current list of entries for next time
         self._SaveEntries()
+        self._EmptyTrash()
         return removed_cipd_entries
 
+    def _ProcessStaleEntries(self, stale_entries, read_entries, full_entries):
+        """Checks and removes entries that are no longer part of the checkout.
+
+        Up to --jobs entries are processed in parallel, but we ensure a child
+        dir is always processed before its parent dir.
+        This is especially important for submodules with pinned revisions
+        overwritten by a vars or custom_deps. In this case, if a parent
+        submodule is processed first, it cannot tell the difference between
+        modifications from the vars or actual user modifications that should
+        be kept. http://crbug/1486677#c9 for more details.
+
+        Returns a dict mapping each entry to the result of _ProcessStaleEntry.
+        """
+        stale = set(stale_entries)
+        # The closest stale entry containing each entry, and the number of
+        # stale entries each entry is still waiting on.
+        parents = {}
+        pending = dict.fromkeys(stale_entries, 0)
+        for entry in stale_entries:
+            parent = posixpath.dirname(entry)
+            while parent and parent not in stale:
+                parent = posixpath.dirname(parent)
+            if parent:
+                parents[entry] = parent
+                pending[parent] += 1
+
+        results = {}
+        # Serializes changes to the index of the checkouts containing the
+        # entries.
+        index_lock = threading.Lock()
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, self._options.jobs)) as executor:
+
+            def submit(entry):
+                return executor.submit(self._ProcessStaleEntry, entry,
+                                       read_entries[entry], full_entries,
+                                       index_lock)
+
+            futures = {
+                submit(entry): entry
+                for entry in stale_entries if not pending[entry]
+            }
+            while futures:
+                done, _ = concurrent.futures.wait(
+                    futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    entry = futures.pop(future)
+                    results[entry] = future.result()
+                    parent = parents.get(entry)
+                    if parent:
+                        pending[parent] -= 1
+                        if not pending[parent]:
+                            futures[submit(parent)] = parent
+        return results
+
+    def _ProcessStaleEntry(self, entry, prev_url, full_entries, index_lock):
+        """Removes a single entry that is no longer part of the checkout.
+
+        Only delete the directory if there are no changes in it, and
+        delete_unversioned_trees is set to true.
+
+        Returns a (keep, message) tuple, where keep is True if the entry must
+        still be tracked as a dependency and message is what to tell the user
+        about it, if anything.
+        """
+        entry_fixed = entry.replace('/', os.path.sep)
+        e_dir = os.path.join(self.root_dir, entry_fixed)
+        scm = gclient_scm.GitWrapper(prev_url, self.root_dir, entry_fixed,
+                                     self.outbuf)
+
+        # Check to see if this directory is now part of a higher-up checkout.
+        scm_root = None
+        try:
+            scm_root = gclient_scm.scm.GIT.GetCheckoutRoot(scm.checkout_path)
+        except subprocess2.CalledProcessError:
+            pass
+        if not scm_root:
+            logging.warning('Could not find checkout root for %s. Unable to '
+                            'determine whether it is part of a higher-level '
+                            'checkout, so not removing.' % entry)
+            return False, None
+
+        versioned_state = None
+        # Check if this is a submodule or versioned directory.
+        if os.path.abspath(scm_root) == os.path.abspath(e_dir):
+            e_par_dir = os.path.join(e_dir, os.pardir)
+            if gclient_scm.scm.GIT.IsInsideWorkTree(e_par_dir):
+                par_scm_root = gclient_scm.scm.GIT.GetCheckoutRoot(e_par_dir)
+                # rel_e_dir : relative path of entry w.r.t. its parent repo.
+                rel_e_dir = os.path.relpath(e_dir, par_scm_root)
+                versioned_state = gclient_scm.scm.GIT.IsVersioned(
+                    par_scm_root, rel_e_dir)
+                # This is to handle the case of third_party/WebKit migrating
+                # from being a DEPS entry to being part of the main project. If
+                # the subproject is a Git project, we need to remove its .git
+                # folder. Otherwise git operations on that folder will have
+                # different effects depending on the current working directory.
+                if versioned_state == gclient_scm.scm.VERSIONED_DIR:
+                    save_dir = scm.GetGitBackupDirPath()
+                    # Remove any eventual stale backup dir for the same
+                    # project.
+                    if os.path.exists(save_dir):
+                        gclient_utils.rmtree(save_dir)
+                    os.rename(os.path.join(e_dir, '.git'), save_dir)
+                    # When switching between the two states (entry/ is a
+                    # subproject -> entry/ is part of the outer
+                    # project), it is very likely that some files are
+                    # changed in the checkout, unless we are jumping
+                    # *exactly* across the commit which changed just
+                    # DEPS. In such case we want to cleanup any eventual
+                    # stale files (coming from the old subproject) in
+                    # order to end up with a clean checkout.
+                    with index_lock:
+                        gclient_scm.scm.GIT.CleanupDir(par_scm_root, rel_e_dir)
+                    assert not os.path.exists(os.path.join(e_dir, '.git'))
+                    return False, (
+                        '\nWARNING: \'%s\' has been moved from DEPS to a '
+                        'higher level checkout. The git folder containing all '
+                        'the local branches has been saved to %s.\n'
+                        'If you don\'t care about its state you can safely '
+                        'remove that folder to free up space.' %
+                        (entry, save_dir))
+
+        if scm_root in full_entries:
+            logging.info('%s is part of a higher level checkout, not removing',
+                         scm.GetCheckoutRoot())
+            return False, None
+
+        file_list = []
+        scm.status(self._options, [], file_list)
+        modified_files = file_list != []
+        if (not self._options.delete_unversioned_trees
+                or (modified_files and not self._options.force)):
+            if modified_files and self._options.delete_unversioned_trees:
+                return True, (
+                    '\nWARNING: \'%s\' is no longer part of this client.\n'
+                    'Despite running \'gclient sync -D\' no action was taken '
+                    'as there are modifications.\nIt is recommended you revert '
+                    'all changes or run \'gclient sync -D --force\' next '
+                    'time.' % entry_fixed)
+            return True, (
+                '\nWARNING: \'%s\' is no longer part of this client.\n'
+                'It is recommended that you manually remove it or use '
+                '\'gclient sync -D\' next time.' % entry_fixed)
+
+        # Delete the entry
+        self._MoveToTrash(e_dir)
+        # We restore empty directories of submodule paths.
+        if versioned_state == gclient_scm.scm.VERSIONED_SUBMODULE:
+            with index_lock:
+                gclient_scm.scm.GIT.Capture(['restore', '--', rel_e_dir],
+                                            cwd=par_scm_root)
+        return False, ('\n________ deleting \'%s\' in \'%s\'' %
+                       (entry_fixed, self.root_dir))
+
+    def _MoveToTrash(self, path):
+        """Moves |path| out of the checkout so _EmptyTrash can delete it.
+
+        Falls back to deleting |path| in place if it can't be moved.
+        """
+        trash_dir = os.path.join(self.root_dir, TRASH_DIR)
+        try:
+            os.makedirs(trash_dir, exist_ok=True)
+            os.rename(
+                path,
+                os.path.join(tempfile.mkdtemp(dir=trash_dir),
+                             os.path.basename(path)))
+        except OSError as e:
+            logging.warning('Could not move %s to %s, deleting it in place: %s',
+                            path, trash_dir, e)
+            gclient_utils.rmtree(path)
+
+    def _EmptyTrash(self):
+        """Deletes the contents of the trash dir in a background thread.
+
+        The thread doesn't keep gclient from exiting; anything it didn't get to
+        is deleted the next time the trash is emptied. Returns the thread, or
+        None if there is no trash dir.
+        """
+        trash_dir = os.path.join(self.root_dir, TRASH_DIR)
+        if not os.path.isdir(trash_dir):
+            return None
+
+        def empty_trash():
+            for name in os.listdir(trash_dir):
+                try:
+                    gclient_utils.rmtree(os.path.join(trash_dir, name))
+                except OSError as e:
+                    logging.warning('Could not delete %s from %s: %s', name,
+                                    trash_dir, e)
+
+        thread = threading.Thread(target=empty_trash, name='gclient-trash')
+        thread.daemon = True
+        thread.start()
+        return thread
+
     def RunOnDeps(self,
                   command,
                   args,
@@ -2425,11 +3027,17 @@ it or fix the checkout.
                 pm = Progress('Syncing projects', 1)
             elif command in ('recurse', 'validate'):
                 pm = Progress(' '.join(args), 1)
+        priorities = None
+        if command == 'update':
+            priorities = self._ReadSyncPriorities()
+            self._previous_sync_fingerprints = self._ReadSyncFingerprints()
+            self._sync_fingerprints = {}
         work_queue = gclient_utils.ExecutionQueue(
             self._options.jobs,
             pm,
             ignore_requirements=ignore_requirements,
-            verbose=self._options.verbose)
+            verbose=self._options.verbose,
+            priorities=priorities)
         for s in self.dependencies:
             if s.should_process:
                 work_queue.enqueue(s)
@@ -2440,6 +3048,14 @@ it or fix the checkout.
                          patch_refs=patch_refs,
                          target_branches=target_branches,
                          skip_sync_revisions=skip_sync_revisions)
+        if command == 'update':
+            self._SaveSyncTimings(work_queue)
+            self._WriteFileContents(
+                SYNC_FINGERPRINTS_FILE,
+                json.dumps(self._sync_fingerprints, indent=2, sort_keys=True))
+            # Every DEPS file of the checkout was just parsed, anything else in
+            # the cache is stale.
+            self.GetDepsParseCache().Prune()
 
         if revision_overrides:
             print(
@@ -2496,7 +3112,10 @@ it or fix the checkout.
         # dependency was moved to CIPD, we want to remove the old git directory
         # first and then sync the CIPD dep.
         if self._cipd_root:
-            self._cipd_root.run(command)
+            self._cipd_root.run(
+                command,
+                force=(getattr(self._options, 'force', False)
+                       or getattr(self._options, 'reset', False)))
             # It's possible that CIPD removed some entries that are now part of
             # git worktree. Try to checkout those directories
             if removed_cipd_entries:
@@ -2519,6 +3138,9 @@ it or fix the checkout.
         self._WriteFileContents(PREVIOUS_SYNC_COMMITS_FILE,
                                 os.environ.get(PREVIOUS_SYNC_COMMITS, '{}'))
 
+        if command == 'update' and self._options.timing_report:
+            self._PrintTimingReport(work_queue)
+
         return 0
 
     def PrintRevInfo(self):
@@ -2633,6 +3255,13 @@ it or fix the checkout.
             self._gcs_root = gclient_scm.GcsRoot(self.root_dir)
         return self._gcs_root
 
+    @gclient_utils.lockedmethod
+    def GetDepsParseCache(self):
+        if not self._deps_parse_cache:
+            self._deps_parse_cache = gclient_eval.ParseCache(
+                os.path.join(self.root_dir, DEPS_PARSE_CACHE_DIR))
+        return self._deps_parse_cache
+
     @property
     def root_dir(self):
         """Root directory of gclient checkout."""
@@ -2652,9 +3281,50 @@ it or fix the checkout.
         return self._enforced_cpu
 
 
+class _HashingReader(object):
+    """Reads a stream, writing what is read to a file and hashing it."""
+
+    def __init__(self, stream, out_file):
+        self._stream = stream
+        self._out_file = out_file
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self._out_file.write(data)
+        self._sha256.update(data)
+        self.size += len(data)
+        return data
+
+    def drain(self):
+        """Reads the rest of the stream."""
+        while self.read(GCS_CHUNK_SIZE):
+            pass
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+
+def _MoveTree(src, dst):
+    """Moves the contents of |src| into |dst|, merging directories."""
+    for name in os.listdir(src):
+        src_path = os.path.join(src, name)
+        dst_path = os.path.join(dst, name)
+        if (os.path.isdir(src_path) and not os.path.islink(src_path)
+                and os.path.isdir(dst_path) and not os.path.islink(dst_path)):
+            _MoveTree(src_path, dst_path)
+        else:
+            os.replace(src_path, dst_path)
+
+
 class GcsDependency(Dependency):
     """A Dependency object that represents a single GCS bucket and object"""
 
+    # Objects are streamed from here when they can be read anonymously, and
+    # through gsutil otherwise.
+    GCS_HTTP_URL = 'https://storage.googleapis.com'
+
     def __init__(self, parent, name, bucket, object_name, sha256sum,
                  output_file, size_bytes, gcs_root, custom_vars, should_process,
                  relative, condition):
@@ -2764,34 +3434,168 @@ class GcsDependency(Dependency):
             return True
         return False
 
-    def ValidateTarFile(self, tar, prefixes):
-
-        def _validate(tarinfo):
-            """Returns false if the tarinfo is something we explicitly forbid."""
-            if tarinfo.issym() or tarinfo.islnk():
-                # For links, check if the destination is valid.
-                if os.path.isabs(tarinfo.linkname):
-                    return False
-                link_target = os.path.normpath(
-                    os.path.join(os.path.dirname(tarinfo.name),
-                                 tarinfo.linkname))
-                if not any(
-                        link_target.startswith(prefix) for prefix in prefixes):
-                    return False
-
-            if tarinfo.name == '.':
-                return True
-
-            # tarfile for sysroot has paths that start with ./
-            cleaned_name = tarinfo.name
-            if tarinfo.name.startswith('./') and len(tarinfo.name) > 2:
-                cleaned_name = tarinfo.name[2:]
-            if ('../' in cleaned_name or '..\\' in cleaned_name or not any(
-                    cleaned_name.startswith(prefix) for prefix in prefixes)):
+    def IsValidTarMember(self, tarinfo, prefixes):
+        """Returns false if the tarinfo is something we explicitly forbid."""
+        if tarinfo.issym() or tarinfo.islnk():
+            # For links, check if the destination is valid.
+            if os.path.isabs(tarinfo.linkname):
                 return False
+            link_target = os.path.normpath(
+                os.path.join(os.path.dirname(tarinfo.name), tarinfo.linkname))
+            if not any(link_target.startswith(prefix) for prefix in prefixes):
+                return False
+
+        if tarinfo.name == '.':
             return True
 
-        return all(map(_validate, tar.getmembers()))
+        # tarfile for sysroot has paths that start with ./
+        cleaned_name = tarinfo.name
+        if tarinfo.name.startswith('./') and len(tarinfo.name) > 2:
+            cleaned_name = tarinfo.name[2:]
+        if ('../' in cleaned_name or '..\\' in cleaned_name or
+                not any(cleaned_name.startswith(prefix)
+                        for prefix in prefixes)):
+            return False
+        return True
+
+    @staticmethod
+    def _TopLevelDir(name):
+        if name.startswith('./') and len(name) > 2:
+            name = name[2:]
+        return name.split('/')[0]
+
+    @contextlib.contextmanager
+    def _OpenObject(self):
+        """Opens a stream of the object's contents.
+
+        Objects that can be read anonymously are streamed over HTTP, others
+        through `gsutil cat`. Yields a (stream, executable) tuple, where
+        executable is None if it isn't known whether the object is marked as
+        executable.
+        """
+        if os.getenv('GCLIENT_TEST') == '1':
+            yield io.BytesIO(self._FakeObjectContents()), False
+            return
+
+        http_url = '%s/%s/%s' % (self.GCS_HTTP_URL, self.bucket,
+                                 urllib.parse.quote(self.object_name))
+        try:
+            response = urllib.request.urlopen(http_url,
+                                              timeout=GCS_HTTP_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            if e.code not in (401, 403):
+                raise Exception(f'{e.code}: {e.reason}')
+            logging.info(
+                'GcsDependency(%s): %s needs credentials, using '
+                'gsutil', self.name, self.url)
+        except (urllib.error.URLError, OSError) as e:
+            # gsutil may get through e.g. a proxy that urllib doesn't know of.
+            logging.info(
+                'GcsDependency(%s): %s is unreachable (%s), using '
+                'gsutil', self.name, self.url, e)
+        else:
+            with response:
+                yield (response,
+                       response.headers.get('x-goog-meta-executable') == '1')
+            return
+
+        gsutil = download_from_google_storage.Gsutil(
+            download_from_google_storage.GSUTIL_DEFAULT_PATH)
+        # Send stderr to a file, so gsutil can't block on a full stderr pipe
+        # while stdout is being read.
+        with tempfile.TemporaryFile() as stderr:
+            proc = subprocess2.Popen(
+                [gsutil.VPYTHON3, gsutil.path, 'cat', self.url],
+                stdout=subprocess2.PIPE,
+                stderr=stderr,
+                env=gsutil.get_sub_env())
+            try:
+                yield proc.stdout, None
+            finally:
+                proc.stdout.close()
+                code = proc.wait()
+            stderr.seek(0)
+            err = stderr.read().decode('utf-8', 'replace')
+        if code:
+            raise Exception(f'{code}: {err}')
+
+    def _FakeObjectContents(self):
+        """Returns the object used in place of the real one by smoke tests."""
+        if 'no-extract' in self.artifact_output_file:
+            return b'non-extractable file'
+        contents = b'extracted text'
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+            tarinfo = tarfile.TarInfo('extracted_dir')
+            tarinfo.type = tarfile.DIRTYPE
+            tarinfo.mode = 0o755
+            tar.addfile(tarinfo)
+            tarinfo = tarfile.TarInfo('extracted_dir/extracted_file')
+            tarinfo.size = len(contents)
+            tar.addfile(tarinfo, io.BytesIO(contents))
+        return buf.getvalue()
+
+    def _StreamObject(self, stream, extract_dir):
+        """Writes |stream| to the artifact file in a single pass.
+
+        The contents are hashed as they are read and, if they are a tarball,
+        extracted into |extract_dir|. Links are only extracted once the whole
+        tarball has been validated. Like TarFile.extractall(), directories are
+        created without their mode and mtime; see _SetDirectoryAttributes().
+
+        Returns a (reader, members) tuple, where members is the list of
+        TarInfos in the tarball or None if the object is not a tarball.
+        """
+        with open(self.artifact_output_file, 'wb') as f:
+            reader = _HashingReader(stream, f)
+            try:
+                tar = tarfile.open(fileobj=reader, mode='r|*')
+            except tarfile.ReadError:
+                # Not a tarball, just write the object out.
+                reader.drain()
+                return reader, None
+
+            members = []
+            links = []
+            with tar:
+                for tarinfo in tar:
+                    members.append(tarinfo)
+                    if tarinfo.issym() or tarinfo.islnk():
+                        links.append(tarinfo)
+                        continue
+                    if not self.IsValidTarMember(
+                            tarinfo, {self._TopLevelDir(tarinfo.name)}):
+                        raise Exception('tarfile contains invalid entries')
+                    tar.extract(tarinfo,
+                                path=extract_dir,
+                                set_attrs=not tarinfo.isdir())
+                reader.drain()
+
+                prefixes = set(
+                    self._TopLevelDir(tarinfo.name) for tarinfo in members)
+                if not all(
+                        self.IsValidTarMember(tarinfo, prefixes)
+                        for tarinfo in links):
+                    raise Exception('tarfile contains invalid entries')
+                for tarinfo in links:
+                    tar.extract(tarinfo, path=extract_dir)
+            return reader, members
+
+    def _SetDirectoryAttributes(self, directories):
+        """Sets the mode and mtime of the extracted |directories|.
+
+        This is done once all their contents are in place, deepest first, so
+        that read-only directories can still be filled in.
+        """
+        for tarinfo in sorted(directories, key=lambda t: t.name, reverse=True):
+            path = os.path.join(self.output_dir, tarinfo.name)
+            try:
+                os.utime(path, (tarinfo.mtime, tarinfo.mtime))
+                os.chmod(path, tarinfo.mode)
+            except OSError as e:
+                logging.warning(
+                    'GcsDependency(%s): could not set attributes '
+                    'of %s: %s', self.name, path, e)
 
     def DownloadGoogleStorage(self):
         """Calls GCS."""
@@ -2812,85 +3616,58 @@ class GcsDependency(Dependency):
         # it, so exist_ok is used.
         os.makedirs(self.output_dir, exist_ok=True)
 
-        gsutil = download_from_google_storage.Gsutil(
-            download_from_google_storage.GSUTIL_DEFAULT_PATH)
-        if os.getenv('GCLIENT_TEST') == '1':
-            if 'no-extract' in self.artifact_output_file:
-                with open(self.artifact_output_file, 'w+') as f:
-                    f.write('non-extractable file')
-            else:
-                # Create fake tar file and extracted tar contents
-                tmpdir = tempfile.mkdtemp()
-                copy_dir = os.path.join(tmpdir, self.gcs_file_name,
-                                        'extracted_dir')
-                if os.path.exists(copy_dir):
-                    shutil.rmtree(copy_dir)
-                os.makedirs(copy_dir)
-                with open(os.path.join(copy_dir, 'extracted_file'), 'w+') as f:
-                    f.write('extracted text')
-                with tarfile.open(self.artifact_output_file, "w:gz") as tar:
-                    tar.add(copy_dir, arcname=os.path.basename(copy_dir))
-        else:
-            code, _, err = gsutil.check_call('cp', self.url,
-                                             self.artifact_output_file)
-            if code and err:
-                raise Exception(f'{code}: {err}')
-            # Check that something actually downloaded into the path
-            if not os.path.exists(self.artifact_output_file):
+        # Tarballs are extracted here and only moved into the output dir once
+        # their hash has been verified.
+        extract_dir = tempfile.mkdtemp(dir=self.output_dir,
+                                       prefix=f'.{self.file_prefix}_')
+        try:
+            with self._gcs_root.download_slots:
+                with self._OpenObject() as (stream, executable):
+                    reader, members = self._StreamObject(stream, extract_dir)
+
+            calculated_sha256sum = reader.hexdigest()
+            calculated_size_bytes = reader.size
+            if os.getenv('GCLIENT_TEST') == '1':
+                calculated_sha256sum = 'abcd123'
+                calculated_size_bytes = 10000
+
+            if calculated_sha256sum != self.sha256sum:
+                raise Exception('sha256sum does not match calculated hash. '
+                                '{original} vs {calculated}'.format(
+                                    original=self.sha256sum,
+                                    calculated=calculated_sha256sum,
+                                ))
+
+            if calculated_size_bytes != self.size_bytes:
                 raise Exception(
-                    f'Nothing was downloaded into {self.artifact_output_file}')
-
-        calculated_sha256sum = ''
-        calculated_size_bytes = None
-        if os.getenv('GCLIENT_TEST') == '1':
-            calculated_sha256sum = 'abcd123'
-            calculated_size_bytes = 10000
-        else:
-            calculated_sha256sum = (
-                upload_to_google_storage_first_class.get_sha256sum(
-                    self.artifact_output_file))
-            calculated_size_bytes = os.path.getsize(self.artifact_output_file)
-
-        if calculated_sha256sum != self.sha256sum:
-            raise Exception('sha256sum does not match calculated hash. '
-                            '{original} vs {calculated}'.format(
-                                original=self.sha256sum,
-                                calculated=calculated_sha256sum,
-                            ))
-
-        if calculated_size_bytes != self.size_bytes:
-            raise Exception('size_bytes does not match calculated size bytes. '
-                            '{original} vs {calculated}'.format(
-                                original=self.size_bytes,
-                                calculated=calculated_size_bytes,
-                            ))
-
-        if tarfile.is_tarfile(self.artifact_output_file):
-            with tarfile.open(self.artifact_output_file, 'r:*') as tar:
-                formatted_names = []
-                for name in tar.getnames():
-                    if name.startswith('./') and len(name) > 2:
-                        formatted_names.append(name[2:])
-                    else:
-                        formatted_names.append(name)
-                possible_top_level_dirs = set(
-                    name.split('/')[0] for name in formatted_names)
-                is_valid_tar = self.ValidateTarFile(tar,
-                                                    possible_top_level_dirs)
-                if not is_valid_tar:
-                    raise Exception('tarfile contains invalid entries')
+                    'size_bytes does not match calculated size bytes. '
+                    '{original} vs {calculated}'.format(
+                        original=self.size_bytes,
+                        calculated=calculated_size_bytes,
+                    ))
 
+            if members is not None:
                 tar_content_file = os.path.join(
                     self.output_dir, f'.{self.file_prefix}_content_names')
-                self.WriteToFile(json.dumps(tar.getnames()), tar_content_file)
-
-                tar.extractall(path=self.output_dir)
+                self.WriteToFile(
+                    json.dumps([tarinfo.name for tarinfo in members]),
+                    tar_content_file)
+                _MoveTree(extract_dir, self.output_dir)
+                self._SetDirectoryAttributes(
+                    [tarinfo for tarinfo in members if tarinfo.isdir()])
+        finally:
+            gclient_utils.rmtree(extract_dir)
 
-        if os.getenv('GCLIENT_TEST') != '1':
+        if executable is None:
             code, err = download_from_google_storage.set_executable_bit(
-                self.artifact_output_file, self.url, gsutil)
+                self.artifact_output_file, self.url,
+                download_from_google_storage.Gsutil(
+                    download_from_google_storage.GSUTIL_DEFAULT_PATH))
             if code != 0:
                 raise Exception(f'{code}: {err}')
+        elif executable or sys.platform == 'cygwin':
+            st = os.stat(self.artifact_output_file)
+            os.chmod(self.artifact_output_file, st.st_mode | stat.S_IEXEC)
 
         self.WriteToFile(calculated_sha256sum, self.hash_file)
         self.WriteToFile(str(1), self.migration_toggle_file)
@@ -3537,6 +4314,12 @@ def _HooksToLines(name, hooks):
             s.append('    "pattern": "%s",' % hook.pattern)
         if hook.condition is not None:
             s.append('    "condition": %r,' % hook.condition)
+        if hook.requires is not None:
+            s.append('    "requires": %r,' % list(hook.requires))
+        if hook.inputs is not None:
+            s.append('    "inputs": %r,' % list(hook.inputs))
+        if hook.input_vars is not None:
+            s.append('    "input_vars": %r,' % list(hook.input_vars))
         # Flattened hooks need to be written relative to the root gclient dir
         cwd = os.path.relpath(os.path.normpath(hook.effective_cwd))
         s.extend(['    "cwd": "%s",' % cwd] + ['    "action": ['] +
@@ -3564,6 +4347,12 @@ def _HooksOsToLines(hooks_os):
                 s.append('      "pattern": "%s",' % hook.pattern)
             if hook.condition is not None:
                 s.append('    "condition": %r,' % hook.condition)
+            if hook.requires is not None:
+                s.append('      "requires": %r,' % list(hook.requires))
+            if hook.inputs is not None:
+                s.append('      "inputs": %r,' % list(hook.inputs))
+            if hook.input_vars is not None:
+                s.append('      "input_vars": %r,' % list(hook.input_vars))
             # Flattened hooks need to be written relative to the root gclient
             # dir
             cwd = os.path.relpath(os.path.normpath(hook.effective_cwd))
@@ -3964,6 +4753,21 @@ def CMDsync(parser, args):
                       dest='experiments',
                       default=[],
                       help='Which experiments should be enabled.')
+    parser.add_option('--timing-report',
+                      action='store_true',
+                      help='Print the chain of dependencies that took the '
+                      'longest to sync once the sync is done.')
+    parser.add_option('--verify-fast-path',
+                      action='store_true',
+                      help='Debug option. Sync dependencies that are unchanged '
+                      'since the last sync anyway, and fail if syncing them '
+                      'changed their checkout. Use --force to sync all '
+                      'dependencies without checking.')
+    parser.add_option('--trace-output',
+                      metavar='PATH',
+                      help='Write a trace of the sync to this path in the '
+                      'Chrome trace event format, for chrome://tracing or '
+                      'https://ui.perfetto.dev.')
     (options, args) = parser.parse_args(args)
     client = GClient.LoadCurrentConfig(options)
 
@@ -4000,10 +4804,16 @@ def CMDsync(parser, args):
                                'src/buildtools/linux64/gn')
         return os.path.exists(gn_path)
 
-    if gclient_utils.IsEnvCog() and gn_exists():
-        ret = client.RunOnDeps('runhooks', args)
-    else:
-        ret = client.RunOnDeps('update', args)
+    if options.trace_output:
+        gclient_utils.StartTracing()
+    try:
+        if gclient_utils.IsEnvCog() and gn_exists():
+            ret = client.RunOnDeps('runhooks', args)
+        else:
+            ret = client.RunOnDeps('update', args)
+    finally:
+        if options.trace_output:
+            gclient_utils.StopTracing().write(options.trace_output)
     if options.output_json:
         slns = {}
         for d in client.subtree(True):
@@ -4120,8 +4930,8 @@ def CMDrunhooks(parser, args):
     parser.add_option('-f',
                       '--force',
                       action='store_true',
-                      default=True,
-                      help='Deprecated. No effect.')
+                      help='Run hooks that declare their inputs even if the '
+                      'inputs did not change since they last ran.')
     (options, args) = parser.parse_args(args)
     client = GClient.LoadCurrentConfig(options)
     if not client:
@@ -4129,6 +4939,7 @@ def CMDrunhooks(parser, args):
             'client not configured; see \'gclient config\'')
     if options.verbose:
         client.PrintLocationAndContents()
+    options.force_hooks = options.force
     options.force = True
     options.nohooks = False
     return client.RunOnDeps('runhooks', args)
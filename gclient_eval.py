@@ -4,9 +4,14 @@
 
 import ast
 import collections
+import hashlib
 from io import StringIO
+import json
 import logging
+import os
 import sys
+import tempfile
+import threading
 import tokenize
 
 import gclient_utils
@@ -45,9 +50,29 @@ class ConstantString(object):
 
 class _NodeDict(collections.abc.MutableMapping):
     """Dict-like type that also stores information on AST nodes and tokens."""
-    def __init__(self, data=None, tokens=None):
+
+    def __init__(self, data=None, tokens=None, content=None):
         self.data = collections.OrderedDict(data or [])
-        self.tokens = tokens
+        self._tokens = tokens
+        # Tokenizing is only needed to edit the DEPS file, so it is done the
+        # first time the tokens are used.
+        self._content = content
+
+    @property
+    def tokens(self):
+        if self._tokens is None and self._content is not None:
+            self._tokens = {
+                token[2]: list(token)
+                for token in tokenize.generate_tokens(
+                    StringIO(self._content).readline)
+            }
+            self._content = None
+        return self._tokens
+
+    @tokens.setter
+    def tokens(self, tokens):
+        self._tokens = tokens
+        self._content = None
 
     def __str__(self):
         return str({k: v[0] for k, v in self.data.items()})
@@ -92,13 +117,15 @@ class _NodeDict(collections.abc.MutableMapping):
         self.data[key] = (value, node)
 
 
-def _NodeDictSchema(dict_schema):
+class _NodeDictSchema(object):
     """Validate dict_schema after converting _NodeDict to a regular dict."""
-    def validate(d):
-        schema.Schema(dict_schema).validate(dict(d))
-        return True
 
-    return validate
+    def __init__(self, dict_schema):
+        self.dict_schema = dict_schema
+
+    def __call__(self, d):
+        schema.Schema(self.dict_schema).validate(dict(d))
+        return True
 
 
 # See https://github.com/keleshev/schema for docs how to configure schema.
@@ -184,6 +211,18 @@ _GCLIENT_HOOKS_SCHEMA = [
         # if the condition evaluates to True.
         schema.Optional('condition'):
         str,
+
+        # Names of the hooks this hook must run after. By default, a hook runs
+        # after the previous hook of its DEPS file; hooks of different DEPS
+        # files can run in parallel.
+        schema.Optional('requires'): [str],
+
+        # Files (relative to the hook's working directory) and variables the
+        # hook depends on. A hook declaring its inputs is skipped when its
+        # action, inputs and condition variables did not change since it last
+        # ran successfully.
+        schema.Optional('inputs'): [str],
+        schema.Optional('input_vars'): [str],
     })
 ]
 
@@ -303,8 +342,141 @@ _GCLIENT_SCHEMA = schema.Schema(
     }))
 
 
-def _gclient_eval(node_or_string, filename='<unknown>', vars_dict=None):
-    """Safely evaluates a single expression. Returns the result."""
+class _SchemaMismatch(Exception):
+    """Raised when a DEPS file doesn't match _GCLIENT_CHECK."""
+
+
+class _TypeCheck(object):
+    def __init__(self, types):
+        self.types = types
+
+    def Matches(self, value):
+        return isinstance(value, self.types)
+
+    def __repr__(self):
+        return self.types.__name__
+
+
+class _ValueCheck(object):
+    def __init__(self, value):
+        self.value = value
+
+    def Matches(self, value):
+        return self.value == value
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+class _OrCheck(object):
+    def __init__(self, checks):
+        self.checks = checks
+
+    def Matches(self, value):
+        return any(check.Matches(value) for check in self.checks)
+
+    def __repr__(self):
+        return ' or '.join(map(repr, self.checks))
+
+
+class _SequenceCheck(object):
+    def __init__(self, sequence_type, item_check):
+        self.sequence_type = sequence_type
+        self.item_check = item_check
+
+    def Matches(self, value):
+        return (isinstance(value, self.sequence_type)
+                and all(self.item_check.Matches(item) for item in value))
+
+    def __repr__(self):
+        return '%s of %r' % (self.sequence_type.__name__, self.item_check)
+
+
+class _DictCheck(object):
+    def __init__(self, value_checks, typed_value_checks, required):
+        # Checks for the values of specific keys, and for the values of any
+        # key of a given type.
+        self.value_checks = value_checks
+        self.typed_value_checks = typed_value_checks
+        self.required = required
+
+    def ValueCheck(self, key):
+        """Returns the check for the value of |key|, or None if not allowed."""
+        try:
+            return self.value_checks[key]
+        except (KeyError, TypeError):
+            pass
+        for key_type, check in self.typed_value_checks:
+            if isinstance(key, key_type):
+                return check
+        return None
+
+    def Matches(self, value):
+        if not isinstance(value, collections.abc.Mapping):
+            return False
+        for key, item in value.items():
+            check = self.ValueCheck(key)
+            if check is None or not check.Matches(item):
+                return False
+        return self.required.issubset(value)
+
+    def __repr__(self):
+        return 'dict with keys %s' % ', '.join(
+            sorted(map(repr, self.value_checks)) +
+            [t.__name__ for t, _ in self.typed_value_checks])
+
+
+def _CompileSchema(s):
+    """Compiles the subset of schema used by _GCLIENT_SCHEMA into checks.
+
+    The checks accept the same values as the schema, but are much cheaper to
+    run and can be applied while the DEPS file is evaluated.
+    """
+    if isinstance(s, (schema.Optional, schema.Schema)):
+        return _CompileSchema(s._schema)
+    if isinstance(s, schema.Or):
+        checks = [_CompileSchema(arg) for arg in s._args]
+        return checks[0] if len(checks) == 1 else _OrCheck(checks)
+    if isinstance(s, _NodeDictSchema):
+        value_checks = {}
+        typed_value_checks = []
+        required = set()
+        for key, value in s.dict_schema.items():
+            check = _CompileSchema(value)
+            if isinstance(key, schema.Optional):
+                key = key._schema
+            else:
+                required.add(key)
+            if isinstance(key, type):
+                typed_value_checks.append((key, check))
+            else:
+                value_checks[key] = check
+        return _DictCheck(value_checks, typed_value_checks, required)
+    if type(s) in (list, tuple):
+        checks = [_CompileSchema(item) for item in s]
+        return _SequenceCheck(
+            type(s), checks[0] if len(checks) == 1 else _OrCheck(checks))
+    if isinstance(s, type):
+        return _TypeCheck(s)
+    if s is None or isinstance(s, (str, int)):
+        return _ValueCheck(s)
+    raise TypeError('unsupported schema: %r' % (s, ))
+
+
+_GCLIENT_CHECK = _CompileSchema(_GCLIENT_SCHEMA)
+
+
+def _gclient_eval(node_or_string,
+                  filename='<unknown>',
+                  vars_dict=None,
+                  check=None,
+                  name=None):
+    """Safely evaluates a single expression. Returns the result.
+
+    If |check| is given, the result is validated against it as it is built,
+    raising _SchemaMismatch if it doesn't match. |name| is used to refer to
+    the result in error messages.
+    """
     _allowed_names = {'None': None, 'True': True, 'False': False}
     if isinstance(node_or_string, ConstantString):
         return node_or_string.value
@@ -320,7 +492,7 @@ def _gclient_eval(node_or_string, filename='<unknown>', vars_dict=None):
             if vars_dict is None:
                 return node.s
             try:
-                return node.s.format(**vars_dict)
+                return node.s.format_map(vars_dict)
             except KeyError as e:
                 raise KeyError(
                     '%s was used as a variable, but was not declared in the vars dict '
@@ -333,16 +505,7 @@ def _gclient_eval(node_or_string, filename='<unknown>', vars_dict=None):
         elif isinstance(node, ast.List):
             return list(map(_convert, node.elts))
         elif isinstance(node, ast.Dict):
-            node_dict = _NodeDict()
-            for key_node, value_node in zip(node.keys, node.values):
-                key = _convert(key_node)
-                if key in node_dict:
-                    raise ValueError(
-                        'duplicate key in dictionary: %s (file %r, line %s)' %
-                        (key, filename, getattr(key_node, 'lineno',
-                                                '<unknown>')))
-                node_dict.SetNode(key, _convert(value_node), value_node)
-            return node_dict
+            return _convert_dict(node)
         elif isinstance(node, ast.Name):
             if node.id not in _allowed_names:
                 raise ValueError(
@@ -397,7 +560,53 @@ def _gclient_eval(node_or_string, filename='<unknown>', vars_dict=None):
                              (node, ast.dump(node), filename,
                               getattr(node, 'lineno', '<unknown>')))
 
-    return _convert(node_or_string)
+    def _convert_dict(node, check=None, path=None):
+        node_dict = _NodeDict()
+        for key_node, value_node in zip(node.keys, node.values):
+            key = _convert(key_node)
+            if key in node_dict:
+                raise ValueError(
+                    'duplicate key in dictionary: %s (file %r, line %s)' %
+                    (key, filename, getattr(key_node, 'lineno', '<unknown>')))
+            if check is None:
+                value = _convert(value_node)
+            else:
+                value_check = check.ValueCheck(key)
+                if value_check is None:
+                    raise _SchemaMismatch(
+                        'unexpected key %r in %s (file %r, line %s)' %
+                        (key, path, filename,
+                         getattr(key_node, 'lineno', '<unknown>')))
+                value = _convert_checked(value_node, value_check,
+                                         '%s[%r]' % (path, key))
+            node_dict.SetNode(key, value, value_node)
+        if check is not None and not check.required.issubset(node_dict):
+            raise _SchemaMismatch(
+                'missing keys %s in %s (file %r, line %s)' %
+                (', '.join(sorted(map(repr, check.required - set(node_dict)))),
+                 path, filename, getattr(node, 'lineno', '<unknown>')))
+        return node_dict
+
+    def _convert_checked(node, check, path):
+        if isinstance(node, ast.Dict) and isinstance(check, _DictCheck):
+            return _convert_dict(node, check, path)
+        if (isinstance(node, ast.List) and isinstance(check, _SequenceCheck)
+                and check.sequence_type is list):
+            return [
+                _convert_checked(item, check.item_check, '%s[%d]' % (path, i))
+                for i, item in enumerate(node.elts)
+            ]
+        value = _convert(node)
+        if not check.Matches(value):
+            raise _SchemaMismatch(
+                'invalid value for %s: %r should be %r (file %r, line %s)' %
+                (path, value, check, filename,
+                 getattr(node, 'lineno', '<unknown>')))
+        return value
+
+    if check is None:
+        return _convert(node_or_string)
+    return _convert_checked(node_or_string, check, name)
 
 
 def Exec(content, filename='<unknown>', vars_override=None, builtin_vars=None):
@@ -437,12 +646,7 @@ def Exec(content, filename='<unknown>', vars_override=None, builtin_vars=None):
         _validate_statement(statement, statements)
         statements[statement.targets[0].id] = statement.value
 
-    tokens = {
-        token[2]: list(token)
-        for token in tokenize.generate_tokens(StringIO(content).readline)
-    }
-
-    local_scope = _NodeDict({}, tokens)
+    local_scope = _NodeDict({}, content=content)
 
     # Process vars first, so we can expand variables in the rest of the DEPS
     # file.
@@ -463,14 +667,34 @@ def Exec(content, filename='<unknown>', vars_override=None, builtin_vars=None):
             {k: v
              for k, v in vars_override.items() if k in vars_dict})
 
-    for name, node in statements.items():
-        value = _gclient_eval(node, filename, vars_dict)
-        local_scope.SetNode(name, value, node)
+    def _eval_statements(checked):
+        for name, node in statements.items():
+            check = None
+            if checked:
+                check = _GCLIENT_CHECK.ValueCheck(name)
+                if check is None:
+                    raise _SchemaMismatch(
+                        'unexpected variable %r (file %r, line %s)' %
+                        (name, filename, getattr(node, 'lineno', '<unknown>')))
+            value = _gclient_eval(node, filename, vars_dict, check, name)
+            local_scope.SetNode(name, value, node)
 
     try:
-        return _GCLIENT_SCHEMA.validate(local_scope)
-    except schema.SchemaError as e:
-        raise gclient_utils.Error(str(e))
+        _eval_statements(checked=True)
+    except _SchemaMismatch as e:
+        # Validate the whole file against the schema for a detailed error.
+        # The compiled checks must never be stricter than the schema, so the
+        # file is accepted if the schema accepts it.
+        _eval_statements(checked=False)
+        try:
+            _GCLIENT_SCHEMA.validate(local_scope)
+        except schema.SchemaError as schema_error:
+            raise gclient_utils.Error(str(schema_error))
+        logging.debug(
+            '%s matches the DEPS schema but not its compiled '
+            'checks: %s', filename, e)
+
+    return local_scope
 
 
 def _StandardizeDeps(deps_dict, vars_dict):
@@ -483,7 +707,7 @@ def _StandardizeDeps(deps_dict, vars_dict):
     """
     new_deps_dict = {}
     for dep_name, dep_info in deps_dict.items():
-        dep_name = dep_name.format(**vars_dict)
+        dep_name = dep_name.format_map(vars_dict)
         if not isinstance(dep_info, collections.abc.Mapping):
             dep_info = {'url': dep_info}
         dep_info.setdefault('dep_type', 'git')
@@ -540,6 +764,15 @@ def UpdateCondition(info_dict, op, new_condition):
         del info_dict['condition']
 
 
+def GetConditionVariables(condition):
+    """Returns the names of the variables used in |condition|."""
+    return {
+        node.id
+        for node in ast.walk(ast.parse(condition, mode='eval'))
+        if isinstance(node, ast.Name) and node.id not in ('True', 'False')
+    }
+
+
 def Parse(content, filename, vars_override=None, builtin_vars=None):
     """Parses DEPS strings.
 
@@ -584,106 +817,252 @@ def Parse(content, filename, vars_override=None, builtin_vars=None):
     return result
 
 
-def EvaluateCondition(condition, variables, referenced_variables=None):
-    """Safely evaluates a boolean condition. Returns the result."""
-    if not referenced_variables:
-        referenced_variables = set()
+class ParseCache(object):
+    """On-disk cache of Parse() results.
+
+    Entries are keyed by the git blob id of the DEPS content, the variables
+    used to parse it and the version of this parser, so a cached result is only
+    returned for an identical Parse() call.
+
+    Results are returned with plain dicts in place of _NodeDict, whether they
+    come from the cache or not, so they can't be used to edit the DEPS file.
+    """
+
+    _TUPLE = '$tuple'
+    _STR = '$Str'
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        # Keys of the entries used by this process.
+        self.used = set()
+        self._lock = threading.Lock()
+        with open(__file__, 'rb') as f:
+            self._parser_fingerprint = hashlib.sha1(f.read()).hexdigest()
+
+    def _Key(self, content, vars_override, builtin_vars):
+        content = content.encode('utf-8')
+        blob_id = hashlib.sha1(b'blob %d\0' % len(content) + content)
+        key = hashlib.sha256()
+        for part in (self._parser_fingerprint, blob_id.hexdigest(),
+                     sorted((vars_override or {}).items()),
+                     sorted((builtin_vars or {}).items())):
+            key.update(repr(part).encode('utf-8'))
+            key.update(b'\0')
+        return key.hexdigest()
+
+    @classmethod
+    def _Encode(cls, value):
+        if isinstance(value, collections.abc.Mapping):
+            return {k: cls._Encode(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [cls._Encode(v) for v in value]
+        if isinstance(value, tuple):
+            return {cls._TUPLE: [cls._Encode(v) for v in value]}
+        if isinstance(value, ConstantString):
+            return {cls._STR: value.value}
+        return value
+
+    @classmethod
+    def _Decode(cls, value):
+        if len(value) == 1 and cls._TUPLE in value:
+            return tuple(value[cls._TUPLE])
+        if len(value) == 1 and cls._STR in value:
+            return ConstantString(value[cls._STR])
+        return value
+
+    def _Load(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f, object_hook=self._Decode)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _Save(self, path, content):
+        with self._lock:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            os.replace(tmp, path)
+        except (IOError, OSError) as e:
+            logging.warning('Failed to write %s: %s', path, e)
+            gclient_utils.rm_file_or_tree(tmp)
+
+    def Parse(self, content, filename, vars_override=None, builtin_vars=None):
+        """Same as Parse(), using the cached result when there is one."""
+        key = self._Key(content, vars_override, builtin_vars)
+        path = os.path.join(self.cache_dir, key + '.json')
+        with self._lock:
+            self.used.add(key)
+        result = self._Load(path)
+        if result is not None:
+            logging.info('ParseCache: using cached result for %s', filename)
+            return result
+        encoded = json.dumps(
+            self._Encode(Parse(content, filename, vars_override, builtin_vars)))
+        self._Save(path, encoded)
+        return json.loads(encoded, object_hook=self._Decode)
+
+    def Prune(self):
+        """Removes the entries not used by this process."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if os.path.splitext(name)[0] not in self.used:
+                gclient_utils.rm_file_or_tree(os.path.join(
+                    self.cache_dir, name))
+
+
+# Conditions compiled by _CompileCondition, keyed by the condition string.
+_COMPILED_CONDITIONS = {}
+
+
+def _CompileCondition(condition):
+    """Compiles a condition string into a function evaluating it.
+
+    The function takes the variables and the set of variables being evaluated
+    (to detect cycles). Conditions are only parsed once per process.
+    """
+    compiled = _COMPILED_CONDITIONS.get(condition)
+    if compiled is not None:
+        return compiled
+
     _allowed_names = {'None': None, 'True': True, 'False': False}
     main_node = ast.parse(condition, mode='eval')
     if isinstance(main_node, ast.Expression):
         main_node = main_node.body
 
-    def _convert(node, allow_tuple=False):
+    def _compile(node, allow_tuple=False):
         if isinstance(node, ast.Str):
-            return node.s
+            value = node.s
+            return lambda variables, referenced_variables: value
 
         if isinstance(node, ast.Tuple) and allow_tuple:
-            return tuple(map(_convert, node.elts))
+            elts = [_compile(elt) for elt in node.elts]
+            return lambda variables, referenced_variables: tuple(
+                elt(variables, referenced_variables) for elt in elts)
 
         if isinstance(node, ast.Name):
-            if node.id in referenced_variables:
-                raise ValueError('invalid cyclic reference to %r (inside %r)' %
-                                 (node.id, condition))
+            name = node.id
+
+            def _name(variables, referenced_variables):
+                if name in referenced_variables:
+                    raise ValueError(
+                        'invalid cyclic reference to %r (inside %r)' %
+                        (name, condition))
 
-            if node.id in _allowed_names:
-                return _allowed_names[node.id]
+                if name in _allowed_names:
+                    return _allowed_names[name]
 
-            if node.id in variables:
-                value = variables[node.id]
+                if name in variables:
+                    value = variables[name]
 
-                # Allow using "native" types, without wrapping everything in
-                # strings. Note that schema constraints still apply to
-                # variables.
-                if not isinstance(value, str):
-                    return value
+                    # Allow using "native" types, without wrapping everything
+                    # in strings. Note that schema constraints still apply to
+                    # variables.
+                    if not isinstance(value, str):
+                        return value
 
-                # Recursively evaluate the variable reference.
-                return EvaluateCondition(variables[node.id], variables,
-                                         referenced_variables.union([node.id]))
+                    # Recursively evaluate the variable reference.
+                    return EvaluateCondition(value, variables,
+                                             referenced_variables.union([name]))
 
-            # Implicitly convert unrecognized names to strings.
-            # If we want to change this, we'll need to explicitly distinguish
-            # between arguments for GN to be passed verbatim, and ones to
-            # be evaluated.
-            return node.id
+                # Implicitly convert unrecognized names to strings.
+                # If we want to change this, we'll need to explicitly
+                # distinguish between arguments for GN to be passed verbatim,
+                # and ones to be evaluated.
+                return name
+
+            return _name
 
         if not sys.version_info[:2] < (3, 4) and isinstance(
                 node, ast.NameConstant):  # Since Python 3.4
-            return node.value
-
-        if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.Or):
-            bool_values = []
-            for value in node.values:
-                bool_values.append(_convert(value))
-                if not isinstance(bool_values[-1], bool):
-                    raise ValueError('invalid "or" operand %r (inside %r)' %
-                                     (bool_values[-1], condition))
-            return any(bool_values)
-
-        if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
-            bool_values = []
-            for value in node.values:
-                bool_values.append(_convert(value))
-                if not isinstance(bool_values[-1], bool):
-                    raise ValueError('invalid "and" operand %r (inside %r)' %
-                                     (bool_values[-1], condition))
-            return all(bool_values)
+            value = node.value
+            return lambda variables, referenced_variables: value
+
+        if isinstance(node, ast.BoolOp) and isinstance(node.op,
+                                                       (ast.Or, ast.And)):
+            op_name, combine = (('or', any) if isinstance(node.op, ast.Or) else
+                                ('and', all))
+            values = [_compile(value) for value in node.values]
+
+            def _bool_op(variables, referenced_variables):
+                bool_values = []
+                for value in values:
+                    bool_values.append(value(variables, referenced_variables))
+                    if not isinstance(bool_values[-1], bool):
+                        raise ValueError('invalid "%s" operand %r (inside %r)' %
+                                         (op_name, bool_values[-1], condition))
+                return combine(bool_values)
+
+            return _bool_op
 
         if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
-            value = _convert(node.operand)
-            if not isinstance(value, bool):
-                raise ValueError('invalid "not" operand %r (inside %r)' %
-                                 (value, condition))
-            return not value
+            operand = _compile(node.operand)
+
+            def _not(variables, referenced_variables):
+                value = operand(variables, referenced_variables)
+                if not isinstance(value, bool):
+                    raise ValueError('invalid "not" operand %r (inside %r)' %
+                                     (value, condition))
+                return not value
+
+            return _not
 
         if isinstance(node, ast.Compare):
             if len(node.ops) != 1:
-                raise ValueError(
-                    'invalid compare: exactly 1 operator required (inside %r)' %
-                    (condition))
+                return _raise(
+                    ValueError('invalid compare: exactly 1 operator required '
+                               '(inside %r)' % (condition)))
             if len(node.comparators) != 1:
-                raise ValueError(
-                    'invalid compare: exactly 1 comparator required (inside %r)'
-                    % (condition))
+                return _raise(
+                    ValueError('invalid compare: exactly 1 comparator required '
+                               '(inside %r)' % (condition)))
 
-            left = _convert(node.left)
-            right = _convert(node.comparators[0],
+            left = _compile(node.left)
+            right = _compile(node.comparators[0],
                              allow_tuple=isinstance(node.ops[0], ast.In))
+            op = node.ops[0]
+            error = ValueError('unexpected operator: %s %s (inside %r)' %
+                               (op, ast.dump(node), condition))
+
+            def _compare(variables, referenced_variables):
+                left_value = left(variables, referenced_variables)
+                right_value = right(variables, referenced_variables)
+                if isinstance(op, ast.Eq):
+                    return left_value == right_value
+                if isinstance(op, ast.NotEq):
+                    return left_value != right_value
+                if isinstance(op, ast.In):
+                    return left_value in right_value
+                raise error
+
+            return _compare
+
+        return _raise(
+            ValueError('unexpected AST node: %s %s (inside %r)' %
+                       (node, ast.dump(node), condition)))
+
+    def _raise(error):
+        # Errors are raised when the condition is evaluated, like they would be
+        # if it wasn't compiled.
+        def _error(variables, referenced_variables):
+            raise error
 
-            if isinstance(node.ops[0], ast.Eq):
-                return left == right
-            if isinstance(node.ops[0], ast.NotEq):
-                return left != right
-            if isinstance(node.ops[0], ast.In):
-                return left in right
+        return _error
 
-            raise ValueError('unexpected operator: %s %s (inside %r)' %
-                             (node.ops[0], ast.dump(node), condition))
+    compiled = _compile(main_node)
+    _COMPILED_CONDITIONS[condition] = compiled
+    return compiled
 
-        raise ValueError('unexpected AST node: %s %s (inside %r)' %
-                         (node, ast.dump(node), condition))
 
-    return _convert(main_node)
+def EvaluateCondition(condition, variables, referenced_variables=None):
+    """Safely evaluates a boolean condition. Returns the result."""
+    if not referenced_variables:
+        referenced_variables = set()
+    return _CompileCondition(condition)(variables, referenced_variables)
 
 
 def RenderDEPSFile(gclient_dict):
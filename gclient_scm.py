@@ -7,6 +7,7 @@ import collections
 import contextlib
 import errno
 import glob
+import hashlib
 import json
 import logging
 import os
@@ -214,6 +215,19 @@ class GitWrapper(SCMWrapper):
     name = 'git'
     remote = 'origin'
 
+    # How checkouts use the git cache: 'alternates' borrows the objects of the
+    # mirror, 'copy' makes each checkout self-contained.
+    CACHE_MODES = ('alternates', 'copy')
+    cache_mode = 'alternates'
+
+    @classmethod
+    def SetCacheMode(cls, cache_mode):
+        if cache_mode not in cls.CACHE_MODES:
+            raise gclient_utils.Error(
+                'Invalid cache_mode %r, expected one of %s' %
+                (cache_mode, ', '.join(cls.CACHE_MODES)))
+        cls.cache_mode = cache_mode
+
     @property
     def cache_dir(self):
         try:
@@ -237,6 +251,70 @@ class GitWrapper(SCMWrapper):
     def GetCheckoutRoot(self):
         return scm.GIT.GetCheckoutRoot(self.checkout_path)
 
+    def _GetGitDir(self):
+        """Returns the .git directory of the checkout without running git."""
+        git_dir = os.path.join(self.checkout_path, '.git')
+        if os.path.isfile(git_dir):
+            # Worktrees and submodules point to their git directory.
+            with open(git_dir) as f:
+                content = f.read().strip()
+            if not content.startswith('gitdir:'):
+                return None
+            git_dir = os.path.join(self.checkout_path,
+                                   content[len('gitdir:'):].strip())
+        return git_dir
+
+    def GetSyncFingerprint(self, options):
+        """Returns the state update() depends on for a pinned dependency.
+
+        The fingerprint covers the resolved revision, HEAD, the index and
+        config mtimes, the remote URL and how the checkout uses the git cache,
+        and is read from the filesystem without running git. Returns None if
+        update() can't be skipped based on it, e.g. when the revision isn't a
+        full hash, HEAD is on a branch that may have moved, update() was asked
+        to change the checkout, or update() would stop borrowing objects from
+        the git cache.
+        """
+        url, revision = gclient_utils.SplitUrlRevision(self.url)
+        if options.revision:
+            revision = str(options.revision)
+        if not revision or not gclient_utils.IsFullGitSha(revision):
+            return None
+        if (options.force or options.reset or options.upstream
+                or options.delete_unversioned_trees):
+            return None
+        try:
+            git_dir = self._GetGitDir()
+            if not git_dir:
+                return None
+            with open(os.path.join(git_dir, 'HEAD')) as f:
+                head = f.read().strip()
+            index_mtime = os.stat(os.path.join(git_dir, 'index')).st_mtime_ns
+            config_mtime = os.stat(os.path.join(git_dir, 'config')).st_mtime_ns
+        except (IOError, OSError):
+            return None
+        # gclient leaves HEAD detached. A branch can move without HEAD itself
+        # changing.
+        if head.startswith('ref:'):
+            return None
+        alternates = self._GetAlternates()
+        if alternates and (self.cache_mode != 'alternates'
+                           or not all(os.path.isdir(a) for a in alternates)):
+            return None
+        return {
+            'url': url,
+            'revision': revision,
+            'head': head,
+            'index_mtime': index_mtime,
+            'config_mtime': config_mtime,
+            'cache_mode': self.cache_mode,
+            'alternates': alternates,
+            'with_branch_heads':
+            bool(getattr(options, 'with_branch_heads', False)),
+            'with_tags': bool(getattr(options, 'with_tags', False)),
+            'no_history': bool(getattr(options, 'no_history', False)),
+        }
+
     def GetRevisionDate(self, _revision):
         """Returns the given revision's date in ISO-8601 format (which contains the
     time zone)."""
@@ -822,6 +900,17 @@ class GitWrapper(SCMWrapper):
             # Reset to a clean state
             self._Scrub('HEAD', options)
 
+        # A checkout that borrows objects from a mirror that has since been
+        # deleted is broken; move it out of the way and clone it again.
+        missing_alternates = [
+            a for a in self._GetAlternates() if not os.path.isdir(a)
+        ]
+        if missing_alternates:
+            self.Print(
+                '_____ %s uses objects from %s, which no longer exists.' %
+                (self.relpath, ', '.join(missing_alternates)))
+            self._DeleteOrMove(options.force)
+
         if (not os.path.exists(self.checkout_path) or
             (os.path.isdir(self.checkout_path)
              and not os.path.exists(os.path.join(self.checkout_path, '.git')))):
@@ -851,6 +940,9 @@ class GitWrapper(SCMWrapper):
         if mirror:
             self._Capture(['remote', 'set-url', '--push', 'origin', mirror.url])
 
+        if self.cache_mode == 'copy' and self._GetAlternates():
+            self._Dissociate(options)
+
         if not managed:
             self._SetFetchConfig(options)
             self.Print('________ unmanaged solution; skipping %s' %
@@ -1321,6 +1413,7 @@ class GitWrapper(SCMWrapper):
             mirror_kwargs['commits'].append(revision)
         return git_cache.Mirror(url, **mirror_kwargs)
 
+    @gclient_utils.TraceSpan('mirror', 'phase')
     def _UpdateMirrorIfNotContains(self, mirror, options, rev_type, revision):
         """Update a git mirror by fetching the latest commits from the remote,
     unless mirror already contains revision whose type is sha1 hash.
@@ -1341,6 +1434,7 @@ class GitWrapper(SCMWrapper):
                         depth=depth,
                         lock_timeout=getattr(options, 'lock_timeout', 0))
 
+    @gclient_utils.TraceSpan('clone', 'phase')
     def _Clone(self, revision, url, options):
         """Clone a git repository from the given URL.
 
@@ -1380,7 +1474,7 @@ class GitWrapper(SCMWrapper):
         else:
             cfg = gclient_utils.DefaultIndexPackConfig(url)
             clone_cmd = cfg + ['clone', '--no-checkout', '--progress']
-            if self.cache_dir:
+            if self.cache_dir and self.cache_mode == 'alternates':
                 clone_cmd.append('--shared')
             if options.verbose:
                 clone_cmd.append('--verbose')
@@ -1426,6 +1520,29 @@ class GitWrapper(SCMWrapper):
                 'create a new branch for your work.') % (revision, self.remote))
         return revision
 
+    def _GetAlternates(self):
+        """Returns the object directories the checkout borrows objects from."""
+        objects = os.path.join(self.checkout_path, '.git', 'objects')
+        try:
+            content = gclient_utils.FileRead(
+                os.path.join(objects, 'info', 'alternates'))
+        except (IOError, OSError):
+            return []
+        # Relative paths are relative to the objects directory.
+        return [
+            os.path.join(objects, line.strip())
+            for line in content.splitlines() if line.strip()
+        ]
+
+    def _Dissociate(self, options):
+        """Copies the borrowed objects into the checkout and stops borrowing."""
+        self.Print('_____ copying objects from the git cache into %s' %
+                   self.relpath)
+        self._Run(['repack', '-a', '-d', '-q'], options)
+        os.remove(
+            os.path.join(self.checkout_path, '.git', 'objects', 'info',
+                         'alternates'))
+
     def _AskForData(self, prompt, options):
         if options.jobs > 1:
             self.Print(prompt)
@@ -1434,6 +1551,7 @@ class GitWrapper(SCMWrapper):
                                       "interaction is possible.")
         return gclient_utils.AskForData(prompt)
 
+    @gclient_utils.TraceSpan('rebase', 'phase')
     def _AttemptRebase(self,
                        upstream,
                        files,
@@ -1625,12 +1743,18 @@ class GitWrapper(SCMWrapper):
                 'GIT_DIR',
                 os.path.abspath(os.path.join(self.checkout_path, '.git')))
         kwargs.setdefault('env', env)
-        ret = git_common.run(*args, **kwargs)
+        cmd = ['git'] + list(args)
+        with gclient_utils.TraceSpan(gclient_utils.TraceCommandName(cmd),
+                                     'git',
+                                     argv=cmd,
+                                     cwd=kwargs['cwd']):
+            ret = git_common.run(*args, **kwargs)
         if strip:
             ret = ret.strip()
         self.Print('Finished running: %s %s' % ('git', ' '.join(args)))
         return ret
 
+    @gclient_utils.TraceSpan('checkout', 'phase')
     def _Checkout(self, options, ref, force=False, quiet=None):
         """Performs a 'git-checkout' operation.
 
@@ -1651,6 +1775,7 @@ class GitWrapper(SCMWrapper):
         checkout_args.append(ref)
         return self._Capture(checkout_args)
 
+    @gclient_utils.TraceSpan('fetch', 'phase')
     def _Fetch(self,
                options,
                remote=None,
@@ -1738,7 +1863,11 @@ class GitWrapper(SCMWrapper):
         env = scm.GIT.ApplyEnvVars(kwargs)
 
         cmd = ['git'] + args
-        gclient_utils.CheckCallAndFilter(cmd, env=env, **kwargs)
+        with gclient_utils.TraceSpan(gclient_utils.TraceCommandName(cmd),
+                                     'git',
+                                     argv=cmd,
+                                     cwd=kwargs['cwd']):
+            gclient_utils.CheckCallAndFilter(cmd, env=env, **kwargs)
 
 
 class CipdPackage(object):
@@ -1770,8 +1899,36 @@ class CipdPackage(object):
         return self._version
 
 
+# Instance IDs are either hex-encoded SHA1 digests (legacy) or 44 character
+# base64-encoded digests.
+_CIPD_INSTANCE_ID_RE = re.compile(r'^([0-9a-f]{40}|[0-9A-Za-z_-]{44})$')
+
+
+def _IsPinnedCipdVersion(version):
+    """Whether a CIPD version always resolves to the same instance.
+
+    Instance IDs and tags are pinned, while refs (e.g. 'latest') can be moved to
+    another instance at any time.
+    """
+    return ':' in version or bool(_CIPD_INSTANCE_ID_RE.match(version))
+
+
+def _CipdPackageNameMatches(package_name, expanded_name):
+    """Whether |expanded_name| is |package_name| with its variables expanded."""
+    if not expanded_name:
+        return False
+    parts = re.split(r'\$\{[^}]*\}', package_name)
+    pattern = '[^/]*'.join(re.escape(part) for part in parts)
+    return bool(re.fullmatch(pattern, expanded_name))
+
+
 class CipdRoot(object):
     """A representation of a single CIPD root."""
+
+    # File in the root dir recording the packages installed by the last
+    # successful `cipd ensure` and the instances pinned versions resolved to.
+    STATE_FILE = '.gclient_cipd_state'
+
     def __init__(self, root_dir, service_url, log_level=None):
         self._all_packages = set()
         self._mutator_lock = threading.Lock()
@@ -1809,8 +1966,11 @@ class CipdRoot(object):
         return list(self._packages_by_subdir[subdir])
 
     def resolved_packages(self):
+        if not self._resolved_packages:
+            self._resolved_packages = self._read_resolved_packages()
         if not self._resolved_packages:
             self._resolved_packages = self.ensure_file_resolve()
+            self._write_resolved_packages(self._resolved_packages)
         return self._resolved_packages
 
     def clobber(self):
@@ -1826,6 +1986,92 @@ class CipdRoot(object):
             except OSError:
                 if os.path.exists(cipd_cache_dir):
                     raise
+            if os.path.exists(self._state_file):
+                os.remove(self._state_file)
+
+    @property
+    def _state_file(self):
+        return os.path.join(self.root_dir, self.STATE_FILE)
+
+    def _read_state(self):
+        try:
+            with open(self._state_file) as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        return state if isinstance(state, dict) else {}
+
+    def _write_state(self, state):
+        gclient_utils.FileWrite(self._state_file,
+                                json.dumps(state, indent=2, sort_keys=True))
+
+    @staticmethod
+    def _host_platform():
+        return '%s-%s' % (platform.system().lower(), platform.machine().lower())
+
+    def _resolution_key(self, package):
+        return ' '.join((package.name, package.version, self._host_platform()))
+
+    def _sorted_packages_by_subdir(self):
+        return [(subdir, sorted(packages, key=lambda p: p.name))
+                for subdir, packages in sorted(self._packages_by_subdir.items())]
+
+    def _read_resolved_packages(self):
+        """Returns the cached resolution of all packages, or None.
+
+    Only packages with pinned versions are cached, so this is None whenever any
+    package has a ref as its version.
+    """
+        with self._mutator_lock:
+            cached = self._read_state().get('resolved', {})
+            resolved = {}
+            for subdir, packages in self._sorted_packages_by_subdir():
+                if not packages:
+                    continue
+                entries = [
+                    cached.get(self._resolution_key(package))
+                    for package in packages
+                ]
+                if None in entries:
+                    return None
+                resolved[subdir] = entries
+            return resolved
+
+    def _write_resolved_packages(self, resolved):
+        """Caches the instances the pinned packages resolved to."""
+        with self._mutator_lock:
+            cached = {}
+            for subdir, packages in self._sorted_packages_by_subdir():
+                entries = resolved.get(subdir, [])
+                # Entries are listed in ensure file order.
+                if len(entries) != len(packages):
+                    continue
+                for package, entry in zip(packages, entries):
+                    if (_IsPinnedCipdVersion(package.version)
+                            and _CipdPackageNameMatches(
+                                package.name,
+                                entry.get('pin', {}).get('package'))):
+                        cached[self._resolution_key(package)] = entry
+            state = self._read_state()
+            state['resolved'] = cached
+            self._write_state(state)
+
+    def _ensure_digest(self):
+        """Returns a digest of the packages to ensure, or None.
+
+    The digest is None when any package has a ref as its version, since the
+    instance the ref points to can change without the package set changing.
+    """
+        if not all(
+                _IsPinnedCipdVersion(package.version)
+                for package in self._all_packages):
+            return None
+        contents = '\n'.join([
+            self._service_url or '',
+            self._host_platform(),
+            self._ensure_file_packages()
+        ])
+        return hashlib.sha256(contents.encode('utf-8')).hexdigest()
 
     def expand_package_name(self, package_name_string, **kwargs):
         """Run `cipd expand-package-name`.
@@ -1841,6 +2087,16 @@ class CipdRoot(object):
         ret = subprocess2.check_output(cmd, **kwargs).decode('utf-8')
         return ret.strip()
 
+    def _ensure_file_packages(self):
+        """Returns the package section of an ensure file for this root."""
+        contents = ''
+        for subdir, packages in self._sorted_packages_by_subdir():
+            contents += '@Subdir %s\n' % subdir
+            for package in packages:
+                contents += '%s %s\n' % (package.name, package.version)
+            contents += '\n'
+        return contents
+
     @contextlib.contextmanager
     def _create_ensure_file(self):
         try:
@@ -1848,11 +2104,7 @@ class CipdRoot(object):
             # TODO(crbug/1329641): Remove once cipd packages have been updated
             # to always be created in copy mode.
             contents += '$OverrideInstallMode copy\n\n'
-            for subdir, packages in sorted(self._packages_by_subdir.items()):
-                contents += '@Subdir %s\n' % subdir
-                for package in sorted(packages, key=lambda p: p.name):
-                    contents += '%s %s\n' % (package.name, package.version)
-                contents += '\n'
+            contents += self._ensure_file_packages()
             ensure_file = None
             with tempfile.NamedTemporaryFile(suffix='.ensure',
                                              delete=False,
@@ -1863,9 +2115,27 @@ class CipdRoot(object):
             if ensure_file is not None and os.path.exists(ensure_file.name):
                 os.remove(ensure_file.name)
 
-    def ensure(self):
-        """Run `cipd ensure`."""
+    def ensure(self, force=False):
+        """Run `cipd ensure`.
+
+    Does nothing if the same pinned packages were successfully ensured last
+    time, unless |force| is set. The fast path trusts the files deployed under
+    the root: it does not notice packages modified or deleted by hand, which
+    only a forced ensure (e.g. `gclient sync --force`) or a clobber repairs.
+    """
         with self._mutator_lock:
+            digest = self._ensure_digest()
+            state = self._read_state()
+            if (not force and digest and state.get('ensured') == digest
+                    and os.path.isdir(os.path.join(self.root_dir, '.cipd'))):
+                logging.info(
+                    'CIPD packages in %s are up to date, skipping '
+                    'cipd ensure', self.root_dir)
+                return
+            if 'ensured' in state:
+                # Forget what was ensured in case this ensure fails midway.
+                del state['ensured']
+                self._write_state(state)
             with self._create_ensure_file() as ensure_file:
                 cmd = [
                     'cipd',
@@ -1880,16 +2150,15 @@ class CipdRoot(object):
                 gclient_utils.CheckCallAndFilter(cmd,
                                                  print_stdout=True,
                                                  show_header=True)
+            if digest:
+                state['ensured'] = digest
+                self._write_state(state)
 
     @contextlib.contextmanager
     def _create_ensure_file_for_resolve(self):
         try:
             contents = '$ResolvedVersions %s\n' % os.devnull
-            for subdir, packages in sorted(self._packages_by_subdir.items()):
-                contents += '@Subdir %s\n' % subdir
-                for package in sorted(packages, key=lambda p: p.name):
-                    contents += '%s %s\n' % (package.name, package.version)
-                contents += '\n'
+            contents += self._ensure_file_packages()
             ensure_file = None
             with tempfile.NamedTemporaryFile(suffix='.ensure',
                                              delete=False,
@@ -1927,12 +2196,12 @@ class CipdRoot(object):
                         output_json = json.load(f)
                         return output_json.get('result', {})
 
-    def run(self, command):
+    def run(self, command, force=False):
         if command == 'update':
-            self.ensure()
+            self.ensure(force=force)
         elif command == 'revert':
             self.clobber()
-            self.ensure()
+            self.ensure(force=True)
 
     def created_package(self, package):
         """Checks whether this root created the given package.
@@ -2053,8 +2322,15 @@ class CipdWrapper(SCMWrapper):
 class GcsRoot(object):
     """Root to keep track of all GCS objects, per checkout"""
 
+    # How many GCS objects may be downloaded at the same time, across all GCS
+    # dependencies.
+    MAX_CONCURRENT_DOWNLOADS = 8
+
     def __init__(self, root_dir):
         self._mutator_lock = threading.Lock()
+        # Held while downloading an object.
+        self.download_slots = threading.BoundedSemaphore(
+            self.MAX_CONCURRENT_DOWNLOADS)
         self._root_dir = root_dir
         # Populated when the DEPS file is parsed
         # The objects here have not yet been downloaded and written into
@@ -9,7 +9,9 @@ import contextlib
 import datetime
 import errno
 import functools
+import heapq
 import io
+import json
 import logging
 import operator
 import os
@@ -833,6 +835,133 @@ def lockedmethod(method):
     return inner
 
 
+class TraceRecorder(object):
+    """Collects spans in the Chrome trace event format.
+
+    The resulting file can be loaded in chrome://tracing or Perfetto. Every
+    span is recorded as a complete event on the thread that ran it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._events = []
+        # Thread ident -> small integer used as the trace tid.
+        self._threads = {}
+
+    def _tid(self):
+        ident = threading.get_ident()
+        tid = self._threads.get(ident)
+        if tid is None:
+            tid = len(self._threads)
+            self._threads[ident] = tid
+            self._events.append({
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': os.getpid(),
+                'tid': tid,
+                'args': {
+                    'name':
+                    'main'
+                    if threading.current_thread() is threading.main_thread()
+                    else 'worker %d' % tid
+                },
+            })
+        return tid
+
+    def add_span(self, name, category, start, end, args=None):
+        """Records a span; start and end are time.perf_counter() values."""
+        ts = int((start - self._origin) * 1e6)
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': ts,
+            'dur': int((end - self._origin) * 1e6) - ts,
+            'pid': os.getpid(),
+        }
+        if args:
+            event['args'] = args
+        with self._lock:
+            event['tid'] = self._tid()
+            self._events.append(event)
+
+    @property
+    def events(self):
+        with self._lock:
+            return list(self._events)
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            # Paths in the args may be pathlib.Path objects.
+            trace = {'traceEvents': self.events, 'displayTimeUnit': 'ms'}
+            json.dump(trace, f, default=str)
+
+
+# The recorder spans are reported to, if tracing is enabled.
+_TRACE_RECORDER = None
+
+
+def StartTracing():
+    """Starts recording TraceSpans and returns the TraceRecorder."""
+    global _TRACE_RECORDER
+    _TRACE_RECORDER = TraceRecorder()
+    return _TRACE_RECORDER
+
+
+def StopTracing():
+    """Stops recording TraceSpans and returns the TraceRecorder, if any."""
+    global _TRACE_RECORDER
+    recorder, _TRACE_RECORDER = _TRACE_RECORDER, None
+    return recorder
+
+
+def TraceCommandName(cmd):
+    """Returns a short span name for |cmd|, e.g. 'git fetch' for a git command.
+    """
+    name = os.path.basename(cmd[0])
+    args = iter(cmd[1:])
+    for arg in args:
+        if arg in ('-c', '-C'):
+            next(args, None)
+        elif not arg.startswith('-'):
+            return '%s %s' % (name, arg)
+    return name
+
+
+class TraceSpan(contextlib.ContextDecorator):
+    """Records the enclosed code as a span when tracing is enabled.
+
+    Usable both as a context manager and as a function decorator. Extra keyword
+    arguments, and anything added to |args| while the span is open, are
+    attached to the event.
+    """
+
+    def __init__(self, name, category, **args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self._start = None
+
+    def _recreate_cm(self):
+        # Decorated functions may run concurrently; use a fresh span per call.
+        return TraceSpan(self.name, self.category, **self.args)
+
+    def __enter__(self):
+        if _TRACE_RECORDER:
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, _exc_value, _traceback):
+        recorder = _TRACE_RECORDER
+        if recorder and self._start is not None:
+            if exc_type:
+                self.args['error'] = exc_type.__name__
+            recorder.add_span(self.name, self.category, self._start,
+                              time.perf_counter(), self.args)
+        return False
+
+
 class WorkItem(object):
     """One work item."""
     # On cygwin, creating a lock throwing randomly when nearing ~100 locks.
@@ -863,21 +992,63 @@ class ExecutionQueue(object):
     This class manages that all the required dependencies are run
     before running each one.
 
+    Scheduling is event driven: each queued item keeps a count of its unmet
+    requirements and is moved to a ready heap when the last one has run, so
+    picking the next item never rescans the whole queue. Items run on a pool of
+    at most |jobs| long-lived worker threads that report back when they are
+    done with an item.
+
     Methods of this class are thread safe.
     """
-    def __init__(self, jobs, progress, ignore_requirements, verbose=False):
+
+    def __init__(self,
+                 jobs,
+                 progress,
+                 ignore_requirements,
+                 verbose=False,
+                 priorities=None,
+                 on_done=None):
         """jobs specifies the number of concurrent tasks to allow. progress is a
-        Progress instance."""
+        Progress instance. priorities optionally maps WorkItem names to a
+        number; among the items that can run, higher priorities start first and
+        ties start in enqueue order. on_done is optionally called from the
+        thread calling flush() with each WorkItem once it is done."""
         # Set when a thread is done or a new item is enqueued.
         self.ready_cond = threading.Condition()
         # Maximum number of concurrent tasks.
         self.jobs = jobs
-        # List of WorkItem, for gclient, these are Dependency instances.
-        self.queued = []
+        # WorkItem not yet started keyed by their enqueue order, for gclient,
+        # these are Dependency instances.
+        self.queued = {}
         # List of strings representing each Dependency.name that was run.
         self.ran = []
+        # Same as self.ran, for constant time lookups.
+        self._ran_names = set()
+        # WorkItem that ran with the requirements they waited for, by name.
+        self._ran_items = {}
+        self._requirements = {}
         # List of items currently running.
         self.running = []
+        # Items sent to the worker pool, or None to stop a worker.
+        self._tasks = queue.Queue()
+        # Items whose worker is done with them, not yet processed by flush().
+        self._finished = []
+        # Long-lived worker threads, at most self.jobs of them.
+        self._workers = []
+        # Heap of (-priority, enqueue order) of queued items whose requirements
+        # are satisfied.
+        self._ready = []
+        self.priorities = priorities or {}
+        # Number of unmet requirements of each queued item that can't run yet.
+        self._pending = {}
+        # Maps a requirement name to the queued items waiting for it to run.
+        self._waiting_on = collections.defaultdict(list)
+        # Maps a resource to the ready items that conflicted on it with a
+        # running item.
+        self._blocked_on = collections.defaultdict(list)
+        # Number of running items using each resource.
+        self._busy_resources = collections.Counter()
+        self._next_index = 0
         # Exceptions thrown if any.
         self.exceptions = queue.Queue()
         # Progress status
@@ -887,6 +1058,7 @@ class ExecutionQueue(object):
 
         self.ignore_requirements = ignore_requirements
         self.verbose = verbose
+        self.on_done = on_done
         self.last_join = None
         self.last_subproc_output = None
 
@@ -897,7 +1069,10 @@ class ExecutionQueue(object):
         assert isinstance(d, WorkItem)
         self.ready_cond.acquire()
         try:
-            self.queued.append(d)
+            index = self._next_index
+            self._next_index += 1
+            self.queued[index] = d
+            self._schedule(index, d)
             total = len(self.queued) + len(self.ran) + len(self.running)
             if self.jobs == 1:
                 total += 1
@@ -909,6 +1084,99 @@ class ExecutionQueue(object):
         finally:
             self.ready_cond.release()
 
+    def _schedule(self, index, d):
+        """Marks a queued item as ready or registers it on its unmet
+        requirements."""
+        if self.ignore_requirements:
+            unmet = set()
+        else:
+            self._requirements[d.name] = d.requirements
+            unmet = set(self._requirements[d.name]) - self._ran_names
+        if not unmet:
+            heapq.heappush(self._ready,
+                           (-self.priorities.get(d.name, 0), index))
+            return
+        self._pending[index] = len(unmet)
+        for requirement in unmet:
+            self._waiting_on[requirement].append(index)
+
+    def _mark_ran(self, task_item):
+        """Records that task_item ran and releases the items waiting on it."""
+        if task_item.name in self._ran_names:
+            raise Error('gclient is confused, "%s" is already in "%s"' %
+                        (task_item.name, ', '.join(self.ran)))
+        self.ran.append(task_item.name)
+        self._ran_names.add(task_item.name)
+        self._ran_items[task_item.name] = task_item
+        for index in self._waiting_on.pop(task_item.name, []):
+            if index not in self._pending:
+                continue
+            self._pending[index] -= 1
+            if not self._pending[index]:
+                del self._pending[index]
+                # Requirements are computed lazily and may have grown since
+                # the item was enqueued, so check them again.
+                self._schedule(index, self.queued[index])
+
+    def _acquire_resources(self, task_item):
+        self._busy_resources.update(task_item.resources)
+
+    def _release_resources(self, task_item):
+        for resource in task_item.resources:
+            self._busy_resources[resource] -= 1
+            if self._busy_resources[resource] > 0:
+                continue
+            del self._busy_resources[resource]
+            for key in self._blocked_on.pop(resource, []):
+                if key[1] in self.queued:
+                    heapq.heappush(self._ready, key)
+
+    def _next_task(self):
+        """Pops the first queued item that can run now, or returns None."""
+        while self._ready:
+            key = heapq.heappop(self._ready)
+            index = key[1]
+            task_item = self.queued.get(index)
+            if task_item is None:
+                continue
+            # Requirements are computed lazily and may have grown since the
+            # item became ready, e.g. when a parent directory was added.
+            if (not self.ignore_requirements
+                    and set(task_item.requirements) - self._ran_names):
+                self._schedule(index, task_item)
+                continue
+            resource = self._is_conflict(task_item)
+            if resource is not None:
+                self._blocked_on[resource].append(key)
+                continue
+            del self.queued[index]
+            return task_item
+        return None
+
+    def _clear_queue(self):
+        self.queued = {}
+        self._ready = []
+        self._pending.clear()
+        self._waiting_on.clear()
+        self._blocked_on.clear()
+
+    def timings(self):
+        """Returns how long each item that ran took and what it required.
+
+        Returns:
+            A tuple of two dicts keyed by WorkItem name: the duration in seconds
+            and the list of requirements of each item.
+        """
+        durations = {}
+        requirements = {}
+        for name, task_item in self._ran_items.items():
+            if not task_item.start or not task_item.finish:
+                continue
+            durations[name] = (task_item.finish -
+                               task_item.start).total_seconds()
+            requirements[name] = list(self._requirements.get(name, ()))
+        return durations, requirements
+
     def out_cb(self, _):
         self.last_subproc_output = datetime.datetime.now()
         return True
@@ -930,13 +1198,16 @@ class ExecutionQueue(object):
                                                task.outbuf.getvalue().strip())
 
     def _is_conflict(self, job):
-        """Checks to see if a job will conflict with another running job."""
-        for running_job in self.running:
-            for used_resource in running_job.item.resources:
-                logging.debug('Checking resource %s' % used_resource)
-                if used_resource in job.resources:
-                    return True
-        return False
+        """Checks to see if a job will conflict with another running job.
+
+        Returns the first resource of job already used by a running job, or
+        None.
+        """
+        for used_resource in job.resources:
+            logging.debug('Checking resource %s' % used_resource)
+            if used_resource in self._busy_resources:
+                return used_resource
+        return None
 
     def flush(self, *args, **kwargs):
         """Runs all enqueued items until all are executed."""
@@ -950,30 +1221,22 @@ class ExecutionQueue(object):
                     if not self.exceptions.empty():
                         # Systematically flush the queue when an exception
                         # logged.
-                        self.queued = []
-                    self._flush_terminated_threads()
+                        self._clear_queue()
+                    self._flush_finished_tasks()
                     if (not self.queued and not self.running
                             or self.jobs == len(self.running)):
                         logging.debug(
                             'No more worker threads or can\'t queue anything.')
                         break
 
-                    # Check for new tasks to start.
-                    for i in range(len(self.queued)):
-                        # Verify its requirements.
-                        if (self.ignore_requirements
-                                or not (set(self.queued[i].requirements) -
-                                        set(self.ran))):
-                            if not self._is_conflict(self.queued[i]):
-                                # Start one work item: all its requirements are
-                                # satisfied.
-                                self._run_one_task(self.queued.pop(i), args,
-                                                   kwargs)
-                                break
-                    else:
+                    # Start the first work item whose requirements are all
+                    # satisfied.
+                    task_item = self._next_task()
+                    if task_item is None:
                         # Couldn't find an item that could run. Break out the
                         # outher loop.
                         break
+                    self._run_one_task(task_item, args, kwargs)
 
                 if not self.queued and not self.running:
                     # We're done.
@@ -994,7 +1257,7 @@ class ExecutionQueue(object):
                         print('[%s] Still working on:' % elapsed)
                         sys.stdout.flush()
                         for task in self.running:
-                            print('[%s]   %s' % (elapsed, task.item.name))
+                            print('[%s]   %s' % (elapsed, task.name))
                             sys.stdout.flush()
                 except KeyboardInterrupt:
                     # Help debugging by printing some information:
@@ -1004,17 +1267,18 @@ class ExecutionQueue(object):
                         (self.jobs, len(self.queued), ', '.join(
                             self.ran), len(self.running)),
                         file=sys.stderr)
-                    for i in self.queued:
+                    for i in self.queued.values():
                         print('%s (not started): %s' %
                               (i.name, ', '.join(i.requirements)),
                               file=sys.stderr)
                     for i in self.running:
-                        print(self.format_task_output(i.item, 'interrupted'),
+                        print(self.format_task_output(i, 'interrupted'),
                               file=sys.stderr)
                     raise
-                # Something happened: self.enqueue() or a thread terminated.
+                # Something happened: self.enqueue() or a task finished.
                 # Loop again.
         finally:
+            self._stop_workers()
             self.ready_cond.release()
 
         assert not self.running, 'Now guaranteed to be single-threaded'
@@ -1024,39 +1288,58 @@ class ExecutionQueue(object):
             # To get back the stack location correctly, the raise a, b, c form
             # must be used, passing a tuple as the first argument doesn't work.
             e, task = self.exceptions.get()
-            print(self.format_task_output(task.item, 'ERROR'), file=sys.stderr)
+            print(self.format_task_output(task, 'ERROR'), file=sys.stderr)
             reraise(e[0], e[1], e[2])
         elif self.progress:
             self.progress.end()
 
-    def _flush_terminated_threads(self):
-        """Flush threads that have terminated."""
-        running = self.running
-        self.running = []
-        for t in running:
-            if t.is_alive():
-                self.running.append(t)
-            else:
-                t.join()
-                self.last_join = datetime.datetime.now()
-                sys.stdout.flush()
-                if self.verbose:
-                    print(self.format_task_output(t.item))
-                if self.progress:
-                    self.progress.update(1, t.item.name)
-                if t.item.name in self.ran:
-                    raise Error('gclient is confused, "%s" is already in "%s"' %
-                                (t.item.name, ', '.join(self.ran)))
-                if not t.item.name in self.ran:
-                    self.ran.append(t.item.name)
+    def _flush_finished_tasks(self):
+        """Processes the items the workers are done with."""
+        finished = self._finished
+        self._finished = []
+        for task_item in finished:
+            self.running.remove(task_item)
+            self.last_join = datetime.datetime.now()
+            sys.stdout.flush()
+            if self.verbose:
+                print(self.format_task_output(task_item))
+            if self.progress:
+                self.progress.update(1, task_item.name)
+            self._release_resources(task_item)
+            self._mark_ran(task_item)
+            if self.on_done:
+                self.on_done(task_item)
+
+    def _task_done(self, task_item, exc_info=None):
+        """Called by a worker when it is done with task_item."""
+        self.ready_cond.acquire()
+        try:
+            if exc_info:
+                self.exceptions.put((exc_info, task_item))
+            self._finished.append(task_item)
+            self.ready_cond.notifyAll()
+        finally:
+            self.ready_cond.release()
+
+    def _stop_workers(self):
+        """Asks all workers to exit once they are done with their item."""
+        for _ in self._workers:
+            self._tasks.put(None)
+        self._workers = []
 
     def _run_one_task(self, task_item, args, kwargs):
         if self.jobs > 1:
-            # Start the thread.
+            # Hand the item to the pool, growing it if all workers are busy.
             index = len(self.ran) + len(self.running) + 1
-            new_thread = self._Worker(task_item, index, args, kwargs)
-            self.running.append(new_thread)
-            new_thread.start()
+            logging.info('_Worker(%s) reqs:%s' %
+                         (task_item.name, task_item.requirements))
+            self.running.append(task_item)
+            self._acquire_resources(task_item)
+            if len(self._workers) < len(self.running):
+                worker = self._Worker(self)
+                self._workers.append(worker)
+                worker.start()
+            self._tasks.put((task_item, index, args, kwargs))
         else:
             # Run the 'thread' inside the main thread. Don't try to catch any
             # exception.
@@ -1064,11 +1347,14 @@ class ExecutionQueue(object):
                 task_item.start = datetime.datetime.now()
                 print('[%s] Started.' % Elapsed(task_item.start),
                       file=task_item.outbuf)
-                task_item.run(*args, **kwargs)
+                with TraceSpan(task_item.name, 'dependency'):
+                    task_item.run(*args, **kwargs)
                 task_item.finish = datetime.datetime.now()
                 print('[%s] Finished.' % Elapsed(task_item.finish),
                       file=task_item.outbuf)
-                self.ran.append(task_item.name)
+                self._mark_ran(task_item)
+                if self.on_done:
+                    self.on_done(task_item)
                 if self.verbose:
                     if self.progress:
                         print('')
@@ -1086,46 +1372,104 @@ class ExecutionQueue(object):
                 raise
 
     class _Worker(threading.Thread):
-        """One thread to execute one WorkItem."""
-        def __init__(self, item, index, args, kwargs):
-            threading.Thread.__init__(self, name=item.name or 'Worker')
-            logging.info('_Worker(%s) reqs:%s' % (item.name, item.requirements))
-            self.item = item
-            self.index = index
-            self.args = args
-            self.kwargs = kwargs
+        """One long-lived thread executing the WorkItems of the pool."""
+        def __init__(self, work_queue):
+            threading.Thread.__init__(self, name='Worker')
+            self.work_queue = work_queue
+            # Index of the current item, used to annotate its output.
+            self.index = 0
             self.daemon = True
 
         def run(self):
             """Runs in its own thread."""
-            logging.debug('_Worker.run(%s)' % self.item.name)
-            work_queue = self.kwargs['work_queue']
+            while True:
+                task = self.work_queue._tasks.get()
+                if task is None:
+                    return
+                item, self.index, args, kwargs = task
+                self.name = item.name or 'Worker'
+                self._run_item(item, args, kwargs)
+                self.index = 0
+
+        def _run_item(self, item, args, kwargs):
+            logging.debug('_Worker.run(%s)' % item.name)
+            exc_info = None
             try:
-                self.item.start = datetime.datetime.now()
-                print('[%s] Started.' % Elapsed(self.item.start),
-                      file=self.item.outbuf)
-                self.item.run(*self.args, **self.kwargs)
-                self.item.finish = datetime.datetime.now()
-                print('[%s] Finished.' % Elapsed(self.item.finish),
-                      file=self.item.outbuf)
+                item.start = datetime.datetime.now()
+                print('[%s] Started.' % Elapsed(item.start), file=item.outbuf)
+                with TraceSpan(item.name, 'dependency'):
+                    item.run(*args, **kwargs)
+                item.finish = datetime.datetime.now()
+                print('[%s] Finished.' % Elapsed(item.finish), file=item.outbuf)
             except KeyboardInterrupt:
-                logging.info('Caught KeyboardInterrupt in thread %s',
-                             self.item.name)
+                logging.info('Caught KeyboardInterrupt in thread %s', item.name)
                 logging.info(str(sys.exc_info()))
-                work_queue.exceptions.put((sys.exc_info(), self))
-                raise
+                exc_info = sys.exc_info()
             except Exception:
                 # Catch exception location.
-                logging.info('Caught exception in thread %s', self.item.name)
+                logging.info('Caught exception in thread %s', item.name)
                 logging.info(str(sys.exc_info()))
-                work_queue.exceptions.put((sys.exc_info(), self))
+                exc_info = sys.exc_info()
             finally:
-                logging.info('_Worker.run(%s) done', self.item.name)
-                work_queue.ready_cond.acquire()
-                try:
-                    work_queue.ready_cond.notifyAll()
-                finally:
-                    work_queue.ready_cond.release()
+                logging.info('_Worker.run(%s) done', item.name)
+                self.work_queue._task_done(item, exc_info)
+
+
+def CriticalPathLengths(durations, requirements):
+    """Computes the longest remaining path from each item of a run.
+
+    Args:
+        durations: dict of item name to how long the item took to run.
+        requirements: dict of item name to the names of the items it requires.
+
+    Returns:
+        A dict of item name to the duration of the item plus the longest chain
+        of durations of the items that transitively require it.
+    """
+    dependents = collections.defaultdict(list)
+    for name, reqs in requirements.items():
+        for requirement in reqs:
+            dependents[requirement].append(name)
+
+    lengths = {}
+    visiting = set()
+    for start in sorted(set(durations) | set(dependents)):
+        stack = [(start, False)]
+        while stack:
+            name, expanded = stack.pop()
+            if name in lengths:
+                continue
+            if expanded:
+                visiting.discard(name)
+                lengths[name] = durations.get(name, 0) + max(
+                    [lengths.get(d, 0) for d in dependents[name]] or [0])
+                continue
+            # Dependents still being visited form a cycle and are ignored.
+            visiting.add(name)
+            stack.append((name, True))
+            stack.extend((d, False) for d in dependents[name]
+                         if d not in lengths and d not in visiting)
+    return lengths
+
+
+def CriticalPath(durations, requirements):
+    """Returns the names on the longest chain of items of a run, in order."""
+    lengths = CriticalPathLengths(durations, requirements)
+    if not lengths:
+        return []
+    dependents = collections.defaultdict(list)
+    for name, reqs in requirements.items():
+        for requirement in reqs:
+            dependents[requirement].append(name)
+
+    path = [max(sorted(lengths), key=lambda n: lengths[n])]
+    seen = set(path)
+    while True:
+        candidates = sorted(d for d in dependents[path[-1]] if d not in seen)
+        if not candidates:
+            return path
+        path.append(max(candidates, key=lambda n: lengths[n]))
+        seen.add(path[-1])
 
 
 def GetEditor(git_editor=None):
@@ -4,7 +4,9 @@
 # found in the LICENSE file.
 """A git command for managing a local cache of git repositories."""
 
+import concurrent.futures
 import contextlib
+import json
 import logging
 import optparse
 import os
@@ -98,6 +100,14 @@ class Mirror(object):
     # Used for tests
     _GIT_CONFIG_LOCATION = []
 
+    # Which revisions each mirror contains, keyed by mirror path. Values are
+    # (state, {revision: bool}) tuples, see _revision_cache_state().
+    _revision_cache = {}
+    _revision_cache_lock = threading.Lock()
+
+    # Limits the number of concurrent fetches, see SetFetchJobs().
+    _fetch_semaphore = None
+
     @staticmethod
     def parse_fetch_spec(spec):
         """Parses and canonicalizes a fetch spec.
@@ -355,21 +365,122 @@ class Mirror(object):
         if not self.exists():
             return False
 
-        if sys.platform.startswith('win'):
-            # Windows .bat scripts use ^ as escape sequence, which means we have
-            # to escape it with itself for every .bat invocation.
-            needle = '%s^^^^{commit}' % revision
-        else:
-            needle = '%s^{commit}' % revision
-        try:
-            # cat-file exits with 0 on success, that is git object of given hash
-            # was found.
-            self.RunGit(['cat-file', '-e', needle])
+        if self.contains_revisions([revision])[revision]:
             return True
-        except subprocess.CalledProcessError:
-            self.print('Commit with hash "%s" not found' % revision,
-                       file=sys.stderr)
-            return False
+        self.print('Commit with hash "%s" not found' % revision,
+                   file=sys.stderr)
+        return False
+
+    @property
+    def _revision_cache_file(self):
+        # Next to the mirror rather than in it, so that it isn't uploaded by
+        # update_bootstrap.
+        return self.mirror_path + '.revisions'
+
+    def _revision_cache_state(self):
+        """Returns a value that changes whenever the objects or refs of the
+        mirror may have changed.
+
+        Fetches write FETCH_HEAD, and repacks and bootstraps replace the packs.
+        """
+        state = []
+        for path in ('FETCH_HEAD', 'packed-refs',
+                     os.path.join('objects', 'pack')):
+            try:
+                st = os.stat(os.path.join(self.mirror_path, path))
+                state.append([st.st_mtime_ns, st.st_size])
+            except OSError:
+                state.append(None)
+        return state
+
+    def _read_revision_cache(self, state):
+        """Returns the cached presence of revisions, if still valid."""
+        with self._revision_cache_lock:
+            cached_state, revisions = self._revision_cache.get(
+                self.mirror_path, (None, None))
+        if cached_state == state:
+            return revisions
+        try:
+            with open(self._revision_cache_file) as f:
+                cached = json.load(f)
+            if cached['state'] == state:
+                return cached['revisions']
+        except (IOError, ValueError, KeyError, TypeError):
+            pass
+        return {}
+
+    def _write_revision_cache(self, state, revisions):
+        with self._revision_cache_lock:
+            self._revision_cache[self.mirror_path] = (state, revisions)
+        try:
+            fd, tmp = tempfile.mkstemp(
+                dir=os.path.dirname(self._revision_cache_file))
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'state': state, 'revisions': revisions}, f)
+            os.replace(tmp, self._revision_cache_file)
+        except OSError as e:
+            logging.warning('Could not write %s: %s', self._revision_cache_file,
+                            e)
+
+    def contains_revisions(self, revisions):
+        """Returns a {revision: bool} dict telling which of |revisions| are
+        commits in the mirror.
+
+        Revisions not in the cache are checked with a single git process.
+        """
+        if not self.exists():
+            return {revision: False for revision in revisions}
+
+        state = self._revision_cache_state()
+        cached = self._read_revision_cache(state)
+        result = {r: cached[r] for r in revisions if r in cached}
+        unknown = [r for r in dict.fromkeys(revisions) if r not in result]
+        if not unknown:
+            return result
+
+        proc = subprocess.run([
+            self.git_exe, '--git-dir',
+            os.path.abspath(self.mirror_path), 'cat-file', '--batch-check'
+        ],
+                              input=''.join('%s^{commit}\n' % r
+                                            for r in unknown).encode(),
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE,
+                              check=True)
+        lines = proc.stdout.decode('utf-8', 'ignore').splitlines()
+        assert len(lines) == len(unknown), lines
+        for revision, line in zip(unknown, lines):
+            # "<oid> commit <size>", or "<revision>^{commit} missing" and
+            # "<revision>^{commit} ambiguous".
+            result[revision] = line.split(' ')[1:2] == ['commit']
+
+        if self._revision_cache_state() == state:
+            revisions_cache = dict(cached)
+            revisions_cache.update(result)
+            self._write_revision_cache(state, revisions_cache)
+        return result
+
+    @staticmethod
+    def batch_contains_revisions(mirrors_and_revisions):
+        """Checks which revisions the given mirrors contain, using one git
+        process per mirror.
+
+        Args:
+            mirrors_and_revisions: iterable of (Mirror, revision) pairs.
+
+        Returns:
+            A {(mirror path, revision): bool} dict.
+        """
+        by_mirror = {}
+        for mirror, revision in mirrors_and_revisions:
+            by_mirror.setdefault(mirror.mirror_path,
+                                 (mirror, []))[1].append(revision)
+        result = {}
+        for path, (mirror, revisions) in by_mirror.items():
+            for revision, present in mirror.contains_revisions(
+                    revisions).items():
+                result[(path, revision)] = present
+        return result
 
     def exists(self):
         return os.path.isfile(os.path.join(self.mirror_path, 'config'))
@@ -402,17 +513,36 @@ class Mirror(object):
                 '%s and "git cache fetch" again.' %
                 os.path.join(self.mirror_path, 'config'))
 
+    def _pack_files(self):
+        pack_dir = os.path.join(self.mirror_path, 'objects', 'pack')
+        if not os.path.isdir(pack_dir):
+            return []
+        return [f for f in os.listdir(pack_dir) if f.endswith('.pack')]
+
+    def _maintain(self):
+        """Keeps object lookups fast by incrementally repacking the mirror.
+
+        Packs are merged geometrically, so that each run only rewrites the
+        small packs, and a multi-pack-index and a commit-graph are written.
+        The caller must hold the lock of the mirror.
+        """
+        with self.print_duration_of('maintenance'):
+            self.RunGit(['repack', '-d', '--geometric=2', '--write-midx'])
+            self.RunGit(['commit-graph', 'write', '--reachable', '--split'])
+        self.DeleteTmpPackFiles(self.mirror_path)
+
+    def maintain(self, lock_timeout=0):
+        """Repacks the mirror incrementally, see _maintain()."""
+        with lockfile.lock(self.mirror_path, lock_timeout):
+            self._maintain()
+
     def _ensure_bootstrapped(self,
                              depth,
                              bootstrap,
                              reset_fetch_config,
                              force=False):
-        pack_dir = os.path.join(self.mirror_path, 'objects', 'pack')
-        pack_files = []
-        if os.path.isdir(pack_dir):
-            pack_files = [
-                f for f in os.listdir(pack_dir) if f.endswith('.pack')
-            ]
+        pack_files = self._pack_files()
+        if os.path.isdir(os.path.join(self.mirror_path, 'objects', 'pack')):
             self.print('%s has %d .pack files, re-bootstrapping if >%d or ==0' %
                        (self.mirror_path, len(pack_files), GC_AUTOPACKLIMIT))
 
@@ -441,6 +571,15 @@ class Mirror(object):
                 # force bootstrap
                 force = True
 
+        if (not force and self.exists() and len(pack_files) > GC_AUTOPACKLIMIT):
+            # Merging the packs is much cheaper than downloading a new
+            # bootstrap, so try that first.
+            try:
+                self._maintain()
+            except subprocess.CalledProcessError:
+                logging.warning('Failed to repack %s' % self.mirror_path)
+            pack_files = self._pack_files()
+
         should_bootstrap = (force or not self.exists()
                             or len(pack_files) > GC_AUTOPACKLIMIT
                             or len(pack_files) == 0)
@@ -496,6 +635,58 @@ class Mirror(object):
         if m:
             self.RunGit(['symbolic-ref', 'HEAD', 'refs/heads/' + m.groups()[0]])
 
+    @classmethod
+    def SetFetchJobs(cls, jobs):
+        """Limits how many mirrors fetch at the same time."""
+        cls._fetch_semaphore = threading.BoundedSemaphore(
+            jobs) if jobs else None
+
+    @contextlib.contextmanager
+    def _fetch_slot(self):
+        semaphore = self._fetch_semaphore
+        if semaphore is None:
+            yield
+            return
+        with semaphore:
+            yield
+
+    def _fetch_one_by_one(self, fetch_cmd, fetch_specs):
+        for spec in fetch_specs:
+            try:
+                self.print('Fetching %s' % spec)
+                with self.print_duration_of('fetch %s' % spec):
+                    self.RunGit(fetch_cmd + [spec], retry=True)
+            except subprocess.CalledProcessError:
+                if spec == '+refs/heads/*:refs/heads/*':
+                    raise ClobberNeeded()  # Corrupted cache.
+                logging.warning('Fetch of %s failed' % spec)
+
+    def _fetch_commits(self):
+        """Fetches the commits of self.fetch_commits the mirror lacks."""
+        contained = self.contains_revisions(sorted(self.fetch_commits))
+        missing = [commit for commit, found in contained.items() if not found]
+        if not missing:
+            return
+        # Fetch the commits at once, falling back to fetching those still
+        # missing one by one, to find out which of them failed.
+        try:
+            self.print('Fetching %s' % ', '.join(missing))
+            with self.print_duration_of('fetch'):
+                self.RunGit(['fetch', 'origin'] + missing, retry=True)
+            return
+        except subprocess.CalledProcessError:
+            logging.warning('Fetch of %s failed, fetching them one by one' %
+                            ', '.join(missing))
+        contained = self.contains_revisions(missing)
+        for commit in missing:
+            if contained[commit]:
+                continue
+            self.print('Fetching %s' % commit)
+            try:
+                with self.print_duration_of('fetch %s' % commit):
+                    self.RunGit(['fetch', 'origin', commit], retry=True)
+            except subprocess.CalledProcessError:
+                logging.warning('Fetch of %s failed' % commit)
 
     def _fetch(self,
                verbose,
@@ -524,22 +715,18 @@ class Mirror(object):
             ],
             cwd=self.mirror_path).decode('utf-8',
                                          'ignore').strip().splitlines()
-        for spec in fetch_specs:
+        with self._fetch_slot():
+            # Fetch all refspecs at once, so that there is a single negotiation
+            # with the server. If that fails, fall back to fetching them one by
+            # one, to find out which of them failed.
             try:
-                self.print('Fetching %s' % spec)
-                with self.print_duration_of('fetch %s' % spec):
-                    self.RunGit(fetch_cmd + [spec], retry=True)
-            except subprocess.CalledProcessError:
-                if spec == '+refs/heads/*:refs/heads/*':
-                    raise ClobberNeeded()  # Corrupted cache.
-                logging.warning('Fetch of %s failed' % spec)
-        for commit in self.fetch_commits:
-            self.print('Fetching %s' % commit)
-            try:
-                with self.print_duration_of('fetch %s' % commit):
-                    self.RunGit(['fetch', 'origin', commit], retry=True)
+                self.print('Fetching %s' % ', '.join(fetch_specs))
+                with self.print_duration_of('fetch'):
+                    self.RunGit(fetch_cmd + fetch_specs, retry=True)
             except subprocess.CalledProcessError:
-                logging.warning('Fetch of %s failed' % commit)
+                logging.warning('Fetch failed, fetching one by one')
+                self._fetch_one_by_one(fetch_cmd, fetch_specs)
+            self._fetch_commits()
         if os.path.isfile(self._init_sentient_file):
             os.remove(self._init_sentient_file)
 
@@ -707,6 +894,100 @@ class Mirror(object):
                 logging.warning('Unable to delete temporary pack file %s' % f)
 
 
+def ReadManifest(path):
+    """Reads a list of repos to cache from a file.
+
+    Each line holds a repo url, optionally followed by @revision. Empty lines
+    and lines starting with # are ignored.
+
+    Returns:
+        A list of (url, revision) tuples, where revision may be None.
+    """
+    entries = []
+    for line in gclient_utils.FileRead(path).splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            entries.append(gclient_utils.SplitUrlRevision(line))
+    return entries
+
+
+def ReadGclientEntries(path):
+    """Reads the git repos of a .gclient_entries file.
+
+    Returns:
+        A list of (url, revision) tuples, where revision may be None.
+    """
+    scope = {}
+    exec(gclient_utils.FileRead(path), scope)
+    entries = []
+    for url in scope.get('entries', {}).values():
+        # Skip file-only solutions, and CIPD and GCS dependencies.
+        if (not url or url.startswith('gs://')
+                or 'chrome-infra-packages' in url):
+            continue
+        entries.append(gclient_utils.SplitUrlRevision(url))
+    return entries
+
+
+def MirrorsForEntries(entries, print_func=None):
+    """Returns a Mirror per repo, fetching the revisions the entries need."""
+    # Different urls may share a mirror, e.g. with and without .git.
+    urls = {}
+    refs = {}
+    commits = {}
+    for url, revision in entries:
+        cache_dir = Mirror.UrlToCacheDir(url)
+        urls.setdefault(cache_dir, url)
+        refs.setdefault(cache_dir, [])
+        commits.setdefault(cache_dir, [])
+        if not revision:
+            continue
+        if gclient_utils.IsFullGitSha(revision):
+            commits[cache_dir].append(revision)
+        elif revision.startswith('refs/'):
+            refs[cache_dir].append(revision)
+    return [
+        Mirror(url,
+               refs=refs[cache_dir],
+               commits=commits[cache_dir],
+               print_func=print_func) for cache_dir, url in urls.items()
+    ]
+
+
+def PopulateMirrors(mirrors, jobs=8, jobs_per_host=4, **kwargs):
+    """Populates several mirrors in parallel.
+
+    Args:
+        mirrors: the Mirror objects to populate.
+        jobs: how many mirrors to populate at the same time.
+        jobs_per_host: how many mirrors of the same host to populate at the
+            same time.
+        kwargs: passed to Mirror.populate.
+
+    Returns:
+        A list of (mirror, seconds, exception) tuples in the order of
+        |mirrors|, where exception is None if populating the mirror succeeded.
+    """
+    host_semaphores = {}
+    for mirror in mirrors:
+        host = urllib.parse.urlparse(mirror.url).netloc
+        host_semaphores.setdefault(host,
+                                   threading.BoundedSemaphore(jobs_per_host))
+
+    def populate(mirror):
+        start = time.time()
+        try:
+            with host_semaphores[urllib.parse.urlparse(mirror.url).netloc]:
+                mirror.populate(**kwargs)
+        except Exception as e:
+            logging.exception('Failed to populate %s', mirror.url)
+            return mirror, time.time() - start, e
+        return mirror, time.time() - start, None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(populate, mirrors))
+
+
 @subcommand.usage('[url of repo to check for caching]')
 @metrics.collector.collect_metrics('git cache exists')
 def CMDexists(parser, args):
@@ -764,6 +1045,41 @@ def CMDupdate_bootstrap(parser, args):
     return 0
 
 
+@subcommand.usage('[url of repo to maintain]')
+@metrics.collector.collect_metrics('git cache maintain')
+def CMDmaintain(parser, args):
+    """Incrementally repack a cached repo to keep it fast."""
+    if gclient_utils.IsEnvCog():
+        print('maintaining cache is not supported in non-git environment.',
+              file=sys.stderr)
+        return 1
+
+    parser.add_option('--all',
+                      action='store_true',
+                      help='Maintain all repos in the cache.')
+    options, args = parser.parse_args(args)
+    if options.all:
+        if args:
+            parser.error('git cache maintain takes either --all or repo urls.')
+        cachepath = Mirror.GetCachePath()
+        mirrors = [
+            Mirror.FromPath(os.path.join(cachepath, d))
+            for d in sorted(os.listdir(cachepath))
+            if os.path.isfile(os.path.join(cachepath, d, 'config'))
+        ]
+    elif args:
+        mirrors = [Mirror(url) for url in args]
+    else:
+        parser.error('git cache maintain needs a repo url or --all.')
+
+    for mirror in mirrors:
+        if not mirror.exists():
+            print('%s is not cached.' % mirror.url, file=sys.stderr)
+            return 1
+        mirror.maintain(lock_timeout=options.timeout)
+    return 0
+
+
 @subcommand.usage('[url of repo to add to or update in cache]')
 @metrics.collector.collect_metrics('git cache populate')
 def CMDpopulate(parser, args):
@@ -809,16 +1125,43 @@ def CMDpopulate(parser, args):
         default=False,
         help='Reset the fetch config before populating the cache.')
 
+    parser.add_option(
+        '--manifest',
+        help='Populate the cache for all repos listed in this file, one '
+        'url[@revision] per line.')
+    parser.add_option(
+        '--from-gclient-entries',
+        metavar='PATH',
+        help='Populate the cache for all git repos in this .gclient_entries '
+        'file.')
+    parser.add_option('--jobs',
+                      '-j',
+                      type='int',
+                      default=8,
+                      help='How many repos to populate at the same time when '
+                      'populating several repos. Default: %default')
+    parser.add_option('--jobs-per-host',
+                      type='int',
+                      default=4,
+                      help='How many repos of the same host to populate at the '
+                      'same time. Default: %default')
+    parser.add_option('--fetch-jobs',
+                      type='int',
+                      help='How many repos to fetch at the same time when '
+                      'populating several repos. Default: as many as --jobs.')
+
     options, args = parser.parse_args(args)
-    if not len(args) == 1:
+    batch = options.manifest or options.from_gclient_entries
+    if batch and args:
+        parser.error('git cache populate takes either a repo url, or '
+                     '--manifest or --from-gclient-entries.')
+    if not batch and not len(args) == 1:
         parser.error('git cache populate only takes exactly one repo url.')
     if options.ignore_locks:
         print('ignore_locks is no longer used. Please remove its usage.')
     if options.break_locks:
         print('break_locks is no longer used. Please remove its usage.')
-    url = args[0]
 
-    mirror = Mirror(url, refs=options.ref, commits=options.commit)
     kwargs = {
         'no_fetch_tags': options.no_fetch_tags,
         'verbose': options.verbose,
@@ -829,7 +1172,32 @@ def CMDpopulate(parser, args):
     }
     if options.depth:
         kwargs['depth'] = options.depth
-    mirror.populate(**kwargs)
+
+    if not batch:
+        mirror = Mirror(args[0], refs=options.ref, commits=options.commit)
+        mirror.populate(**kwargs)
+        return 0
+
+    entries = []
+    if options.manifest:
+        entries.extend(ReadManifest(options.manifest))
+    if options.from_gclient_entries:
+        entries.extend(ReadGclientEntries(options.from_gclient_entries))
+    mirrors = MirrorsForEntries(entries)
+    Mirror.SetFetchJobs(options.fetch_jobs)
+    results = PopulateMirrors(mirrors,
+                              jobs=options.jobs,
+                              jobs_per_host=options.jobs_per_host,
+                              **kwargs)
+    failed = 0
+    for mirror, seconds, error in results:
+        if error:
+            failed += 1
+            print('%s: failed after %.1fs: %s' % (mirror.url, seconds, error))
+        else:
+            print('%s: %.1fs' % (mirror.url, seconds))
+    print('Populated %d of %d repos.' % (len(results) - failed, len(results)))
+    return 1 if failed else 0
 
 
 @subcommand.usage('Fetch new commits into cache and current checkout')
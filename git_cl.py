@@ -1670,7 +1670,7 @@ class Changelist(object):
         """Returns the list of affected files for the given commit range."""
         try:
             return [
-                f for _, f in scm.GIT.CaptureStatus(
+                f for _, f in scm.GIT.IterStatus(
                     settings.GetRoot(), upstream, end_commit=end_commit)
             ]
         except subprocess2.CalledProcessError:
@@ -26,6 +26,7 @@ IMapIterator.next = wrapper(IMapIterator.next)
 IMapIterator.__next__ = IMapIterator.next
 # TODO(iannucci): Monkeypatch all other 'wait' methods too.
 
+import atexit
 import binascii
 import collections
 import contextlib
@@ -52,7 +53,6 @@ import gclient_utils
 import scm
 import subprocess2
 
-from io import BytesIO
 
 ROOT = os.path.abspath(os.path.dirname(__file__))
 IS_WIN = sys.platform == 'win32'
@@ -1017,18 +1017,6 @@ def status(ignore_submodules=None):
 
     stat_entry = collections.namedtuple('stat_entry', 'lstat rstat src')
 
-    def tokenizer(stream):
-        acc = BytesIO()
-        c = None
-        while c != b'':
-            c = stream.read(1)
-            if c in (None, b'', b'\0'):
-                if len(acc.getvalue()) > 0:
-                    yield acc.getvalue()
-                    acc = BytesIO()
-            else:
-                acc.write(c)
-
     def parser(tokens):
         while True:
             try:
@@ -1044,13 +1032,33 @@ def status(ignore_submodules=None):
             yield (dest, stat_entry(lstat, rstat, src))
 
     return parser(
-        tokenizer(
+        iter_nul_delimited(
             run_stream('status',
                        '-z',
                        f'--ignore-submodules={ignore_submodules}',
                        bufsize=-1)))
 
 
+def iter_nul_delimited(stream, chunk_size=64 * 1024):
+    """Yields the non-empty NUL-delimited tokens of a binary stream.
+
+    The stream is read in chunks, so only the current chunk and token are held
+    in memory.
+    """
+    pending = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        tokens = (pending + chunk).split(b'\0')
+        pending = tokens.pop()
+        for token in tokens:
+            if token:
+                yield token
+    if pending:
+        yield pending
+
+
 def squash_current_branch(header=None, merge_base=None):
     header = header or 'git squash commit for %s.' % current_branch()
     merge_base = merge_base or get_or_create_merge_base(current_branch())
@@ -1151,6 +1159,10 @@ def topo_iter(branch_tree, top_down=True):
                 del branch_tree[branch]
 
 
+# The types of the tree entries which aren't blobs, by mode.
+_TREE_ENTRY_TYPES = {'040000': 'tree', '160000': 'commit'}
+
+
 def tree(treeref, recurse=False):
     """Returns a dict representation of a git tree object.
 
@@ -1175,20 +1187,211 @@ def tree(treeref, recurse=False):
 
         ref is the hex encoded hash of the entry.
     """
-    ret = {}
-    opts = ['ls-tree', '--full-tree']
-    if recurse:
-        opts.append('-r')
-    opts.append(treeref)
-    try:
-        for line in run(*opts).splitlines():
-            mode, typ, ref, name = line.split(None, 3)
-            ret[name] = (mode, typ, ref)
-    except subprocess2.CalledProcessError:
+    reader = object_reader()
+    info = reader.info(treeref)
+    # Peel tags and commits down to their tree.
+    while info is not None and info[1] != 'tree':
+        if info[1] not in ('commit', 'tag'):
+            return None
+        header = reader.read(info[0])[1].split(b'\n', 1)[0]
+        info = reader.info(header.split(b' ', 1)[1].decode())
+    if info is None:
         return None
+
+    # Binary hashes are half as long as hex ones, whatever the hash function.
+    hash_size = len(info[0]) // 2
+    ret = {}
+
+    def add_entries(prefix, ref):
+        content = reader.read(ref)[1]
+        pos = 0
+        # Each entry is "<mode> <name>\0<binary hash>".
+        while pos < len(content):
+            space = content.index(b' ', pos)
+            nul = content.index(b'\0', space)
+            mode = content[pos:space].decode().zfill(6)
+            name = prefix + content[space + 1:nul].decode('utf-8', 'replace')
+            pos = nul + 1 + hash_size
+            entry_ref = content[nul + 1:pos].hex()
+            typ = _TREE_ENTRY_TYPES.get(mode, 'blob')
+            if recurse and typ == 'tree':
+                add_entries(name + '/', entry_ref)
+            else:
+                ret[name] = (mode, typ, entry_ref)
+
+    add_entries('', info[0])
     return ret
 
 
+class ObjectReader(object):
+    """Reads objects of a repository through long-lived git processes.
+
+    `git cat-file --batch` and `git cat-file --batch-check` are started on
+    first use and kept running, so reading many objects costs one process
+    instead of one per object. Instances are thread-safe.
+    """
+
+    def __init__(self, cwd=None):
+        self.cwd = cwd or os.getcwd()
+        self._procs = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exc_type, _exc_value, _traceback):
+        self.close()
+
+    def _proc(self, mode):
+        """Returns the running `git cat-file |mode|` process."""
+        proc = self._procs.get(mode)
+        if proc is None or proc.poll() is not None:
+            proc = subprocess2.Popen((GIT_EXE, 'cat-file', mode),
+                                     cwd=self.cwd,
+                                     stdin=subprocess2.PIPE,
+                                     stdout=subprocess2.PIPE,
+                                     stderr=subprocess2.DEVNULL,
+                                     shell=False)
+            self._procs[mode] = proc
+        return proc
+
+    def _query(self, mode, rev):
+        """Sends |rev| to the `git cat-file |mode|` process.
+
+        Returns the process and the (hash, type, size) of the object, or None
+        if it doesn't exist.
+        """
+        if '\n' in rev:
+            raise ValueError('Invalid revision %r' % rev)
+        proc = self._proc(mode)
+        proc.stdin.write(rev.encode('utf-8') + b'\n')
+        proc.stdin.flush()
+        return proc, self._read_header(proc, mode)
+
+    def _read_header(self, proc, mode):
+        header = proc.stdout.readline()
+        if not header:
+            raise subprocess2.CalledProcessError(proc.wait(),
+                                                 ('cat-file', mode), self.cwd,
+                                                 b'', b'')
+        # Missing objects are reported as "<rev> missing" or
+        # "<rev> ambiguous", where <rev> may contain spaces.
+        if header.endswith((b' missing\n', b' ambiguous\n')):
+            return None
+        oid, typ, size = header.split()
+        return oid.decode(), typ.decode(), int(size)
+
+    def info(self, rev):
+        """Returns the (hash, type, size) of |rev|, or None if it doesn't
+        exist."""
+        with self._lock:
+            return self._query('--batch-check', rev)[1]
+
+    def info_batch(self, revs):
+        """Returns the (hash, type, size) of each of |revs|, with None for the
+        ones that don't exist.
+
+        All the revisions are sent to git at once rather than one at a time.
+        """
+        revs = list(revs)
+        if any('\n' in rev for rev in revs):
+            raise ValueError('Invalid revisions %r' % revs)
+        with self._lock:
+            proc = self._proc('--batch-check')
+
+            # Write from another thread, so that neither pipe can fill up
+            # while the other is waited on.
+            def write():
+                try:
+                    proc.stdin.write(b''.join(
+                        rev.encode('utf-8') + b'\n' for rev in revs))
+                    proc.stdin.flush()
+                except (IOError, OSError):
+                    pass
+
+            writer = threading.Thread(target=write)
+            writer.daemon = True
+            writer.start()
+            try:
+                return [self._read_header(proc, '--batch-check') for _ in revs]
+            except:
+                # The writer may be blocked on a full pipe no one reads
+                # anymore. Kill git so that it fails instead, and start a new
+                # process next time.
+                proc.kill()
+                proc.wait()
+                self._procs.pop('--batch-check', None)
+                raise
+            finally:
+                writer.join()
+
+    def read(self, rev):
+        """Returns the (type, content) of |rev|, or None if it doesn't exist.
+
+        The content is returned as bytes.
+        """
+        with self._lock:
+            proc, info = self._query('--batch', rev)
+            if info is None:
+                return None
+            content = proc.stdout.read(info[2])
+            # Skip the newline after the content.
+            proc.stdout.read(1)
+            return info[1], content
+
+    def close(self):
+        with self._lock:
+            for proc in self._procs.values():
+                proc.stdin.close()
+                proc.wait()
+            self._procs = {}
+
+
+# Maps the path of a repository to its identity and shared ObjectReader.
+_OBJECT_READERS = {}
+_OBJECT_READERS_LOCK = threading.Lock()
+
+
+def _repo_identity(path):
+    """Returns the (device, inode) of |path| and of its .git, if any.
+
+    A repository deleted and recreated at the same path gets a new identity.
+    The inode of |path| can't be reused while a reader's processes still run
+    in it.
+    """
+    identity = []
+    for p in (path, os.path.join(path, '.git')):
+        try:
+            st = os.stat(p)
+        except OSError:
+            identity.append(None)
+        else:
+            identity.append((st.st_dev, st.st_ino))
+    return tuple(identity)
+
+
+def object_reader(cwd=None):
+    """Returns the shared ObjectReader for the repository at |cwd|."""
+    key = os.path.abspath(cwd or os.getcwd())
+    identity = _repo_identity(key)
+    with _OBJECT_READERS_LOCK:
+        old_identity, reader = _OBJECT_READERS.get(key, (None, None))
+        if reader is None or old_identity != identity:
+            if reader is not None:
+                reader.close()
+            reader = ObjectReader(key)
+            _OBJECT_READERS[key] = (identity, reader)
+        return reader
+
+
+@atexit.register
+def close_object_readers():
+    with _OBJECT_READERS_LOCK:
+        for _, reader in _OBJECT_READERS.values():
+            reader.close()
+        _OBJECT_READERS.clear()
+
+
 def get_remote_url(remote='origin'):
     return scm.GIT.GetConfig(os.getcwd(), 'remote.%s.url' % remote)
 
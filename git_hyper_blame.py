@@ -390,13 +390,13 @@ def main(args, outbuf):
             ignored_list.extend(parse_ignore_file(ignore_file))
 
     ignored = set()
+    reader = git_common.object_reader()
     for c in ignored_list:
-        try:
-            ignored.add(git_common.hash_one(c))
-        except subprocess2.CalledProcessError as e:
-            # Custom warning string (the message from git-rev-parse is
-            # inappropriate).
+        info = reader.info(c)
+        if info is None:
             sys.stderr.write('warning: unknown revision \'%s\'.\n' % c)
+        else:
+            ignored.add(info[0])
 
     return hyper_blame(outbuf, ignored, filename, args.revision)
 
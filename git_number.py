@@ -71,13 +71,13 @@ def get_number_tree(prefix_bytes):
     """
     ref = '%s:%s' % (REF, pathlify(prefix_bytes))
 
-    try:
-        raw = git.run('cat-file', 'blob', ref, autostrip=False, decode=False)
-        return dict(
-            struct.unpack_from(CHUNK_FMT, raw, i * CHUNK_SIZE)
-            for i in range(len(raw) // CHUNK_SIZE))
-    except subprocess2.CalledProcessError:
+    obj = git.object_reader().read(ref)
+    if obj is None or obj[0] != 'blob':
         return {}
+    raw = obj[1]
+    return dict(
+        struct.unpack_from(CHUNK_FMT, raw, i * CHUNK_SIZE)
+        for i in range(len(raw) // CHUNK_SIZE))
 
 
 @git.memoize_one(threadsafe=False)
@@ -3,6 +3,7 @@
 # found in the LICENSE file.
 """Generic presubmit checks that can be reused by other presubmit checks."""
 
+import collections
 import datetime
 import functools
 import io as _io
@@ -239,6 +240,12 @@ def CheckAuthorizedAuthor(input_api, output_api, bot_allowlist=None):
 
 def CheckDoNotSubmitInFiles(input_api, output_api):
     """Checks that the user didn't add 'DO NOT ''SUBMIT' to any files."""
+    return _CheckLineRules(input_api, output_api,
+                           [_DoNotSubmitInFilesRule(input_api)])[0]
+
+
+def _DoNotSubmitInFilesRule(input_api):
+    """Returns the _LineRule of CheckDoNotSubmitInFiles."""
     # We want to check every text file, not just source files.
     file_filter = lambda x: x
 
@@ -252,22 +259,36 @@ def CheckDoNotSubmitInFiles(input_api, output_api):
         except UnicodeDecodeError:
             return True
 
-    errors = _FindNewViolationsOfRule(DoNotSubmitRule, input_api, file_filter)
-    text = '\n'.join('Found %s in %s' % (keyword, loc) for loc in errors)
-    if text:
-        return [output_api.PresubmitError(text)]
-    return []
+    def report(output_api, errors):
+        text = '\n'.join('Found %s in %s' % (keyword, loc) for loc in errors)
+        if text:
+            return [output_api.PresubmitError(text)]
+        return []
+
+    return _LineRule(DoNotSubmitRule,
+                     _GenerateAffectedFileExtList(input_api, file_filter),
+                     report)
 
 
 def CheckCorpLinksInFiles(input_api, output_api, source_file_filter=None):
     """Checks that files do not contain a corp link."""
-    errors = _FindNewViolationsOfRule(
-        lambda _, line: _CORP_LINK_KEYWORD not in line, input_api,
-        source_file_filter)
-    text = '\n'.join('Found corp link in %s' % loc for loc in errors)
-    if text:
-        return [output_api.PresubmitPromptWarning(text)]
-    return []
+    return _CheckLineRules(
+        input_api, output_api,
+        [_CorpLinksInFilesRule(input_api, source_file_filter)])[0]
+
+
+def _CorpLinksInFilesRule(input_api, source_file_filter):
+    """Returns the _LineRule of CheckCorpLinksInFiles."""
+
+    def report(output_api, errors):
+        text = '\n'.join('Found corp link in %s' % loc for loc in errors)
+        if text:
+            return [output_api.PresubmitPromptWarning(text)]
+        return []
+
+    return _LineRule(
+        lambda _, line: _CORP_LINK_KEYWORD not in line,
+        _GenerateAffectedFileExtList(input_api, source_file_filter), report)
 
 
 def CheckLargeScaleChange(input_api, output_api):
@@ -466,6 +487,91 @@ def _GenerateAffectedFileExtList(input_api, source_file_filter):
         yield (f, extension)
 
 
+# A per-line rule checked by _FindNewViolationsOfRules().
+#
+# callable_rule: a callable taking a file extension and line of input and
+#     returning True if the rule is satisfied and False if there was a problem.
+# file_ext_list: the (file, extension) tuples the rule applies to, as returned
+#     by _GenerateAffectedFileExtList().
+# report: a callable taking (output_api, errors) and returning the results of
+#     the check owning the rule. Only used by _CheckLineRules().
+# error_formatter: a callable taking (filename, line_number, line) and
+#     returning a formatted error string.
+_LineRule = collections.namedtuple(
+    '_LineRule', 'callable_rule file_ext_list report error_formatter')
+_LineRule.__new__.__defaults__ = (_ReportErrorFileAndLine, )
+
+
+def _FindNewViolationsOfRules(rules):
+    """Find all newly introduced violations of several per-line rules.
+
+    The contents of each affected file are walked once for all the rules that
+    apply to it, rather than once per rule.
+
+    Arguments:
+        rules: a list of _LineRule.
+
+    Returns:
+        A list with, for each rule, the list of newly-introduced violations it
+        reported.
+    """
+    # Group the rules by file. Each rule also keeps the order in which it lists
+    # its files, so that its errors are reported in that order.
+    files = {}
+    rule_files = [{} for _ in rules]
+    for index, rule in enumerate(rules):
+        for f, extension in rule.file_ext_list:
+            files.setdefault(f, []).append((index, extension))
+            rule_files[index][f] = None
+
+    # The errors of each rule, by file.
+    errors = [{} for _ in rules]
+    for f, file_rules in files.items():
+        # For speed, we do two passes, checking first the full file.  Shelling
+        # out to the SCM to determine the changed region can be quite expensive
+        # on Win32.  Assuming that most files will be kept problem-free, we can
+        # skip the SCM operations most of the time.
+        pending = file_rules
+        failed = []
+        for line in f.NewContents():
+            passed = []
+            for index, extension in pending:
+                if rules[index].callable_rule(extension, line):
+                    passed.append((index, extension))
+                else:
+                    failed.append((index, extension))
+            pending = passed
+            if not pending:
+                break
+        if not failed:
+            continue  # No violation found in full text: can skip considering diff.
+
+        failed.sort()
+        for line_num, line in f.ChangedContents():
+            for index, extension in failed:
+                rule = rules[index]
+                if not rule.callable_rule(extension, line):
+                    errors[index].setdefault(f, []).append(
+                        rule.error_formatter(f.LocalPath(), line_num, line))
+
+    return [[e for f in ordered_files for e in file_errors.get(f, [])]
+            for ordered_files, file_errors in zip(rule_files, errors)]
+
+
+def _CheckLineRules(input_api, output_api, rules):
+    """Runs the checks owning |rules| with a single pass over affected files.
+
+    Returns:
+        A list with, for each rule, the results of its check.
+    """
+    if input_api.no_diffs:
+        return [[] for _ in rules]
+    return [
+        rule.report(output_api, errors)
+        for rule, errors in zip(rules, _FindNewViolationsOfRules(rules))
+    ]
+
+
 def _FindNewViolationsOfRuleForList(callable_rule,
                                     file_ext_list,
                                     error_formatter=_ReportErrorFileAndLine):
@@ -485,20 +591,8 @@ def _FindNewViolationsOfRuleForList(callable_rule,
     Returns:
         A list of the newly-introduced violations reported by the rule.
     """
-    errors = []
-    for f, extension in file_ext_list:
-        # For speed, we do two passes, checking first the full file.  Shelling
-        # out to the SCM to determine the changed region can be quite expensive
-        # on Win32.  Assuming that most files will be kept problem-free, we can
-        # skip the SCM operations most of the time.
-        if all(callable_rule(extension, line) for line in f.NewContents()):
-            continue  # No violation found in full text: can skip considering diff.
-
-        for line_num, line in f.ChangedContents():
-            if not callable_rule(extension, line):
-                errors.append(error_formatter(f.LocalPath(), line_num, line))
-
-    return errors
+    return _FindNewViolationsOfRules(
+        [_LineRule(callable_rule, file_ext_list, None, error_formatter)])[0]
 
 
 def _FindNewViolationsOfRule(callable_rule,
@@ -530,6 +624,13 @@ def CheckChangeHasNoTabs(input_api, output_api, source_file_filter=None):
     """Checks that there are no tab characters in any of the text files to be
     submitted.
     """
+    return _CheckLineRules(
+        input_api, output_api,
+        [_ChangeHasNoTabsRule(input_api, source_file_filter)])[0]
+
+
+def _ChangeHasNoTabsRule(input_api, source_file_filter):
+    """Returns the _LineRule of CheckChangeHasNoTabs."""
     # In addition to the filter, make sure that makefiles are skipped.
     if not source_file_filter:
         # It's the default filter.
@@ -541,15 +642,17 @@ def CheckChangeHasNoTabs(input_api, output_api, source_file_filter=None):
                      or basename.endswith('.mk'))
                 and source_file_filter(affected_file))
 
-    tabs = _FindNewViolationsOfRule(lambda _, line: '\t' not in line, input_api,
-                                    filter_more)
+    def report(output_api, tabs):
+        if tabs:
+            return [
+                output_api.PresubmitPromptWarning('Found a tab character in:',
+                                                  long_text='\n'.join(tabs))
+            ]
+        return []
 
-    if tabs:
-        return [
-            output_api.PresubmitPromptWarning('Found a tab character in:',
-                                              long_text='\n'.join(tabs))
-        ]
-    return []
+    return _LineRule(lambda _, line: '\t' not in line,
+                     _GenerateAffectedFileExtList(input_api, filter_more),
+                     report)
 
 
 def CheckChangeTodoHasOwner(input_api, output_api, source_file_filter=None):
@@ -560,35 +663,60 @@ def CheckChangeTodoHasOwner(input_api, output_api, source_file_filter=None):
     modernTODO = ':\\s*[^\\s]+\\s*\\-'
     unowned_todo = input_api.re.compile('TODO(?!(%s|%s))' %
                                         (legacyTODO, modernTODO))
-    errors = _FindNewViolationsOfRule(lambda _, x: not unowned_todo.search(x),
-                                      input_api, source_file_filter)
-    errors = ['Found TODO with no owner in ' + x for x in errors]
-    if errors:
-        return [output_api.PresubmitPromptWarning('\n'.join(errors))]
-    return []
+
+    def report(output_api, errors):
+        errors = ['Found TODO with no owner in ' + x for x in errors]
+        if errors:
+            return [output_api.PresubmitPromptWarning('\n'.join(errors))]
+        return []
+
+    rule = _LineRule(
+        lambda _, x: not unowned_todo.search(x),
+        _GenerateAffectedFileExtList(input_api, source_file_filter), report)
+    return _CheckLineRules(input_api, output_api, [rule])[0]
 
 
 def CheckChangeHasNoStrayWhitespace(input_api,
                                     output_api,
                                     source_file_filter=None):
     """Checks that there is no stray whitespace at source lines end."""
-    errors = _FindNewViolationsOfRule(lambda _, line: line.rstrip() == line,
-                                      input_api, source_file_filter)
-    if errors:
-        return [
-            output_api.PresubmitPromptWarning(
-                'Found line ending with white spaces in:',
-                long_text='\n'.join(errors))
-        ]
-    return []
+    return _CheckLineRules(
+        input_api, output_api,
+        [_ChangeHasNoStrayWhitespaceRule(input_api, source_file_filter)])[0]
+
+
+def _ChangeHasNoStrayWhitespaceRule(input_api, source_file_filter):
+    """Returns the _LineRule of CheckChangeHasNoStrayWhitespace."""
+
+    def report(output_api, errors):
+        if errors:
+            return [
+                output_api.PresubmitPromptWarning(
+                    'Found line ending with white spaces in:',
+                    long_text='\n'.join(errors))
+            ]
+        return []
+
+    return _LineRule(
+        lambda _, line: line.rstrip() == line,
+        _GenerateAffectedFileExtList(input_api, source_file_filter), report)
 
 
 def CheckLongLines(input_api, output_api, maxlen, source_file_filter=None):
     """Checks that there aren't any lines longer than maxlen characters in any of
     the text files to be submitted.
     """
-    if input_api.no_diffs:
-        return []
+    return _CheckLineRules(
+        input_api, output_api,
+        [_LongLinesRule(input_api, maxlen, source_file_filter)])[0]
+
+
+def _LongLinesRule(input_api, maxlen, source_file_filter):
+    """Returns the _LineRule of CheckLongLines.
+
+    Python files are not covered by the rule itself, and are checked when the
+    rule reports its errors.
+    """
     maxlens = {
         'java': 100,
         # This is specifically for Android's handwritten makefiles (Android.mk).
@@ -711,29 +839,69 @@ def CheckLongLines(input_api, output_api, maxlen, source_file_filter=None):
     file_ext_list = list(
         _GenerateAffectedFileExtList(input_api, source_file_filter))
 
-    errors = []
-
     # For non-Python files, a simple line-based rule check is enough.
     non_py_file_ext_list = [
         x for x in file_ext_list if x[1] not in PY_FILE_EXTS
     ]
-    if non_py_file_ext_list:
-        errors += _FindNewViolationsOfRuleForList(no_long_lines,
-                                                  non_py_file_ext_list,
-                                                  error_formatter=format_error)
 
     # However, Python files need more sophisticated checks that need parsing
     # the whole source file.
     py_file_list = [x[0] for x in file_ext_list if x[1] in PY_FILE_EXTS]
-    if py_file_list:
-        errors += check_python_long_lines(py_file_list,
-                                          error_formatter=format_error)
-    if errors:
-        msg = 'Found %d lines longer than %s characters (first 5 shown).' % (
-            len(errors), maxlen)
-        return [output_api.PresubmitPromptWarning(msg, items=errors[:5])]
 
-    return []
+    def report(output_api, errors):
+        if py_file_list:
+            errors = errors + check_python_long_lines(
+                py_file_list, error_formatter=format_error)
+        if errors:
+            msg = 'Found %d lines longer than %s characters (first 5 shown).' % (
+                len(errors), maxlen)
+            return [output_api.PresubmitPromptWarning(msg, items=errors[:5])]
+        return []
+
+    return _LineRule(no_long_lines, non_py_file_ext_list, report, format_error)
+
+
+# The canned checks made of a single _LineRule, and the functions returning
+# their rule given the same arguments as the check, minus output_api.
+_LINE_RULE_CHECKS = {
+    CheckDoNotSubmitInFiles: _DoNotSubmitInFilesRule,
+    CheckCorpLinksInFiles: _CorpLinksInFilesRule,
+    CheckChangeHasNoTabs: _ChangeHasNoTabsRule,
+    CheckChangeHasNoStrayWhitespace: _ChangeHasNoStrayWhitespaceRule,
+    CheckLongLines: _LongLinesRule,
+}
+
+
+def _RunLineChecks(input_api, output_api, checks):
+    """Runs per-line canned checks with a single pass over affected files.
+
+    The checks are looked up in input_api.canned_checks. A check replaced
+    there, e.g. by --skip_canned, is called as is rather than having its rule
+    checked along with the others.
+
+    Args:
+        checks: a list of (name, args) tuples, where |name| is the name of a
+            canned check and |args| the arguments to pass it after input_api
+            and output_api.
+
+    Returns:
+        A list with, for each check, its results.
+    """
+    results = [None] * len(checks)
+    rules = []
+    rule_indices = []
+    for index, (name, args) in enumerate(checks):
+        check = getattr(input_api.canned_checks, name)
+        make_rule = _LINE_RULE_CHECKS.get(check)
+        if make_rule:
+            rules.append(make_rule(input_api, *args))
+            rule_indices.append(index)
+        else:
+            results[index] = check(input_api, output_api, *args)
+    for index, rule_results in zip(
+            rule_indices, _CheckLineRules(input_api, output_api, rules)):
+        results[index] = rule_results
+    return results
 
 
 def CheckLicense(input_api,
@@ -985,6 +1153,15 @@ def CheckDoNotSubmit(input_api, output_api):
             CheckDoNotSubmitInFiles(input_api, output_api))
 
 
+def _MarkUncacheable(input_api):
+    """Keeps the results of the running check out of the result cache.
+
+    Called by the checks whose results depend on the network rather than only
+    on the change.
+    """
+    input_api._uncacheable = True
+
+
 def CheckTreeIsOpen(input_api,
                     output_api,
                     url=None,
@@ -1003,6 +1180,7 @@ def CheckTreeIsOpen(input_api,
         closed: regex to match for closed status.
         json_url: url to download json style status.
     """
+    _MarkUncacheable(input_api)
     if not input_api.is_committing or \
         'PRESUBMIT_SKIP_NETWORK' in _os.environ:
         return []
@@ -1550,6 +1728,7 @@ def CheckOwnersDirMetadataExclusive(input_api, output_api):
 
 
 def CheckOwnersFormat(input_api, output_api):
+    _MarkUncacheable(input_api)
     if input_api.gerrit and input_api.gerrit.IsCodeOwnersEnabledOnRepo():
         return []
 
@@ -1569,6 +1748,7 @@ def CheckOwnersFormat(input_api, output_api):
 
 
 def CheckOwners(input_api, output_api, source_file_filter=None, allow_tbr=True):
+    _MarkUncacheable(input_api)
     # Skip OWNERS check when Owners-Override label is approved. This is intended
     # for global owners, trusted bots, and on-call sheriffs. Review is still
     # required for these changes.
@@ -1609,6 +1789,8 @@ def GetCodereviewOwnerAndReviewers(input_api,
         return None, (set() if approval_needed else _ReviewersFromChange(
             input_api.change))
 
+    _MarkUncacheable(input_api)
+
     owner_email = input_api.gerrit.GetChangeOwner(issue)
     reviewers = set(
         r for r in input_api.gerrit.GetChangeReviewers(issue, approval_needed)
@@ -1715,20 +1897,21 @@ def PanProjectChecks(input_api,
     except Exception as e:
         print('Failed to check owners - %s' % str(e))
 
-    snapshot("checking long lines")
-    results.extend(
-        input_api.canned_checks.CheckLongLines(input_api,
-                                               output_api,
-                                               maxlen,
-                                               source_file_filter=sources))
-    snapshot("checking tabs")
-    results.extend(
-        input_api.canned_checks.CheckChangeHasNoTabs(
-            input_api, output_api, source_file_filter=sources))
-    snapshot("checking stray whitespace")
-    results.extend(
-        input_api.canned_checks.CheckChangeHasNoStrayWhitespace(
-            input_api, output_api, source_file_filter=sources))
+    # The per-line checks share a single pass over the affected files. Their
+    # results are still reported in the usual order.
+    snapshot("checking per-line rules")
+    line_checks = [
+        ('CheckLongLines', (maxlen, sources)),
+        ('CheckChangeHasNoTabs', (sources, )),
+        ('CheckChangeHasNoStrayWhitespace', (sources, )),
+        ('CheckCorpLinksInFiles', (sources, )),
+    ]
+    if input_api.is_committing:
+        line_checks.append(('CheckDoNotSubmitInFiles', ()))
+    line_results = _RunLineChecks(input_api, output_api, line_checks)
+    results.extend(line_results[0])
+    results.extend(line_results[1])
+    results.extend(line_results[2])
     snapshot("checking license")
     results.extend(
         input_api.canned_checks.CheckLicense(input_api,
@@ -1736,10 +1919,7 @@ def PanProjectChecks(input_api,
                                              license_header,
                                              project_name,
                                              source_file_filter=sources))
-    snapshot("checking corp links in files")
-    results.extend(
-        input_api.canned_checks.CheckCorpLinksInFiles(
-            input_api, output_api, source_file_filter=sources))
+    results.extend(line_results[3])
     snapshot("checking large scale change")
     results.extend(
         input_api.canned_checks.CheckLargeScaleChange(input_api, output_api))
@@ -1765,10 +1945,7 @@ def PanProjectChecks(input_api,
             results.extend(
                 input_api.canned_checks.CheckCorpLinksInDescription(
                     input_api, output_api))
-        snapshot("checking do not submit in files")
-        results.extend(
-            input_api.canned_checks.CheckDoNotSubmitInFiles(
-                input_api, output_api))
+        results.extend(line_results[4])
 
     if global_checks:
         results.extend(
@@ -2253,6 +2430,8 @@ def CheckChangedLUCIConfigs(input_api, output_api):
         A list presubmit errors and/or warnings from the validation result of files
         in input_api.AffectedFiles()
     """
+    _MarkUncacheable(input_api)
+
     import json
     import logging
 
@@ -12,15 +12,21 @@ __version__ = '2.0.0'
 # change). We should add it as our presubmit scripts start feeling slow.
 
 import argparse
+import array
 import ast  # Exposed through the API.
+import collections
+import concurrent.futures
 import contextlib
+import copy
 import cpplint
 import fnmatch  # Exposed through the API.
 import glob
+import hashlib
 import inspect
 import json  # Exposed through the API.
 import logging
 import mimetypes
+import mmap
 import multiprocessing
 import os  # Somewhat exposed through the API.
 import random
@@ -169,8 +175,15 @@ class Timer(object):
 
 
 class ThreadPool(object):
-    def __init__(self, pool_size=None, timeout=None):
+    def __init__(self, pool_size=None, timeout=None, test_slots=None):
+        """Constructor.
+
+        Args:
+            test_slots: optional semaphore shared with other ThreadPools to
+                bound how many tests they run at once, in total.
+        """
         self.timeout = timeout
+        self._test_slots = test_slots
         self._pool_size = pool_size or multiprocessing.cpu_count()
         if sys.platform == 'win32':
             # TODO(crbug.com/1190269) - we can't use more than 56 child
@@ -224,10 +237,11 @@ class ThreadPool(object):
         """
         cmd = self._GetCommand(test)
         try:
-            start = time_time()
-            returncode, stdout = self._RunWithTimeout(cmd, test.stdin,
-                                                      test.kwargs)
-            duration = time_time() - start
+            with self._test_slots or contextlib.nullcontext():
+                start = time_time()
+                returncode, stdout = self._RunWithTimeout(
+                    cmd, test.stdin, test.kwargs)
+                duration = time_time() - start
         except Exception:
             duration = time_time() - start
             return test.message(
@@ -296,6 +310,97 @@ def normpath(path):
     return os.path.normpath(path)
 
 
+# The line boundaries recognized by str.splitlines().
+_LINE_BREAK_RE = re.compile('\r\n|[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]')
+
+
+class _Lines(object):
+    """The lines of a text, stored as the text and the bounds of each line.
+
+    This takes much less memory than a list of strings, which is only built
+    when the lines are asked for.
+    """
+    __slots__ = ('_text', '_bounds')
+
+    def __init__(self, text):
+        self._text = text
+        # Start and end offsets of each line, line breaks excluded.
+        self._bounds = array.array('q')
+        start = 0
+        for m in _LINE_BREAK_RE.finditer(text):
+            self._bounds.extend((start, m.start()))
+            start = m.end()
+        if start < len(text):
+            self._bounds.extend((start, len(text)))
+
+    def __len__(self):
+        return len(self._bounds) // 2
+
+    def Size(self):
+        """Returns the approximate memory used, in bytes."""
+        return len(self._text) + self._bounds.itemsize * len(self._bounds)
+
+    def ToList(self):
+        """Returns the lines as a list, like str.splitlines() would."""
+        text = self._text
+        bounds = self._bounds
+        return [text[bounds[i]:bounds[i + 1]] for i in range(0, len(bounds), 2)]
+
+    @classmethod
+    def FromFile(cls, path):
+        """Reads the lines of a file through a memory map.
+
+        Raises IOError if the file can't be read, e.g. if it doesn't exist.
+        """
+        with open(path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return cls('')
+            # The map is only used while decoding, so that the file is not kept
+            # open (and locked on Windows) afterwards.
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                return cls(str(m, 'utf-8', 'replace'))
+
+
+class _ContentsCache(object):
+    """A thread-safe LRU cache of the contents of affected files.
+
+    The number of files and the total size of their contents are bounded, so
+    that changes with many files don't keep all of them in memory. Evicted
+    contents are loaded again when needed.
+    """
+
+    def __init__(self, max_files, max_size):
+        self.max_files = max_files
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def Get(self, key):
+        """Returns the cached value for |key|, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def Set(self, key, value, size):
+        """Caches |value|, which takes |size| bytes of memory."""
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            if size > self.max_size:
+                return
+            self._entries[key] = (value, size)
+            self._size += size
+            while (len(self._entries) > self.max_files
+                   or self._size > self.max_size):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+
 def _RightHandSideLinesImpl(affected_files):
     """Implements RightHandSideLines for InputApi and GclChange."""
     for af in affected_files:
@@ -685,6 +790,14 @@ class InputApi(object):
         # Temporary files we must manually remove at the end of a run.
         self._named_temporary_files = []
 
+        # Whether RunTests deferred tests to the end of the run (--parallel),
+        # in which case the results of the check are not complete.
+        self._deferred_tests = False
+
+        # Whether a canned check talking to the network ran, in which case
+        # the results of the check may change even if the change doesn't.
+        self._uncacheable = False
+
         self.owners_client = None
         if self.gerrit and not 'PRESUBMIT_SKIP_NETWORK' in self.environ:
             try:
@@ -903,6 +1016,8 @@ class InputApi(object):
                 if not t.kwargs.get('cwd'):
                     t.kwargs['cwd'] = self.PresubmitLocalPath()
         self.thread_pool.AddTests(tests, parallel)
+        if self.parallel and tests:
+            self._deferred_tests = True
         # When self.parallel is True (i.e. --parallel is passed as an option)
         # RunTests doesn't actually run tests. It adds them to a ThreadPool that
         # will run all tests once all PRESUBMIT files are processed.
@@ -915,6 +1030,16 @@ class InputApi(object):
 class _DiffCache(object):
     """Caches diffs retrieved from a particular SCM."""
 
+    # Bounds of the contents of affected files kept in memory at once.
+    CONTENTS_CACHE_FILES = 1000
+    CONTENTS_CACHE_SIZE = 256 * 1024 * 1024
+
+    def __init__(self):
+        # The contents of the affected files of the change. They are released
+        # along with the change.
+        self.contents_cache = _ContentsCache(self.CONTENTS_CACHE_FILES,
+                                             self.CONTENTS_CACHE_SIZE)
+
     def GetDiff(self, path, local_root):
         """Get the diff for a particular path."""
         raise NotImplementedError()
@@ -923,31 +1048,53 @@ class _DiffCache(object):
         """Get the old version for a particular path."""
         raise NotImplementedError()
 
+    def SetPaths(self, paths):
+        """Sets the paths of the change, so their data can be fetched at once.
+        """
+        pass
+
 
 class _GitDiffCache(_DiffCache):
     """DiffCache implementation for git; gets all file diffs at once."""
 
+    # Maximum size of the old contents kept in memory, in characters.
+    OLD_CONTENTS_CACHE_SIZE = 64 * 1024 * 1024
+
     def __init__(self, upstream, end_commit):
         """Stores the upstream revision against which all diffs are computed."""
         super(_GitDiffCache, self).__init__()
         self._upstream = upstream
         self._end_commit = end_commit
         self._diffs_by_file = None
+        self._paths = []
+        # Blob id of the old version of each path, or None if there is none.
+        self._old_blob_ids = None
+        # Decoded old contents by blob id, least recently used first.
+        self._old_contents = collections.OrderedDict()
+        self._old_contents_size = 0
+        self._lock = threading.Lock()
+
+    def SetPaths(self, paths):
+        self._paths = list(paths)
 
     def GetDiff(self, path, local_root):
-        # Compare against None to distinguish between None and an initialized
-        # but empty dictionary.
-        if self._diffs_by_file == None:
-            # Don't specify any filenames below, because there are command line
-            # length limits on some platforms and GenerateDiff would fail.
-            unified_diff = scm.GIT.GenerateDiff(local_root,
-                                                files=[],
-                                                full_move=True,
-                                                branch=self._upstream,
-                                                branch_head=self._end_commit)
-            # Compute a single diff for all files and parse the output; with git
-            # this is much faster than computing one diff for each file.
-            self._diffs_by_file = _parse_unified_diff(unified_diff)
+        # Checks running in parallel must not each generate the diff.
+        with self._lock:
+            # Compare against None to distinguish between None and an
+            # initialized but empty dictionary.
+            if self._diffs_by_file == None:
+                # Don't specify any filenames below, because there are command
+                # line length limits on some platforms and GenerateDiff would
+                # fail.
+                unified_diff = scm.GIT.GenerateDiff(
+                    local_root,
+                    files=[],
+                    full_move=True,
+                    branch=self._upstream,
+                    branch_head=self._end_commit)
+                # Compute a single diff for all files and parse the output; with
+                # git this is much faster than computing one diff for each file.
+                self._diffs_by_file = _parse_unified_diff(unified_diff)
 
         if path not in self._diffs_by_file:
             # SCM didn't have any diff on this file. It could be that the file
@@ -959,7 +1106,34 @@ class _GitDiffCache(_DiffCache):
         return self._diffs_by_file[path]
 
     def GetOldContents(self, path, local_root):
-        return scm.GIT.GetOldContents(local_root, path, branch=self._upstream)
+        with self._lock:
+            if self._old_blob_ids is None:
+                # Look up the old blobs of all the files in the change at once,
+                # rather than one at a time as checks ask for them.
+                self._old_blob_ids = scm.GIT.GetOldBlobIds(
+                    local_root,
+                    set(self._paths) | {path},
+                    branch=self._upstream)
+            if path not in self._old_blob_ids:
+                self._old_blob_ids.update(
+                    scm.GIT.GetOldBlobIds(local_root, [path],
+                                          branch=self._upstream))
+            blob_id = self._old_blob_ids[path]
+            if blob_id is None:
+                return ''
+            if blob_id in self._old_contents:
+                self._old_contents.move_to_end(blob_id)
+                return self._old_contents[blob_id]
+
+            contents = scm.GIT.ReadBlob(local_root, blob_id)
+            # Only keep up to OLD_CONTENTS_CACHE_SIZE characters in memory.
+            if len(contents) <= self.OLD_CONTENTS_CACHE_SIZE:
+                self._old_contents[blob_id] = contents
+                self._old_contents_size += len(contents)
+                while self._old_contents_size > self.OLD_CONTENTS_CACHE_SIZE:
+                    _, evicted = self._old_contents.popitem(last=False)
+                    self._old_contents_size -= len(evicted)
+            return contents
 
 
 class _ProvidedDiffCache(_DiffCache):
@@ -1026,9 +1200,12 @@ class AffectedFile(object):
         self._action = action
         self._local_root = repository_root
         self._is_directory = None
-        self._cached_changed_contents = None
-        self._cached_new_contents = None
         self._diff_cache = diff_cache
+        if isinstance(diff_cache, _DiffCache):
+            self._contents_cache = diff_cache.contents_cache
+        else:
+            self._contents_cache = _ContentsCache(
+                _DiffCache.CONTENTS_CACHE_FILES, _DiffCache.CONTENTS_CACHE_SIZE)
         self._is_testable_file = None
         logging.debug('%s(%s)', self.__class__.__name__, self._path)
 
@@ -1089,20 +1266,17 @@ class AffectedFile(object):
         Contents will be empty if the file is a directory or does not exist.
         Note: The carriage returns (LF or CR) are stripped off.
         """
-        if self._cached_new_contents is None or flush_cache:
-            self._cached_new_contents = []
+        key = (self._path, 'new')
+        lines = None if flush_cache else self._contents_cache.Get(key)
+        if lines is None:
             try:
-                self._cached_new_contents = gclient_utils.FileRead(
-                    self.AbsoluteLocalPath(), 'rU').splitlines()
+                lines = _Lines.FromFile(self.AbsoluteLocalPath())
             except IOError:
-                pass  # File not found?  That's fine; maybe it was deleted.
-            except UnicodeDecodeError as e:
-                # log the filename since we're probably trying to read a binary
-                # file, and shouldn't be.
-                print('Error reading %s: %s' % (self.AbsoluteLocalPath(), e))
-                raise
+                # File not found?  That's fine; maybe it was deleted.
+                lines = _Lines('')
+            self._contents_cache.Set(key, lines, lines.Size())
 
-        return self._cached_new_contents[:]
+        return lines.ToList()
 
     def ChangedContents(self, keeplinebreaks=False):
         """Returns a list of tuples (line number, line text) of all new lines.
@@ -1112,9 +1286,12 @@ class AffectedFile(object):
 
         ^@@ <old line num>,<old size> <new line num>,<new size> @@$
         """
+        key = (self._path, 'changed')
         # Don't return cached results when line breaks are requested.
-        if not keeplinebreaks and self._cached_changed_contents is not None:
-            return self._cached_changed_contents[:]
+        if not keeplinebreaks:
+            cached = self._contents_cache.Get(key)
+            if cached is not None:
+                return cached[:]
         result = []
         line_num = 0
 
@@ -1132,8 +1309,9 @@ class AffectedFile(object):
         # Don't cache results with line breaks.
         if keeplinebreaks:
             return result
-        self._cached_changed_contents = result
-        return self._cached_changed_contents[:]
+        self._contents_cache.Set(key, result,
+                                 sum(len(line) for _, line in result))
+        return result[:]
 
     def __str__(self):
         return self.LocalPath()
@@ -1205,14 +1383,17 @@ class Change(object):
         # List of submodule paths in the repo.
         self._submodules = None
 
-        assert all((isinstance(f, (list, tuple)) and len(f) == 2)
-                   for f in files), files
-
+        # |files| may be a generator, so it is checked as it is consumed.
         diff_cache = self._diff_cache()
-        self._affected_files = [
-            self._AFFECTED_FILES(path, action.strip(), self._local_root,
-                                 diff_cache) for action, path in files
-        ]
+        self._affected_files = []
+        for f in files:
+            assert isinstance(f, (list, tuple)) and len(f) == 2, f
+            action, path = f
+            self._affected_files.append(
+                self._AFFECTED_FILES(path, action.strip(), self._local_root,
+                                     diff_cache))
+        logging.info('Found %d file(s).', len(self._affected_files))
+        diff_cache.SetPaths(f.LocalPath() for f in self._affected_files)
 
     def _diff_cache(self):
         return self._AFFECTED_FILES.DIFF_CACHE()
@@ -1649,6 +1830,164 @@ def DoPostUploadExecuter(change, gerrit_obj, verbose):
     return exit_code
 
 
+class PresubmitResultCache(object):
+    """Caches the results of presubmit functions in the git directory.
+
+    Results are keyed by the presubmit script, the function name, the committing
+    flag, the skipped canned checks and the contents of the change, i.e. its
+    description, upstream commit and affected files. A function is replayed
+    only if none of these changed.
+
+    The key covers all the affected files, not only those a function reads, so
+    editing any file reruns every function. This is deliberate: functions also
+    open files and run tests and linters outside of the InputApi, so the files
+    they read through it don't tell which files their results depend on.
+
+    The results of functions running canned checks that talk to the network,
+    e.g. to Gerrit or to check the tree status, are not cached. PRESUBMIT files
+    can list other functions that must always run in
+    PRESUBMIT_RESULT_CACHE_SKIP.
+    """
+
+    # Entries not used for that many seconds are removed.
+    MAX_AGE = 7 * 24 * 60 * 60
+
+    _RESULT_TYPES = {
+        cls.__name__: cls
+        for cls in (_PresubmitError, _PresubmitPromptWarning,
+                    _PresubmitNotifyResult, _MailTextResult)
+    }
+
+    def __init__(self, change, cache_dir, skip_canned=()):
+        self._change = change
+        self._cache_dir = cache_dir
+        self._skip_canned = sorted(set(skip_canned))
+        self._change_hash = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def ForChange(cls, change, skip_canned=()):
+        """Returns the cache for |change|, or None if it can't be cached.
+
+        |skip_canned| are the names of the canned checks disabled for this run.
+        """
+        if change.scm != 'git':
+            return None
+        root = change.RepositoryRoot()
+        try:
+            git_dir = scm.GIT.Capture(['rev-parse', '--git-common-dir'],
+                                      cwd=root)
+        except subprocess.CalledProcessError:
+            return None
+        cache = cls(change, os.path.join(root, git_dir, 'presubmit_results'),
+                    skip_canned)
+        cache.Prune()
+        return cache
+
+    def _ChangeHash(self):
+        with self._lock:
+            if self._change_hash is None:
+                h = hashlib.sha256()
+
+                def update(value):
+                    h.update(str(value).encode('utf-8', 'replace') + b'\0')
+
+                # Updating depot_tools may change what the checks report.
+                for path in (__file__, presubmit_canned_checks.__file__):
+                    update(path)
+                    with open(path, 'rb') as f:
+                        h.update(f.read())
+                update(self._change.FullDescriptionText())
+                update(self._change.author_email)
+                update(self._change.issue)
+                upstream = self._change.UpstreamBranch()
+                update(upstream and scm.GIT.ResolveCommit(
+                    self._change.RepositoryRoot(), upstream))
+                for f in self._change.AffectedFiles():
+                    update(f.Action())
+                    update(f.LocalPath())
+                    path = f.AbsoluteLocalPath()
+                    if os.path.isfile(path):
+                        with open(path, 'rb') as fh:
+                            h.update(hashlib.sha256(fh.read()).digest())
+                self._change_hash = h.hexdigest()
+            return self._change_hash
+
+    def Key(self, script_text, presubmit_path, function_name, *flags):
+        """Returns the key of a presubmit function for the current change."""
+        h = hashlib.sha256()
+        for value in (self._ChangeHash(), script_text, presubmit_path,
+                      function_name, self._skip_canned) + flags:
+            h.update(str(value).encode('utf-8', 'replace') + b'\0')
+        return h.hexdigest()
+
+    def Get(self, key):
+        """Returns the cached (results, more_cc) for |key|, or None."""
+        path = os.path.join(self._cache_dir, key + '.json')
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            results = [
+                self._RESULT_TYPES[r['type']](r['message'],
+                                              r['items'],
+                                              r['long_text'],
+                                              show_callstack=False)
+                for r in entry['results']
+            ]
+            more_cc = entry['more_cc']
+        except (IOError, ValueError, KeyError, TypeError):
+            return None
+        # Mark the entry as used, so that it is not pruned.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return results, more_cc
+
+    def Set(self, key, results, more_cc):
+        """Stores the results of a presubmit function, if they can be."""
+        entry = {'results': [], 'more_cc': list(more_cc)}
+        for r in results:
+            if self._RESULT_TYPES.get(type(r).__name__) is not type(r):
+                return
+            entry['results'].append({
+                'type': type(r).__name__,
+                'message': r._message,
+                'items': [str(item) for item in r._items],
+                'long_text': r._long_text,
+            })
+        try:
+            data = json.dumps(entry)
+        except (TypeError, ValueError) as e:
+            logging.warning('Failed to cache presubmit results: %s', e)
+            return
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w',
+                                             dir=self._cache_dir,
+                                             suffix='.tmp',
+                                             delete=False) as f:
+                f.write(data)
+            os.replace(f.name, os.path.join(self._cache_dir, key + '.json'))
+        except (IOError, OSError) as e:
+            logging.warning('Failed to cache presubmit results: %s', e)
+
+    def Prune(self):
+        """Removes the entries that were not used recently."""
+        try:
+            names = os.listdir(self._cache_dir)
+        except OSError:
+            return
+        cutoff = time_time() - self.MAX_AGE
+        for name in names:
+            path = os.path.join(self._cache_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
 class PresubmitExecuter(object):
     def __init__(self,
                  change,
@@ -1658,7 +1997,9 @@ class PresubmitExecuter(object):
                  dry_run=None,
                  thread_pool=None,
                  parallel=False,
-                 no_diffs=False):
+                 no_diffs=False,
+                 parallel_checks=False,
+                 result_cache=None):
         """
         Args:
             change: The Change object.
@@ -1670,6 +2011,11 @@ class PresubmitExecuter(object):
                 PRESUBMIT files will be run in parallel.
             no_diffs: if true, implies that --files or --all was specified so some
                 checks can be skipped, and some errors will be messages.
+            parallel_checks: if true, the Check functions of each PRESUBMIT
+                file will be run concurrently. PRESUBMIT files can also opt in
+                with PRESUBMIT_VERSION 3.0.0 or later.
+            result_cache: a PresubmitResultCache to replay the results of
+                functions from, if any.
         """
         self.change = change
         self.committing = committing
@@ -1680,6 +2026,9 @@ class PresubmitExecuter(object):
         self.thread_pool = thread_pool
         self.parallel = parallel
         self.no_diffs = no_diffs
+        self.parallel_checks = parallel_checks
+        self.result_cache = result_cache
+        self._sink_lock = threading.Lock()
 
     def ExecPresubmitScript(self, script_text, presubmit_path):
         """Executes a single presubmit script.
@@ -1729,6 +2078,7 @@ class PresubmitExecuter(object):
                                    (presubmit_path, e))
 
         context['__args'] = (input_api, output_api)
+        context['__script_text'] = script_text
 
         # Get path of presubmit directory relative to repository root.
         # Always use forward slashes, so that path is same in *nix and Windows
@@ -1761,6 +2111,7 @@ class PresubmitExecuter(object):
                     # iteration" exception if checks add globals to context.
                     # E.g. sometimes the Python runtime will add
                     # __warningregistry__.
+                    function_names = []
                     for function_name in list(context.keys()):
                         if not function_name.startswith('Check'):
                             continue
@@ -1769,6 +2120,16 @@ class PresubmitExecuter(object):
                             continue
                         if function_name.endswith('Upload') and self.committing:
                             continue
+                        function_names.append(function_name)
+
+                    if self.parallel_checks or version >= [3, 0, 0]:
+                        results.extend(
+                            self._run_check_functions_in_parallel(
+                                function_names, context, sink, presubmit_path,
+                                input_api))
+                        function_names = []
+
+                    for function_name in function_names:
                         logging.debug('Running %s in %s', function_name,
                                       presubmit_path)
                         results.extend(
@@ -1805,21 +2166,87 @@ class PresubmitExecuter(object):
 
         return results
 
-    def _run_check_function(self, function_name, context, sink, presubmit_path):
+    def _run_check_functions_in_parallel(self, function_names, context, sink,
+                                         presubmit_path, input_api):
+        """Evaluates the given presubmit functions concurrently.
+
+        Each function gets its own OutputApi, so that CCs are collected per
+        check, and its own ThreadPool for the tests it runs, unless those are
+        all deferred with --parallel. The ThreadPools of the functions have the
+        size and timeout of input_api.thread_pool, and together run no more
+        tests at once than its size. The functions share the working directory of the
+        presubmit script, so scripts are still run one at a time.
+
+        Returns:
+            the results of the presubmit functions, in the order of
+            |function_names|.
+        """
+
+        shared_pool = input_api.thread_pool
+        test_slots = threading.BoundedSemaphore(shared_pool._pool_size)
+
+        def run(function_name):
+            check_input_api = copy.copy(input_api)
+            if not self.parallel:
+                check_input_api.thread_pool = ThreadPool(
+                    shared_pool._pool_size, shared_pool.timeout, test_slots)
+            check_output_api = OutputApi(self.committing)
+            logging.debug('Running %s in %s', function_name, presubmit_path)
+            result = self._run_check_function(
+                function_name, context, sink, presubmit_path,
+                (check_input_api, check_output_api))
+            logging.debug('Running %s done.', function_name)
+            return result, check_output_api.more_cc
+
+        results = []
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=shared_pool._pool_size) as executor:
+            for result, more_cc in executor.map(run, function_names):
+                results.extend(result)
+                self.more_cc.extend(more_cc)
+        return results
+
+    def _run_check_function(self,
+                            function_name,
+                            context,
+                            sink,
+                            presubmit_path,
+                            args=None):
         """Evaluates and returns the result of a given presubmit function.
 
         If sink is given, the result of the presubmit function will be reported
-        to the ResultSink.
+        to the ResultSink. If the executer has a result cache, the result is
+        replayed from it when possible, and stored into it otherwise.
 
         Args:
             function_name: the name of the presubmit function to evaluate
             context: a context dictionary in which the function will be evaluated
             sink: an instance of ResultSink. None, by default.
+            args: the (input_api, output_api) to call the function with. The
+                ones stored in context['__args'] are used by default.
         Returns:
             the result of the presubmit function call.
         """
         start_time = time_time()
 
+        if args is None:
+            args = context['__args']
+        cache_key = None
+        if (self.result_cache and function_name not in context.get(
+                'PRESUBMIT_RESULT_CACHE_SKIP', ())):
+            cache_key = self.result_cache.Key(context['__script_text'],
+                                              presubmit_path, function_name,
+                                              self.committing, self.dry_run,
+                                              self.no_diffs, self.verbose)
+            cached = self.result_cache.Get(cache_key)
+            if cached is not None:
+                result, more_cc = cached
+                args[1].more_cc.extend(more_cc)
+                logging.debug('Replayed cached results of %s.', function_name)
+                self._report_to_sink(sink, function_name, result,
+                                     time_time() - start_time)
+                return result
+
         def _progress_loop(event):
             while not event.is_set():
                 if event.wait(timeout=30):
@@ -1832,9 +2259,20 @@ class PresubmitExecuter(object):
         event_thread.daemon = True
         event_thread.start()
 
+        input_api, output_api = args
+        input_api._deferred_tests = False
+        input_api._uncacheable = False
+        more_cc = list(output_api.more_cc)
         try:
-            result = eval(function_name + '(*__args)', context)
+            result = eval(function_name + '(*__args)', context,
+                          {'__args': args})
             self._check_result_type(result)
+            # Results can't be replayed if tests were deferred to the end of
+            # the run, or if they depend on the network.
+            if (cache_key and not input_api._deferred_tests
+                    and not input_api._uncacheable):
+                self.result_cache.Set(cache_key, result,
+                                      output_api.more_cc[len(more_cc):])
         except Exception:
             _, e_value, _ = sys.exc_info()
             result = [
@@ -1850,12 +2288,16 @@ class PresubmitExecuter(object):
         if elapsed_time > 10.0:
             sys.stdout.write('%6.1fs to run %s from %s.\n' %
                              (elapsed_time, function_name, presubmit_path))
-        if sink:
-            status, failure_reason = RDBStatusFrom(result)
-            sink.report(function_name, status, elapsed_time, failure_reason)
+        self._report_to_sink(sink, function_name, result, elapsed_time)
 
         return result
 
+    def _report_to_sink(self, sink, function_name, result, elapsed_time):
+        if sink:
+            status, failure_reason = RDBStatusFrom(result)
+            with self._sink_lock:
+                sink.report(function_name, status, elapsed_time, failure_reason)
+
     def _check_result_type(self, result):
         """Helper function which ensures result is a list, and all elements are
         instances of OutputApi.PresubmitResult"""
@@ -1895,7 +2337,10 @@ def DoPresubmitChecks(change,
                       dry_run=None,
                       parallel=False,
                       json_output=None,
-                      no_diffs=False):
+                      no_diffs=False,
+                      parallel_checks=False,
+                      result_cache=False,
+                      skip_canned=()):
     """Runs all presubmit checks that apply to the files in the change.
 
     This finds all PRESUBMIT.py files in directories enclosing the files in the
@@ -1918,6 +2363,11 @@ def DoPresubmitChecks(change,
             PRESUBMIT files will be run in parallel.
         no_diffs: if true, implies that --files or --all was specified so some
             checks can be skipped, and some errors will be messages.
+        parallel_checks: if true, the Check functions of each PRESUBMIT file
+            will be run concurrently.
+        result_cache: if true, the results of presubmit functions are cached in
+            the git directory and replayed when the change did not change.
+        skip_canned: the names of the canned checks disabled for this run.
     Return:
         1 if presubmit checks failed or 0 otherwise.
     """
@@ -1934,8 +2384,11 @@ def DoPresubmitChecks(change,
             sys.stdout.write('Warning, no PRESUBMIT.py found.\n')
         results = []
         thread_pool = ThreadPool()
-        executer = PresubmitExecuter(change, committing, verbose, gerrit_obj,
-                                     dry_run, thread_pool, parallel, no_diffs)
+        executer = PresubmitExecuter(
+            change, committing, verbose, gerrit_obj, dry_run, thread_pool,
+            parallel, no_diffs, parallel_checks,
+            PresubmitResultCache.ForChange(change, skip_canned)
+            if result_cache else None)
         if default_presubmit:
             if verbose:
                 sys.stdout.write('Running default presubmit script.\n')
@@ -2117,10 +2570,10 @@ def _parse_change(parser, options):
     elif options.diff_file:
         diff, change_files = _process_diff_file(options.diff_file)
     else:
-        change_files = scm.GIT.CaptureStatus(options.root,
-                                             options.upstream or None,
-                                             ignore_submodules=False)
-    logging.info('Found %d file(s).', len(change_files))
+        # Streamed straight into the Change, without an intermediate list.
+        change_files = scm.GIT.IterStatus(options.root,
+                                          options.upstream or None,
+                                          ignore_submodules=False)
 
     change_args = [
         options.name, options.description, options.root, change_files,
@@ -2353,6 +2806,18 @@ def main(argv=None):
                         action='store_true',
                         help='Run all tests specified by input_api.RunTests in '
                         'all PRESUBMIT files in parallel.')
+    parser.add_argument('--parallel_checks',
+                        action='store_true',
+                        help='Run the Check functions of each PRESUBMIT file '
+                        'in parallel.')
+    parser.add_argument(
+        '--result_cache',
+        action='store_true',
+        default=bool(os.environ.get('DEPOT_TOOLS_PRESUBMIT_RESULT_CACHE')),
+        help='Replay the results of presubmit functions from a '
+        'cache in the git directory when nothing they could '
+        'observe changed. Enabled by default when '
+        'DEPOT_TOOLS_PRESUBMIT_RESULT_CACHE is set.')
     parser.add_argument('--json_output',
                         help='Write presubmit errors to json output.')
     parser.add_argument('--all_files',
@@ -2396,11 +2861,12 @@ def main(argv=None):
         if options.post_upload:
             return DoPostUploadExecuter(change, gerrit_obj, options.verbose)
         with canned_check_filter(options.skip_canned):
-            return DoPresubmitChecks(change, options.commit, options.verbose,
-                                     options.default_presubmit,
-                                     options.may_prompt, gerrit_obj,
-                                     options.dry_run, options.parallel,
-                                     options.json_output, options.no_diffs)
+            return DoPresubmitChecks(
+                change, options.commit, options.verbose,
+                options.default_presubmit, options.may_prompt, gerrit_obj,
+                options.dry_run, options.parallel, options.json_output,
+                options.no_diffs, options.parallel_checks, options.result_cache,
+                options.skip_canned)
     except PresubmitFailure as e:
         import utils
         print(e, file=sys.stderr)
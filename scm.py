@@ -7,11 +7,15 @@ from __future__ import annotations
 
 import abc
 import contextlib
+import hashlib
+import json
 import os
 import pathlib
 import platform
 import re
+import tempfile
 import threading
+import time
 
 from collections import defaultdict
 from itertools import chain
@@ -376,20 +380,155 @@ class CachedGitConfigState(object):
 class GitConfigStateReal(GitConfigStateBase):
     """GitConfigStateReal implements CachedGitConfigState by actually interacting with
     the git configuration files on disk via GIT.Capture.
+
+    If $DEPOT_TOOLS_GIT_CONFIG_SNAPSHOT is set to 1, the parsed configuration
+    is also saved on disk, and reused by later processes until one of the
+    files it was read from changes.
     """
 
     _GLOBAL_LOCK = threading.Lock()
 
+    SNAPSHOT_ENV_VAR = 'DEPOT_TOOLS_GIT_CONFIG_SNAPSHOT'
+
     def __init__(self, root: pathlib.Path):
         super().__init__()
         self.root = root
 
+    def _snapshot_path(self) -> Optional[str]:
+        """Returns where the config snapshot of this root is saved, or None if
+        snapshots are disabled."""
+        if os.environ.get(self.SNAPSHOT_ENV_VAR) != '1':
+            return None
+        # Which files git reads depends on the root and on these variables.
+        env = sorted(
+            (k, v) for k, v in os.environ.items()
+            if k in ('HOME', 'XDG_CONFIG_HOME') or k.startswith('GIT_'))
+        key = json.dumps([str(pathlib.Path(self.root).absolute()), env])
+        cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+            os.path.expanduser('~'), '.cache')
+        return os.path.join(cache_home, 'depot_tools', 'git_config',
+                            hashlib.sha256(key.encode()).hexdigest() + '.json')
+
+    def _candidate_config_files(self) -> list[str]:
+        """Returns config files git reads which may not exist yet."""
+        xdg_config_home = os.environ.get('XDG_CONFIG_HOME') or os.path.join(
+            os.path.expanduser('~'), '.config')
+        files = [
+            os.environ.get('GIT_CONFIG_GLOBAL')
+            or os.path.join(os.path.expanduser('~'), '.gitconfig'),
+            os.path.join(xdg_config_home, 'git', 'config'),
+        ]
+        try:
+            # git only tells where the system config is, including when it
+            # doesn't exist, by opening it in an editor.
+            env = os.environ.copy()
+            env['GIT_EDITOR'] = 'echo'
+            files.append(
+                GIT.Capture(['config', '--system', '--edit'],
+                            cwd=self.root,
+                            env=env))
+        except subprocess2.CalledProcessError:
+            pass
+        try:
+            git_paths = GIT.Capture([
+                'rev-parse', '--git-path', 'config', '--git-path',
+                'config.worktree'
+            ],
+                                    cwd=self.root)
+            files.extend(
+                os.path.join(self.root, f) for f in git_paths.splitlines())
+        except subprocess2.CalledProcessError:
+            pass
+        return [os.path.abspath(f) for f in files]
+
+    @staticmethod
+    def _files_state(paths: Iterable[str]) -> list[list[Any]]:
+        state = []
+        for path in sorted(set(paths)):
+            try:
+                st = os.stat(path)
+                state.append([path, st.st_mtime_ns, st.st_size])
+            except OSError:
+                state.append([path, None, None])
+        return state
+
+    def _read_snapshot(self, path: str) -> Optional[GitFlatConfigData]:
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+            files = [entry[0] for entry in snapshot['files']]
+            if self._files_state(files) == snapshot['files']:
+                return snapshot['config']
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            pass
+        return None
+
+    def _write_snapshot(self, path: str, files_before: list[list[Any]],
+                        started: int, origins: Iterable[str],
+                        cfg: GitFlatConfigData):
+        """Saves |cfg| read from |origins|.
+
+        |files_before| is the state of the candidate config files before git
+        read the config, which started at |started| (in ns). Nothing is saved
+        if any file may have changed since git read it, since the snapshot
+        would then be newer than the config it holds.
+        """
+        files = [entry[0] for entry in files_before]
+        for origin in origins:
+            # Other origins are e.g. 'command line:' and 'blob:<blob>'.
+            if origin.startswith('file:'):
+                files.append(
+                    os.path.abspath(
+                        os.path.join(self.root, origin[len('file:'):])))
+        candidates = set(entry[0] for entry in files_before)
+        files_state = self._files_state(files)
+        for entry in files_state:
+            if entry[0] in candidates:
+                if entry not in files_before:
+                    return
+            # Files only known from the origins, e.g. included files, were not
+            # stat'ed before git read them, so they must not have been modified
+            # since, allowing for coarse file timestamps.
+            elif entry[1] is None or entry[1] >= started - 2 * 10**9:
+                return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'files': files_state, 'config': cfg}, f)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def _drop_snapshot(self):
+        path = self._snapshot_path()
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
     def load_config(self) -> GitFlatConfigData:
+        snapshot_path = self._snapshot_path()
+        if snapshot_path:
+            snapshot = self._read_snapshot(snapshot_path)
+            if snapshot is not None:
+                return snapshot
+            # Stat the files before git reads them, to tell whether they
+            # change while it does.
+            files_before = self._files_state(self._candidate_config_files())
+            started = time.time_ns()
+
         # NOTE: `git config --list` already canonicalizes keys.
         try:
             gitConfigCmd = ['config', '--list', '-z', '--show-scope']
             if git_common.get_git_version() <= (2, 25):
                 gitConfigCmd = ['config', '--list', '-z']
+                snapshot_path = None
+            elif snapshot_path:
+                # The files the config was read from tell when the snapshot
+                # becomes stale.
+                gitConfigCmd.append('--show-origin')
 
             rawConfig = GIT.Capture(gitConfigCmd,
                                     cwd=self.root,
@@ -411,17 +550,28 @@ class GitConfigStateReal(GitConfigStateBase):
             if scope != "default":
                 cfg["default"][key].append(value)
 
+        show_scope = '--show-scope' in gitConfigCmd
+        origins = set()
         i = 0
         while i < len(entries):
-            if entries[i] in ['local', 'global', 'system']:
-                scope = entries[i]
-                i += 1
-                if i < len(entries):
-                    process_entry(entries[i], scope)
-            else:
+            if not show_scope:
                 process_entry(entries[i], "default")
+                i += 1
+                continue
+            # Every entry starts with its scope and, if asked for, its origin,
+            # including scopes newer versions of git may add.
+            scope = entries[i]
+            i += 1
+            if snapshot_path and i < len(entries):
+                origins.add(entries[i])
+                i += 1
+            if i < len(entries):
+                process_entry(entries[i], scope)
             i += 1
 
+        if snapshot_path:
+            self._write_snapshot(snapshot_path, files_before, started, origins,
+                                 cfg)
         return cfg
 
     def set_config(self, key: str, value: str, *, append: bool,
@@ -432,6 +582,7 @@ class GitConfigStateReal(GitConfigStateBase):
             args.append('--add')
         with self._scope_lock(scope):
             GIT.Capture(args, cwd=self.root)
+        self._drop_snapshot()
 
     def set_config_multi(self, key: str, value: str, *,
                          value_pattern: Optional[str], scope: GitConfigScope):
@@ -441,6 +592,7 @@ class GitConfigStateReal(GitConfigStateBase):
             args.append(value_pattern)
         with self._scope_lock(scope):
             GIT.Capture(args, cwd=self.root)
+        self._drop_snapshot()
 
     def unset_config(self, key: str, *, scope: GitConfigScope,
                      missing_ok: bool):
@@ -451,6 +603,7 @@ class GitConfigStateReal(GitConfigStateBase):
                 GIT.Capture(['config', f'--{scope}', '--unset', key],
                             cwd=self.root,
                             accepted_retcodes=accepted_retcodes)
+            self._drop_snapshot()
         except subprocess2.CalledProcessError as cpe:
             if cpe.returncode == 5:
                 if b'multiple values' in cpe.stderr:
@@ -470,6 +623,7 @@ class GitConfigStateReal(GitConfigStateBase):
                 GIT.Capture(args,
                             cwd=self.root,
                             accepted_retcodes=accepted_retcodes)
+            self._drop_snapshot()
         except subprocess2.CalledProcessError as cpe:
             if cpe.returncode == 5:
                 raise GitConfigUnsetMissingValue(key, scope)
@@ -707,7 +861,12 @@ class GIT(object):
         kwargs.setdefault('env', GIT.ApplyEnvVars(kwargs))
         kwargs.setdefault('cwd', cwd)
         kwargs.setdefault('autostrip', strip_out)
-        return git_common.run(*args, **kwargs)
+        cmd = ['git'] + list(args)
+        with gclient_utils.TraceSpan(gclient_utils.TraceCommandName(cmd),
+                                     'git',
+                                     argv=cmd,
+                                     cwd=kwargs['cwd']):
+            return git_common.run(*args, **kwargs)
 
     @staticmethod
     def CaptureStatus(
@@ -718,6 +877,22 @@ class GIT(object):
         """Returns git status.
 
         Returns an array of (status, file) tuples."""
+        return list(
+            GIT.IterStatus(cwd,
+                           upstream_branch,
+                           end_commit=end_commit,
+                           ignore_submodules=ignore_submodules))
+
+    @staticmethod
+    def IterStatus(cwd: str,
+                   upstream_branch: str,
+                   end_commit: Optional[str] = None,
+                   ignore_submodules: bool = True) -> Iterator[tuple[str, str]]:
+        """Yields the (status, file) tuples of git status.
+
+        The NUL-delimited output of git is parsed as it is read, so this works
+        for changes with any number of files, and for paths with newlines.
+        """
         if end_commit is None:
             end_commit = ''
         if upstream_branch is None:
@@ -727,27 +902,51 @@ class GIT(object):
 
         command = [
             '-c', 'core.quotePath=false', 'diff', '--name-status',
-            '--no-renames'
+            '--no-renames', '-z'
         ]
         if ignore_submodules:
             command.append('--ignore-submodules=all')
         command.extend(['-r', '%s...%s' % (upstream_branch, end_commit)])
 
-        status = GIT.Capture(command, cwd)
-        assert isinstance(status, str)
-        results = []
-        if status:
-            for statusline in status.splitlines():
-                # 3-way merges can cause the status can be 'MMM' instead of 'M'.
-                # This can happen when the user has 2 local branches and he
-                # diffs between these 2 branches instead diffing to upstream.
-                m = re.match(r'^(\w)+\t(.+)$', statusline)
-                if not m:
-                    raise gclient_utils.Error(
-                        'status currently unsupported: %s' % statusline)
-                # Only grab the first letter.
-                results.append(('%s      ' % m.group(1)[0], m.group(2)))
-        return results
+        cmd = [git_common.GIT_EXE] + command
+        # stderr goes to a file rather than a pipe, so that git can't block on
+        # it while stdout is being read.
+        with gclient_utils.TraceSpan(gclient_utils.TraceCommandName(cmd),
+                                     'git',
+                                     argv=cmd,
+                                     cwd=cwd), \
+                tempfile.TemporaryFile() as stderr:
+            proc = subprocess2.Popen(cmd,
+                                     cwd=cwd,
+                                     env=GIT.ApplyEnvVars({}),
+                                     stdout=subprocess2.PIPE,
+                                     stderr=stderr)
+            complete = False
+            try:
+                tokens = git_common.iter_nul_delimited(proc.stdout)
+                for status in tokens:
+                    # 3-way merges can cause the status can be 'MMM' instead of
+                    # 'M'. This can happen when the user has 2 local branches
+                    # and he diffs between these 2 branches instead diffing to
+                    # upstream.
+                    status = status.decode('utf-8', 'replace')
+                    path = next(tokens, None)
+                    if not re.match(r'^\w+$', status) or path is None:
+                        raise gclient_utils.Error(
+                            'status currently unsupported: %s' % status)
+                    # Only grab the first letter.
+                    yield ('%s      ' % status[0],
+                           path.decode('utf-8', 'replace'))
+                complete = True
+            finally:
+                # Closing the pipe first lets git exit if the caller stopped
+                # early.
+                proc.stdout.close()
+                retcode = proc.wait()
+            if complete and retcode:
+                stderr.seek(0)
+                raise subprocess2.CalledProcessError(retcode, cmd, cwd, b'',
+                                                     stderr.read())
 
     @staticmethod
     def GetConfig(cwd: str,
@@ -1009,11 +1208,41 @@ class GIT(object):
         if platform.system() == 'Windows':
             # git show <sha>:<path> wants a posix path.
             filename = filename.replace('\\', '/')
-        command = ['show', '%s:%s' % (branch, filename)]
-        try:
-            return GIT.Capture(command, cwd=cwd, strip_out=False)
-        except subprocess2.CalledProcessError:
+        obj = git_common.object_reader(cwd).read('%s:%s' % (branch, filename))
+        if obj is None or obj[0] != 'blob':
+            return ''
+        return obj[1].decode('utf-8', 'replace')
+
+    @staticmethod
+    def GetOldBlobIds(cwd: str,
+                      filenames: Iterable[str],
+                      branch: Optional[str] = None) -> Dict[str, Optional[str]]:
+        """Returns the blob ids of |filenames| in |branch|, as GetOldContents
+        would read them, in a single batch.
+
+        Files that don't exist in |branch| or are not blobs map to None.
+        """
+        if not branch:
+            branch = GIT.GetUpstreamBranch(cwd)
+        filenames = list(filenames)
+        revs = []
+        for filename in filenames:
+            if platform.system() == 'Windows':
+                filename = filename.replace('\\', '/')
+            revs.append('%s:%s' % (branch, filename))
+        infos = git_common.object_reader(cwd).info_batch(revs)
+        return {
+            filename: info[0] if info and info[1] == 'blob' else None
+            for filename, info in zip(filenames, infos)
+        }
+
+    @staticmethod
+    def ReadBlob(cwd: str, blob_id: str) -> str:
+        """Returns the contents of a blob, or '' if it doesn't exist."""
+        obj = git_common.object_reader(cwd).read(blob_id)
+        if obj is None or obj[0] != 'blob':
             return ''
+        return obj[1].decode('utf-8', 'replace')
 
     @staticmethod
     def GenerateDiff(cwd: str,
@@ -187,6 +187,10 @@ def main():
     with io.open(args.ensure_file, 'r', encoding='utf-8') as f:
         new_content = parse_cipd(args.root, f.readlines())
 
+    # Like cipd, keep its state in a .cipd directory under the root.
+    if not os.path.exists(os.path.join(args.root, '.cipd')):
+        os.makedirs(os.path.join(args.root, '.cipd'))
+
     # Install new packages
     for path, packages in new_content.items():
         if not os.path.exists(path):
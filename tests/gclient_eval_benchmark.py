@@ -0,0 +1,106 @@
+#!/usr/bin/env vpython3
+# Copyright (c) 2026 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Benchmarks gclient_eval.Parse on a synthetic DEPS file.
+
+Compares gclient_eval.Parse in the working tree against gclient_eval.Parse as
+of a baseline revision. This is not a test and is not run by the presubmit. Run
+it by hand when changing how gclient_eval evaluates or validates DEPS files.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import timeit
+import types
+
+DEPOT_TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DEPOT_TOOLS_DIR)
+
+import metrics_utils
+# We have to disable monitoring before importing gclient.
+metrics_utils.COLLECT_METRICS = False
+
+import gclient_eval
+
+
+def make_deps(num_vars, num_deps, num_hooks):
+    """Returns a DEPS file with a mix of git and CIPD deps and hooks."""
+    lines = ['vars = {']
+    lines.extend('  "rev_%d": "%040x",' % (i, i) for i in range(num_vars))
+    lines.extend([
+        '  "checkout_foo": False,',
+        '  "chromium_git": "https://chromium.googlesource.com",',
+        '}',
+        'deps = {',
+    ])
+    for i in range(num_deps):
+        if i % 3 == 0:
+            lines.append('  "src/dep%d": Var("chromium_git") + "/dep%d.git"'
+                         ' + "@" + Var("rev_%d"),' % (i, i, i % num_vars))
+        elif i % 3 == 1:
+            lines.extend([
+                '  "src/dep%d": {' % i,
+                '    "url": "{chromium_git}/dep%d.git@{rev_%d}",' %
+                (i, i % num_vars),
+                '    "condition": "checkout_linux and not checkout_foo",',
+                '  },',
+            ])
+        else:
+            lines.extend([
+                '  "src/cipd%d": {' % i,
+                '    "packages": [{"package": "p%d", "version": "v"}],' % i,
+                '    "dep_type": "cipd",',
+                '    "condition": "host_os == \\"linux\\"",',
+                '  },',
+            ])
+    lines.append('}')
+    lines.append('hooks = [')
+    lines.extend('  {"name": "hook%d", "pattern": ".", '
+                 '"action": ["python3", "hook%d.py"]},' % (i, i)
+                 for i in range(num_hooks))
+    lines.append(']')
+    return ''.join(l + '\n' for l in lines)
+
+
+def load_baseline(revision):
+    """Returns gclient_eval as of |revision| as a separate module."""
+    source = subprocess.check_output(
+        ['git', 'show', '%s:gclient_eval.py' % revision], cwd=DEPOT_TOOLS_DIR)
+    module = types.ModuleType('gclient_eval_baseline')
+    module.__file__ = os.path.join(DEPOT_TOOLS_DIR, 'gclient_eval.py')
+    exec(compile(source, module.__file__, 'exec'), module.__dict__)
+    return module
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--vars', type=int, default=150)
+    parser.add_argument('--deps', type=int, default=600)
+    parser.add_argument('--hooks', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--baseline',
+                        default='origin/main',
+                        help='git revision of gclient_eval.py to compare '
+                        'against (default: %(default)s)')
+    options = parser.parse_args(args)
+
+    content = make_deps(options.vars, options.deps, options.hooks)
+    baseline = load_baseline(options.baseline)
+
+    for name, module in (
+        ('Parse (%s)' % options.baseline, baseline),
+        ('Parse (working tree)', gclient_eval),
+    ):
+        best = min(
+            timeit.repeat(lambda: module.Parse(content, '<unknown>'),
+                          number=1,
+                          repeat=options.repeat))
+        print('%-32s %.3fs' % (name, best))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -7,7 +7,9 @@ import itertools
 import logging
 import os
 import sys
+import tempfile
 import unittest
+from unittest import mock
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -238,6 +240,70 @@ class ExecTest(unittest.TestCase):
                 ]), '<unknown>')
         self.assertIn('duplicate key in dictionary: a_dep', str(cm.exception))
 
+    def test_compiled_schema_matches_schema(self):
+        local_scope = gclient_eval.Exec(
+            file_join([
+                'vars = {',
+                '  "foo": "bar",',
+                '  "baz": Str("quux"),',
+                '  "enabled": True,',
+                '}',
+                'deps = {',
+                '  "a_dep": "a_url@{foo}",',
+                '  "b_dep": {',
+                '    "url": "b_url",',
+                '    "condition": "enabled",',
+                '  },',
+                '  "c_dep": {',
+                '    "packages": [{"package": "p", "version": "v"}],',
+                '    "dep_type": "cipd",',
+                '  },',
+                '}',
+                'hooks = [{"action": ["a", "b"], "pattern": "."}]',
+            ]))
+        self.assertTrue(gclient_eval._GCLIENT_CHECK.Matches(local_scope))
+        gclient_eval._GCLIENT_SCHEMA.validate(local_scope)
+
+        for invalid in ({
+                'deps': {
+                    'a_dep': {
+                        'url': 'a_url',
+                        'bogus': 'x'
+                    }
+                }
+        }, {
+                'hooks': [{
+                    'pattern': '.'
+                }]
+        }, {
+                'include_rules': {}
+        }, {
+                'allowed_hosts': 1
+        }):
+            self.assertFalse(gclient_eval._GCLIENT_CHECK.Matches(invalid))
+            with self.assertRaises(gclient_eval.schema.SchemaError):
+                gclient_eval._GCLIENT_SCHEMA.validate(invalid)
+
+    def test_schema_accepts_what_compiled_checks_reject(self):
+        with mock.patch.object(gclient_eval._GCLIENT_CHECK,
+                               'ValueCheck',
+                               return_value=None), \
+                self.assertLogs(level='DEBUG') as logs:
+            local_scope = gclient_eval.Exec('vars = {"foo": "bar"}')
+        self.assertEqual({'vars': {'foo': 'bar'}}, local_scope)
+        # A valid DEPS file is not worth a warning.
+        self.assertEqual(['DEBUG'], [r.levelname for r in logs.records])
+        self.assertIn('unexpected variable', logs.records[0].getMessage())
+
+    def test_tokens_are_lazy(self):
+        with mock.patch('tokenize.generate_tokens') as generate_tokens:
+            local_scope = gclient_eval.Exec('vars = {"foo": "bar"}')
+        generate_tokens.assert_not_called()
+
+        gclient_eval.SetVar(local_scope, 'foo', 'baz')
+        self.assertEqual('vars = {"foo": "baz"}',
+                         gclient_eval.RenderDEPSFile(local_scope))
+
 
 class UpdateConditionTest(unittest.TestCase):
     def test_both_present(self):
@@ -437,6 +503,23 @@ class EvaluateConditionTest(unittest.TestCase):
             gclient_eval.EvaluateCondition('s_var in ("baz", "quux")',
                                            {'s_var': Str("foo")}))
 
+    def test_compiled_condition_is_cached(self):
+        condition = 'checkout_foo and host_os == "linux"'
+        variables = {'checkout_foo': True, 'host_os': 'linux'}
+        gclient_eval._COMPILED_CONDITIONS.pop(condition, None)
+        with mock.patch('ast.parse', wraps=gclient_eval.ast.parse) as parse:
+            self.assertTrue(gclient_eval.EvaluateCondition(
+                condition, variables))
+            parse.assert_any_call(condition, mode='eval')
+
+            parse.reset_mock()
+            self.assertTrue(gclient_eval.EvaluateCondition(
+                condition, variables))
+            variables['checkout_foo'] = False
+            self.assertFalse(
+                gclient_eval.EvaluateCondition(condition, variables))
+        parse.assert_not_called()
+
 
 class VarTest(unittest.TestCase):
     def assert_adds_var(self, before, after):
@@ -1318,6 +1401,70 @@ class ParseTest(unittest.TestCase):
             }, local_scope)
 
 
+class ParseCacheTest(unittest.TestCase):
+    DEPS_CONTENT = file_join([
+        'vars = {',
+        '  "foo": Str("bar"),',
+        '  "checkout_foo": False,',
+        '}',
+        'deps = {',
+        '  "a_dep": {',
+        '    "url": "a{foo}b",',
+        '    "condition": "checkout_foo",',
+        '  },',
+        '}',
+        'recursedeps = [',
+        '  ("a_dep", "DEPS.alt"),',
+        ']',
+    ])
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(gclient_utils.rmtree, self.cache_dir)
+        self.cache = gclient_eval.ParseCache(self.cache_dir)
+
+    def parse(self, vars_override=None, builtin_vars=None):
+        return self.cache.Parse(self.DEPS_CONTENT, 'DEPS', vars_override,
+                                builtin_vars)
+
+    def test_matches_parse(self):
+        expected = gclient_eval.Parse(self.DEPS_CONTENT, 'DEPS')
+        self.assertEqual(expected, self.parse())
+        self.assertEqual(expected, self.parse())
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+
+    def test_preserves_types(self):
+        self.parse()
+        with mock.patch('gclient_eval.Parse') as parse:
+            local_scope = self.parse()
+        parse.assert_not_called()
+        self.assertIsInstance(local_scope['vars']['foo'],
+                              gclient_eval.ConstantString)
+        self.assertIs(False, local_scope['vars']['checkout_foo'])
+        self.assertEqual([('a_dep', 'DEPS.alt')], local_scope['recursedeps'])
+
+    def test_key_includes_vars(self):
+        self.parse({'foo': 'baz'})
+        self.parse({'foo': 'baz'}, {'checkout_foo': True})
+        self.assertEqual('abazb',
+                         self.parse({'foo': 'baz'})['deps']['a_dep']['url'])
+        self.assertEqual(2, len(os.listdir(self.cache_dir)))
+
+    def test_corrupt_entry(self):
+        self.parse()
+        for name in os.listdir(self.cache_dir):
+            with open(os.path.join(self.cache_dir, name), 'w') as f:
+                f.write('{')
+        self.assertEqual('abarb', self.parse()['deps']['a_dep']['url'])
+
+    def test_prune(self):
+        self.parse({'foo': 'baz'})
+        self.cache = gclient_eval.ParseCache(self.cache_dir)
+        self.parse()
+        self.cache.Prune()
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+
+
 if __name__ == '__main__':
     level = logging.DEBUG if '-v' in sys.argv else logging.FATAL
     logging.basicConfig(level=level,
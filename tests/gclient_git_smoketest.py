@@ -231,6 +231,21 @@ class GClientSmokeGIT(gclient_smoketest_base.GClientSmokeBase):
         }
         self.assertEqual(out, output_json)
 
+    def testSyncCacheDirNone(self):
+        # repo_19 pins its git dependencies to full hashes, which are looked up
+        # in the git cache when there is one.
+        self.gclient([
+            'config', self.git_base + 'repo_19', '--name', 'dir', '--cache-dir',
+            'none'
+        ])
+        self.gclient(['sync', '--nohooks'])
+        self.assertEqual(
+            self.githash('repo_3', 1),
+            subprocess2.check_output(
+                ['git', 'rev-parse', 'HEAD'],
+                cwd=join(self.root_dir, 'dir', 'chicken',
+                         'dickens')).decode('utf-8').strip())
+
     def testSyncIgnoredSolutionName(self):
         """TODO(maruel): This will become an error soon."""
         self.gclient(['config', self.git_base + 'repo_1', '--name', 'src'])
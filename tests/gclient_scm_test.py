@@ -241,6 +241,114 @@ from :3
 
 
 class ManagedGitWrapperTestCase(BaseGitWrapperTestCase):
+    def testGetSyncFingerprint(self):
+        if not self.enabled:
+            return
+        options = self.Options()
+        scm = gclient_scm.GitWrapper(self.url, self.root_dir, self.relpath)
+        # Not pinned to a revision.
+        self.assertIsNone(scm.GetSyncFingerprint(options))
+
+        head = scm._Capture(['rev-parse', 'HEAD'])
+        options.revision = head
+        # On a branch, which may move without HEAD changing.
+        self.assertIsNone(scm.GetSyncFingerprint(options))
+
+        scm._Capture(['checkout', '-q', head])
+        fingerprint = scm.GetSyncFingerprint(options)
+        self.assertEqual(head, fingerprint['revision'])
+        self.assertEqual(head, fingerprint['head'])
+        self.assertEqual(fingerprint, scm.GetSyncFingerprint(options))
+
+        # Changing the config, e.g. the remote, changes the fingerprint.
+        config = os.path.join(self.root_dir, self.relpath, '.git', 'config')
+        os.utime(config, ns=(0, 0))
+        self.assertNotEqual(fingerprint, scm.GetSyncFingerprint(options))
+
+        options.force = True
+        self.assertIsNone(scm.GetSyncFingerprint(options))
+
+    def _CacheCheckout(self):
+        """Returns a GitWrapper for a checkout of the test repo via a cache."""
+        checkout_root = tempfile.mkdtemp()
+        self.addCleanup(gclient_utils.rmtree, checkout_root)
+        cache_dir = os.path.join(checkout_root, 'cache')
+        mock.patch.object(git_cache.Mirror,
+                          'cachepath',
+                          cache_dir,
+                          create=True).start()
+        mock.patch.dict(os.environ, {'CHROME_HEADLESS': '1'}).start()
+        return gclient_scm.GitWrapper(self.base_path, checkout_root, 'dep')
+
+    def testCacheModeAlternates(self):
+        if not self.enabled:
+            return
+        options = self.Options()
+        scm = self._CacheCheckout()
+        scm.update(options, None, [])
+        head = scm._Capture(['rev-parse', 'HEAD'])
+        self.assertEqual([
+            os.path.join(git_cache.Mirror(self.base_path).mirror_path,
+                         'objects')
+        ], scm._GetAlternates())
+
+        # The mirror goes away; the checkout is cloned again.
+        gclient_utils.rmtree(git_cache.Mirror(self.base_path).mirror_path)
+        options.force = True
+        scm.update(options, None, [])
+        self.assertTrue(all(os.path.isdir(a) for a in scm._GetAlternates()))
+        self.assertEqual(head, scm._Capture(['rev-parse', 'HEAD']))
+
+    @mock.patch.object(gclient_scm.GitWrapper, 'cache_mode', 'copy')
+    def testCacheModeCopy(self):
+        if not self.enabled:
+            return
+        options = self.Options()
+        scm = self._CacheCheckout()
+        scm.update(options, None, [])
+        head = scm._Capture(['rev-parse', 'HEAD'])
+        self.assertEqual([], scm._GetAlternates())
+
+        # Checkouts made with alternates are converted.
+        with mock.patch.object(gclient_scm.GitWrapper, 'cache_mode',
+                               'alternates'):
+            gclient_utils.rmtree(scm.checkout_path)
+            scm.update(options, None, [])
+            self.assertNotEqual([], scm._GetAlternates())
+        scm.update(options, None, [])
+        self.assertEqual([], scm._GetAlternates())
+
+        gclient_utils.rmtree(git_cache.Mirror(self.base_path).mirror_path)
+        self.assertEqual(head, scm._Capture(['rev-parse', 'HEAD']))
+        scm._Capture(['fsck', '--connectivity-only'])
+
+    def testGetSyncFingerprintCacheMode(self):
+        if not self.enabled:
+            return
+        options = self.Options()
+        scm = self._CacheCheckout()
+        scm.update(options, None, [])
+        options.revision = scm._Capture(['rev-parse', 'HEAD'])
+        fingerprint = scm.GetSyncFingerprint(options)
+        self.assertEqual('alternates', fingerprint['cache_mode'])
+        self.assertEqual(scm._GetAlternates(), fingerprint['alternates'])
+
+        # update() would copy the objects from the git cache.
+        with mock.patch.object(gclient_scm.GitWrapper, 'cache_mode', 'copy'):
+            self.assertIsNone(scm.GetSyncFingerprint(options))
+
+        # update() would clone the checkout again.
+        gclient_utils.rmtree(git_cache.Mirror(self.base_path).mirror_path)
+        self.assertIsNone(scm.GetSyncFingerprint(options))
+
+    def testSetCacheMode(self):
+        self.addCleanup(setattr, gclient_scm.GitWrapper, 'cache_mode',
+                        gclient_scm.GitWrapper.cache_mode)
+        gclient_scm.GitWrapper.SetCacheMode('copy')
+        self.assertEqual('copy', gclient_scm.GitWrapper.cache_mode)
+        with self.assertRaises(gclient_utils.Error):
+            gclient_scm.GitWrapper.SetCacheMode('hardlinks')
+
     def testRevertMissing(self):
         if not self.enabled:
             return
@@ -1075,6 +1183,116 @@ class CipdWrapperTestCase(unittest.TestCase):
         git_wrapper.update(None, (), [])
 
 
+class CipdRootTestCase(unittest.TestCase):
+    def setUp(self):
+        self._cipd_root_dir = tempfile.mkdtemp()
+        self.addCleanup(gclient_utils.rmtree, self._cipd_root_dir)
+        # Use the fake cipd client from testing_support.
+        testing_support_dir = os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            'testing_support')
+        mock.patch.dict(
+            os.environ, {
+                'PATH': testing_support_dir + os.pathsep + os.environ['PATH']
+            }).start()
+        self.check_call = mock.patch(
+            'gclient_utils.CheckCallAndFilter',
+            wraps=gclient_utils.CheckCallAndFilter).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def createRoot(self, version):
+        root = gclient_scm.CipdRoot(
+            self._cipd_root_dir, 'https://chrome-infra-packages.appspot.com')
+        root.add_package('f', 'foo_package', version)
+        root.add_package('b', 'bar_package/${platform}', 'version:1')
+        return root
+
+    def cipdCommands(self):
+        commands = [call.args[0][1] for call in self.check_call.call_args_list]
+        self.check_call.reset_mock()
+        return commands
+
+    def testEnsureSkippedWhenUnchanged(self):
+        self.createRoot('version:1').ensure()
+        self.assertEqual(['ensure'], self.cipdCommands())
+
+        self.createRoot('version:1').ensure()
+        self.assertEqual([], self.cipdCommands())
+
+        self.createRoot('version:2').ensure()
+        self.assertEqual(['ensure'], self.cipdCommands())
+
+    def testEnsureNotSkippedForRefs(self):
+        self.createRoot('latest').ensure()
+        self.createRoot('latest').ensure()
+        self.assertEqual(['ensure', 'ensure'], self.cipdCommands())
+
+    def testEnsureNotSkippedAfterClobber(self):
+        self.createRoot('version:1').ensure()
+        root = self.createRoot('version:1')
+        root.clobber()
+        root.ensure()
+        self.assertEqual(['ensure', 'ensure'], self.cipdCommands())
+
+    def testEnsureNotSkippedWhenForced(self):
+        self.createRoot('version:1').ensure()
+        self.createRoot('version:1').ensure(force=True)
+        self.assertEqual(['ensure', 'ensure'], self.cipdCommands())
+
+        self.createRoot('version:1').run('update', force=True)
+        self.assertEqual(['ensure'], self.cipdCommands())
+
+    def testEnsureNotSkippedAfterFailure(self):
+        self.createRoot('version:1').ensure()
+        with mock.patch('gclient_utils.CheckCallAndFilter',
+                        side_effect=subprocess2.CalledProcessError(
+                            1, 'cipd', None, None, None)):
+            with self.assertRaises(subprocess2.CalledProcessError):
+                self.createRoot('version:2').ensure()
+        self.check_call.reset_mock()
+
+        self.createRoot('version:1').ensure()
+        self.assertEqual(['ensure'], self.cipdCommands())
+
+    def testResolvedPackagesCached(self):
+        expected = {
+            'b': [{
+                'package': 'bar_package/platform-expanded-test-only',
+                'pin': {
+                    'package':
+                    'bar_package/platform-expanded-test-only',
+                    'instance_id':
+                    'bar_package/platform-expanded-test-only-fake-resolved-id',
+                },
+            }],
+            'f': [{
+                'package': 'foo_package',
+                'pin': {
+                    'package': 'foo_package',
+                    'instance_id': 'foo_package-fake-resolved-id',
+                },
+            }],
+        }
+        self.assertEqual(expected,
+                         self.createRoot('version:1').resolved_packages())
+        self.assertEqual(['ensure-file-resolve'], self.cipdCommands())
+
+        self.assertEqual(expected,
+                         self.createRoot('version:1').resolved_packages())
+        self.assertEqual([], self.cipdCommands())
+
+        root = self.createRoot('version:1')
+        root.clobber()
+        self.assertEqual(expected, root.resolved_packages())
+        self.assertEqual(['ensure-file-resolve'], self.cipdCommands())
+
+    def testResolvedPackagesNotCachedForRefs(self):
+        self.createRoot('latest').resolved_packages()
+        self.createRoot('latest').resolved_packages()
+        self.assertEqual(['ensure-file-resolve', 'ensure-file-resolve'],
+                         self.cipdCommands())
+
+
 class GcsWrapperTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -7,13 +7,20 @@
 See gclient_smoketest.py for integration tests.
 """
 
+import hashlib
+import http.server
+import io
 import json
 import logging
 import ntpath
 import os
 import queue
+import stat
 import sys
+import tarfile
+import threading
 import unittest
+import urllib.error
 from unittest import mock
 
 
@@ -27,6 +34,7 @@ metrics_utils.COLLECT_METRICS = False
 import gclient
 import gclient_eval
 import gclient_utils
+import subprocess2
 from testing_support import trial_dir
 
 # TODO: Should fix these warnings.
@@ -69,6 +77,10 @@ class SCMMock(object):
         self.name = name
         self.url = parsed_url
 
+    @classmethod
+    def SetCacheMode(cls, _):
+        pass
+
     def RunCommand(self, command, options, args, file_list):
         self.unit_test.assertEqual('None', command)
         self.unit_test.processed.put((self.name, self.url))
@@ -1706,6 +1718,697 @@ class GclientTest(trial_dir.TestCase):
         self.assertEqual(expected_skip_sync_revisions,
                          client._EnforceSkipSyncRevisions(patch_refs))
 
+    def testDepsParseCache(self):
+        write(
+            '.gclient', 'solutions = [\n'
+            '  { "name": "foo", "url": "svn://example.com/foo" },\n'
+            ']')
+        write(os.path.join('foo', 'DEPS'), 'deps = {\n'
+              '  "foo/bar": "svn://example.com/bar",\n'
+              '}')
+        options, _ = gclient.OptionParser().parse_args([])
+        obj = gclient.GClient.LoadCurrentConfig(options)
+        obj.RunOnDeps('None', [])
+        self._get_processed()
+        self.assertTrue(os.listdir(gclient.DEPS_PARSE_CACHE_DIR))
+
+        obj = gclient.GClient.LoadCurrentConfig(options)
+        with mock.patch('gclient_eval.Parse') as parse:
+            obj.RunOnDeps('None', [])
+        parse.assert_not_called()
+        self.assertEqual([('foo', 'svn://example.com/foo'),
+                          ('foo/bar', 'svn://example.com/bar')],
+                         self._get_processed())
+
+    def _fastPathClient(self, verify_fast_path=False):
+        write(
+            '.gclient', 'solutions = [\n'
+            '  { "name": "foo", "url": "svn://example.com/foo" },\n'
+            ']')
+        options, _ = gclient.OptionParser().parse_args([])
+        options.verify_fast_path = verify_fast_path
+        client = gclient.GClient.LoadCurrentConfig(options)
+        dep = client.dependencies[0]
+        dep._used_scm = mock.Mock()
+        dep._used_scm.GetSyncFingerprint.return_value = {
+            'revision': 'a' * 40,
+            'head': 'a' * 40,
+            'index_mtime': 1,
+        }
+        dep._used_scm.RunCommand.return_value = 'a' * 40
+        return client, dep, options
+
+    def testUpdateGitDependencyFastPath(self):
+        client, dep, options = self._fastPathClient()
+        fingerprint = dep._used_scm.GetSyncFingerprint.return_value
+        client._previous_sync_fingerprints = {'foo': dict(fingerprint)}
+
+        self.assertEqual('a' * 40,
+                         dep._UpdateGitDependency(options, [], [], {}))
+        dep._used_scm.RunCommand.assert_not_called()
+        self.assertEqual({'foo': fingerprint}, client._sync_fingerprints)
+
+    def testUpdateGitDependencyFingerprintChanged(self):
+        client, dep, options = self._fastPathClient()
+        fingerprint = dep._used_scm.GetSyncFingerprint.return_value
+        client._previous_sync_fingerprints = {
+            'foo': dict(fingerprint, index_mtime=0)
+        }
+
+        self.assertEqual('a' * 40,
+                         dep._UpdateGitDependency(options, [], [], {}))
+        dep._used_scm.RunCommand.assert_called_once_with(
+            'update', options, [], [])
+        self.assertEqual({'foo': fingerprint}, client._sync_fingerprints)
+
+    def testUpdateGitDependencyPatchRef(self):
+        client, dep, options = self._fastPathClient()
+        fingerprint = dep._used_scm.GetSyncFingerprint.return_value
+        client._previous_sync_fingerprints = {'foo': dict(fingerprint)}
+
+        dep._UpdateGitDependency(options, [], [],
+                                 {'svn://example.com/foo': 'refs/changes/1'})
+        dep._used_scm.RunCommand.assert_called_once_with(
+            'update', options, [], [])
+        self.assertEqual({}, client._sync_fingerprints)
+
+    def testUpdateGitDependencyVerifyFastPath(self):
+        client, dep, options = self._fastPathClient(verify_fast_path=True)
+        fingerprint = dep._used_scm.GetSyncFingerprint.return_value
+        client._previous_sync_fingerprints = {'foo': dict(fingerprint)}
+
+        dep._UpdateGitDependency(options, [], [], {})
+        dep._used_scm.RunCommand.assert_called_once_with(
+            'update', options, [], [])
+
+        dep._used_scm.RunCommand.return_value = 'b' * 40
+        with self.assertRaises(gclient_utils.Error):
+            dep._UpdateGitDependency(options, [], [], {})
+
+    def testReadSyncPriorities(self):
+        write(
+            '.gclient', 'solutions = [\n'
+            '  { "name": "src", "url": "https://example.com/src" },\n'
+            ']')
+        write(
+            gclient.SYNC_TIMINGS_FILE,
+            json.dumps({
+                'src': {
+                    'duration': 10,
+                    'requirements': []
+                },
+                'src/a': {
+                    'duration': 5,
+                    'requirements': ['src']
+                },
+                'src/b': {
+                    'duration': 30,
+                    'requirements': ['src']
+                },
+                'src/b/c': {
+                    'duration': 1,
+                    'requirements': ['src', 'src/b']
+                },
+            }))
+        options, _ = gclient.OptionParser().parse_args([])
+
+        client = gclient.GClient.LoadCurrentConfig(options)
+        self.assertEqual({
+            'src': 41,
+            'src/a': 5,
+            'src/b': 31,
+            'src/b/c': 1
+        }, client._ReadSyncPriorities())
+
+    def testReadSyncPrioritiesMalformed(self):
+        write(
+            '.gclient', 'solutions = [\n'
+            '  { "name": "src", "url": "https://example.com/src" },\n'
+            ']')
+        write(gclient.SYNC_TIMINGS_FILE, '{')
+        options, _ = gclient.OptionParser().parse_args([])
+
+        client = gclient.GClient.LoadCurrentConfig(options)
+        self.assertEqual({}, client._ReadSyncPriorities())
+
+    def testProcessStaleEntriesChildrenFirst(self):
+        write(
+            '.gclient', 'solutions = [\n'
+            '  { "name": "src", "url": "https://example.com/src" },\n'
+            ']')
+        options, _ = gclient.OptionParser().parse_args(['--jobs', '4'])
+        client = gclient.GClient.LoadCurrentConfig(options)
+        stale_entries = ['src/b', 'src/a/c/d', 'src/a/b', 'src/a', 'other']
+        read_entries = {
+            entry: 'https://example.com/' + entry
+            for entry in stale_entries
+        }
+        processed = []
+
+        def process(entry, prev_url, full_entries, index_lock):
+            self.assertEqual('https://example.com/' + entry, prev_url)
+            processed.append(entry)
+            return entry == 'src/b', None
+
+        with mock.patch.object(client,
+                               '_ProcessStaleEntry',
+                               side_effect=process):
+            results = client._ProcessStaleEntries(stale_entries, read_entries,
+                                                  [])
+
+        self.assertEqual(
+            {
+                'src/b': (True, None),
+                'src/a/c/d': (False, None),
+                'src/a/b': (False, None),
+                'src/a': (False, None),
+                'other': (False, None),
+            }, results)
+        self.assertCountEqual(stale_entries, processed)
+        self.assertLess(processed.index('src/a/c/d'), processed.index('src/a'))
+        self.assertLess(processed.index('src/a/b'), processed.index('src/a'))
+
+    def testMoveToTrash(self):
+        write(
+            '.gclient', 'solutions = [\n'
+            '  { "name": "src", "url": "https://example.com/src" },\n'
+            ']')
+        write(os.path.join('src', 'foo', 'bar'), 'bar')
+        options, _ = gclient.OptionParser().parse_args([])
+        client = gclient.GClient.LoadCurrentConfig(options)
+
+        client._MoveToTrash(os.path.join(self.root_dir, 'src', 'foo'))
+        self.assertFalse(os.path.exists(os.path.join('src', 'foo')))
+        self.assertTrue(os.listdir(gclient.TRASH_DIR))
+
+        client._EmptyTrash().join()
+        self.assertEqual([], os.listdir(gclient.TRASH_DIR))
+
+    def testHookWorkItems(self):
+        def hook(name, **kwargs):
+            return gclient.Hook(['cmd', name], name=name, **kwargs)
+
+        items = gclient._HookWorkItems([
+            [
+                hook('a1'),
+                hook('a2', condition='False', variables={}),
+                hook('a3'),
+                hook('a4', requires=[]),
+                hook('a5', requires=['b1', 'a2', 'missing']),
+            ],
+            [hook('b1'), hook('b2')],
+        ])
+        self.assertEqual(
+            {
+                'a1': [],
+                'a3': ['a1'],
+                'a4': [],
+                'a5': ['b1'],
+                'b1': [],
+                'b2': ['b1'],
+            }, {item.name: item.requirements
+                for item in items})
+
+    def testHookWorkItemsUniqueNames(self):
+        items = gclient._HookWorkItems([
+            [gclient.Hook(['cmd']),
+             gclient.Hook(['cmd'])],
+            [gclient.Hook(['cmd'])],
+        ])
+        self.assertEqual(3, len({item.name for item in items}))
+        self.assertEqual([items[0].name], items[1].requirements)
+        self.assertEqual([], items[2].requirements)
+
+    def testHookWorkItemsCycle(self):
+        with self.assertRaises(gclient_utils.Error) as cm:
+            gclient._HookWorkItems([
+                [gclient.Hook(['cmd'], name='a', requires=['b'])],
+                [gclient.Hook(['cmd'], name='b', requires=['a'])],
+            ])
+        self.assertIn('a -> b -> a', str(cm.exception))
+
+    def _process_deps(self, options):
+        client = gclient.GClient.LoadCurrentConfig(options)
+        work_queue = gclient_utils.ExecutionQueue(options.jobs, None, False)
+        for s in client.dependencies:
+            work_queue.enqueue(s)
+        work_queue.flush({},
+                         None, [],
+                         options=options,
+                         patch_refs={},
+                         target_branches={},
+                         skip_sync_revisions={})
+        return client
+
+    def testRunHooksInParallel(self):
+        def append(name):
+            return {
+                'name':
+                name,
+                'action':
+                ['python3', '-c',
+                 'open("log", "a").write("%s\\n")' % name],
+            }
+
+        write(
+            '.gclient', 'solutions = [\n'
+            '  { "name": "foo", "url": "svn://example.com/foo" },\n'
+            '  { "name": "bar", "url": "svn://example.com/bar" },\n'
+            ']')
+        write(os.path.join('foo', 'DEPS'),
+              'hooks = %r' % [append('foo1'), append('foo2')])
+        write(os.path.join('bar', 'DEPS'),
+              'hooks = %r' % [append('bar1'), append('bar2')])
+        options, _ = gclient.OptionParser().parse_args(['--jobs', '4'])
+        client = self._process_deps(options)
+        with mock.patch('sys.stdout', io.StringIO()) as stdout:
+            client.RunHooksRecursively(options, None)
+        # The output reads like the output of hooks run sequentially.
+        running = ("________ running 'python3 -c "
+                   "open(\"log\", \"a\").write(\"%s\\n\")' in '%s'")
+        expected = [
+            running % (name, self.root_dir)
+            for name in ('foo1', 'foo2', 'bar1', 'bar2')
+        ]
+        self.assertEqual(expected, stdout.getvalue().splitlines())
+        with open('log') as f:
+            ran = f.read().split()
+        self.assertEqual(['bar1', 'bar2', 'foo1', 'foo2'], sorted(ran))
+        self.assertLess(ran.index('foo1'), ran.index('foo2'))
+        self.assertLess(ran.index('bar1'), ran.index('bar2'))
+
+    def testHookOutputPrinter(self):
+        items = [
+            gclient._HookWorkItem(name, gclient.Hook(['cmd']))
+            for name in ('a', 'b', 'c')
+        ]
+        for item in items:
+            print(item.name, file=item.hook_output)
+        printer = gclient._HookOutputPrinter(items)
+        with mock.patch('sys.stdout', io.StringIO()) as stdout:
+            printer.done(items[1])
+            self.assertEqual('', stdout.getvalue())
+            printer.done(items[0])
+            self.assertEqual('a\nb\n', stdout.getvalue())
+            printer.print_remaining()
+            self.assertEqual('a\nb\nc\n', stdout.getvalue())
+
+    def testHookStamp(self):
+        write('input.sha1', 'abc')
+        variables = {'checkout_foo': True, 'rev': 'a', 'other': 'b'}
+
+        def stamp(**kwargs):
+            return gclient.Hook(['cmd'],
+                                variables=variables,
+                                cwd_base=self.root_dir,
+                                **kwargs).stamp()
+
+        self.assertIsNone(stamp())
+        stamps = [
+            stamp(inputs=['input.sha1'], condition='checkout_foo'),
+            stamp(input_vars=['rev']),
+        ]
+        self.assertEqual(stamps, [
+            stamp(inputs=['input.sha1'], condition='checkout_foo'),
+            stamp(input_vars=['rev']),
+        ])
+
+        variables['other'] = 'c'
+        self.assertEqual(stamps[1], stamp(input_vars=['rev']))
+        variables['rev'] = 'b'
+        self.assertNotEqual(stamps[1], stamp(input_vars=['rev']))
+        variables['checkout_foo'] = 'True'
+        self.assertNotEqual(
+            stamps[0], stamp(inputs=['input.sha1'], condition='checkout_foo'))
+        variables['checkout_foo'] = True
+        write('input.sha1', 'def')
+        self.assertNotEqual(
+            stamps[0], stamp(inputs=['input.sha1'], condition='checkout_foo'))
+
+    def testRunHooksSkipsUpToDateHooks(self):
+        write(
+            '.gclient', 'solutions = [\n'
+            '  { "name": "foo", "url": "svn://example.com/foo" },\n'
+            ']')
+        write(
+            os.path.join('foo', 'DEPS'), 'hooks = [{\n'
+            '  "name": "stamped",\n'
+            '  "inputs": ["foo/input.sha1"],\n'
+            '  "action": ["python3", "-c",\n'
+            '             "open(\'log\', \'a\').write(\'x\')"],\n'
+            '}]')
+        write(os.path.join('foo', 'input.sha1'), 'abc')
+
+        def run_hooks(*args):
+            options, _ = gclient.OptionParser().parse_args(['--jobs', '1'] +
+                                                           list(args))
+            self._process_deps(options).RunHooksRecursively(options, None)
+            with open('log') as f:
+                return len(f.read())
+
+        self.assertEqual(1, run_hooks())
+        self.assertEqual(1, run_hooks())
+        write(os.path.join('foo', 'input.sha1'), 'def')
+        self.assertEqual(2, run_hooks())
+        self.assertEqual(2, run_hooks('--jobs', '4'))
+
+        options, _ = gclient.OptionParser().parse_args(['--jobs', '1'])
+        options.force_hooks = True
+        self._process_deps(options).RunHooksRecursively(options, None)
+        with open('log') as f:
+            self.assertEqual(3, len(f.read()))
+
+    def testRunHooksStampsPerDepsFile(self):
+        write(
+            '.gclient', 'solutions = [\n'
+            '  { "name": "foo", "url": "svn://example.com/foo" },\n'
+            '  { "name": "bar", "url": "svn://example.com/bar" },\n'
+            ']')
+        for name in ('foo', 'bar'):
+            write(
+                os.path.join(name, 'DEPS'), 'hooks = [{\n'
+                '  "name": "stamped",\n'
+                '  "inputs": ["%s/input.sha1"],\n'
+                '  "action": ["python3", "-c",\n'
+                '             "open(\'%s.log\', \'a\').write(\'x\')"],\n'
+                '}]' % (name, name))
+            write(os.path.join(name, 'input.sha1'), 'abc')
+
+        def run_hooks():
+            options, _ = gclient.OptionParser().parse_args(['--jobs', '1'])
+            self._process_deps(options).RunHooksRecursively(options, None)
+            result = []
+            for name in ('foo', 'bar'):
+                with open('%s.log' % name) as f:
+                    result.append(len(f.read()))
+            return result
+
+        self.assertEqual([1, 1], run_hooks())
+        self.assertEqual([1, 1], run_hooks())
+        write(os.path.join('bar', 'input.sha1'), 'def')
+        self.assertEqual([1, 2], run_hooks())
+        self.assertEqual([1, 2], run_hooks())
+        self.assertEqual([gclient.HOOK_STAMPS_FILE], [
+            f for f in os.listdir('.') if f.startswith(gclient.HOOK_STAMPS_FILE)
+        ])
+
+    def testRunHooksInParallelFailure(self):
+        write(
+            '.gclient', 'solutions = [\n'
+            '  { "name": "foo", "url": "svn://example.com/foo" },\n'
+            ']')
+        write(
+            os.path.join('foo', 'DEPS'), 'hooks = [\n'
+            '  {"name": "fail", "action": ["python3", "-c", "exit(1)"]},\n'
+            '  {"name": "next", "action": ["python3", "-c", "exit(0)"]},\n'
+            ']')
+        options, _ = gclient.OptionParser().parse_args(['--jobs', '4'])
+        client = self._process_deps(options)
+        with mock.patch('sys.stderr', io.StringIO()):
+            with self.assertRaises(SystemExit) as cm:
+                client.RunHooksRecursively(options, None)
+        self.assertEqual(2, cm.exception.code)
+
+    @mock.patch('git_cache.Mirror.batch_contains_revisions')
+    @mock.patch('git_cache.Mirror.GetCachePath', return_value='/cache')
+    def testPrefetchMirrorRevisions(self, _mockGetCachePath, mockBatch):
+        gclient.gclient_scm.GitWrapper = self._old_createscm
+        sha = '1' * 40
+        write(
+            '.gclient', 'solutions = [\n'
+            '  { "name": "foo", "url": "https://example.com/foo" },\n'
+            ']')
+        write(
+            os.path.join('foo', 'DEPS'), 'deps = {\n'
+            '  "foo/bar": "https://example.com/bar@%s",\n'
+            '  "foo/baz": "https://example.com/baz@main",\n'
+            '  "foo/none": None,\n'
+            '  "foo/qux": {\n'
+            '    "url": "https://example.com/qux@%s",\n'
+            '    "condition": "False",\n'
+            '  },\n'
+            '}' % (sha, sha))
+        options, _ = gclient.OptionParser().parse_args([])
+        client = gclient.GClient.LoadCurrentConfig(options)
+        foo = client.dependencies[0]
+        foo.ParseDepsFile()
+
+        foo._PrefetchMirrorRevisions()
+        (pairs, ), _ = mockBatch.call_args
+        self.assertEqual([('https://example.com/bar', sha)],
+                         [(mirror.url, revision) for mirror, revision in pairs])
+
+        mockBatch.reset_mock()
+        _mockGetCachePath.side_effect = RuntimeError
+        foo._PrefetchMirrorRevisions()
+        mockBatch.assert_not_called()
+
+    @mock.patch('git_cache.Mirror.batch_contains_revisions')
+    def testPrefetchMirrorRevisionsCacheDirNone(self, mockBatch):
+        gclient.gclient_scm.GitWrapper = self._old_createscm
+        # The .gclient file below sets the cache path on git_cache.Mirror.
+        mock.patch('git_cache.Mirror.cachepath', create=True).start()
+        write(
+            '.gclient', 'solutions = [\n'
+            '  { "name": "foo", "url": "https://example.com/foo" },\n'
+            ']\n'
+            'cache_dir = None\n')
+        write(os.path.join('foo', 'DEPS'),
+              'deps = {"foo/bar": "https://example.com/bar@%s"}' % ('1' * 40))
+        options, _ = gclient.OptionParser().parse_args([])
+        client = gclient.GClient.LoadCurrentConfig(options)
+        foo = client.dependencies[0]
+        foo.ParseDepsFile()
+
+        foo._PrefetchMirrorRevisions()
+        mockBatch.assert_not_called()
+
+
+class FakeGcsHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the objects of a FakeGcsServer."""
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.path in self.server.forbidden:
+            self.send_error(403)
+            return
+        if self.path not in self.server.objects:
+            self.send_error(404)
+            return
+        contents, headers = self.server.objects[self.path]
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(contents)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(contents)
+
+    def log_message(self, *args):
+        pass
+
+
+class GcsDependencyTest(trial_dir.TestCase):
+    def setUp(self):
+        super(GcsDependencyTest, self).setUp()
+        self.previous_dir = os.getcwd()
+        os.chdir(self.root_dir)
+        self.addCleanup(os.chdir, self.previous_dir)
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      FakeGcsHandler)
+        self.server.objects = {}
+        self.server.forbidden = set()
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={'poll_interval': 0.01})
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        mock.patch.object(gclient.GcsDependency, 'GCS_HTTP_URL',
+                          'http://127.0.0.1:%d' %
+                          self.server.server_port).start()
+        mock.patch.dict(os.environ, {'GCLIENT_TEST': '0'}).start()
+        self.addCleanup(mock.patch.stopall)
+
+        write(
+            '.gclient', 'solutions = [\n'
+            '  { "name": "src", "url": "https://example.com/src" },\n'
+            ']')
+        options, _ = gclient.OptionParser().parse_args([])
+        self.client = gclient.GClient.LoadCurrentConfig(options)
+
+    def addObject(self, object_name, contents, headers=None):
+        self.server.objects['/bucket/' + object_name] = (contents, headers
+                                                         or {})
+
+    def createDep(self, object_name, contents, output_file=None):
+        return gclient.GcsDependency(
+            parent=self.client.dependencies[0],
+            name='src/gcs',
+            bucket='bucket',
+            object_name=object_name,
+            sha256sum=hashlib.sha256(contents).hexdigest(),
+            output_file=output_file,
+            size_bytes=len(contents),
+            gcs_root=self.client.GetGcsRoot(),
+            custom_vars={},
+            should_process=True,
+            relative=False,
+            condition=None)
+
+    @staticmethod
+    def makeTarball(files, links=None):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+            for name, contents in files.items():
+                tarinfo = tarfile.TarInfo(name)
+                tarinfo.size = len(contents)
+                tar.addfile(tarinfo, io.BytesIO(contents))
+            for name, target in (links or {}).items():
+                tarinfo = tarfile.TarInfo(name)
+                tarinfo.type = tarfile.SYMTYPE
+                tarinfo.linkname = target
+                tar.addfile(tarinfo)
+        return buf.getvalue()
+
+    def testDownloadTarball(self):
+        contents = self.makeTarball({
+            'dir/a': b'a',
+            'dir/sub/b': b'b'
+        },
+                                    links={'dir/c': 'a'})
+        self.addObject('Linux/dir.tar.gz', contents)
+        dep = self.createDep('Linux/dir.tar.gz', contents)
+
+        dep.DownloadGoogleStorage()
+
+        output_dir = os.path.join('src', 'gcs')
+        with open(os.path.join(output_dir, 'dir', 'a')) as f:
+            self.assertEqual('a', f.read())
+        with open(os.path.join(output_dir, 'dir', 'sub', 'b')) as f:
+            self.assertEqual('b', f.read())
+        self.assertEqual('a', os.readlink(os.path.join(output_dir, 'dir', 'c')))
+        with open(dep.artifact_output_file, 'rb') as f:
+            self.assertEqual(contents, f.read())
+        with open(dep.hash_file) as f:
+            self.assertEqual(dep.sha256sum, f.read().strip())
+        with open(os.path.join(output_dir,
+                               '.Linux_dir_tar_gz_content_names')) as f:
+            self.assertEqual(['dir/a', 'dir/sub/b', 'dir/c'], json.load(f))
+        self.assertFalse(dep.IsDownloadNeeded())
+        # Only the extracted tarball and gclient's own files are left.
+        self.assertEqual(['dir'], [
+            name for name in os.listdir(output_dir) if not name.startswith('.')
+        ])
+
+    @unittest.skipIf(sys.platform == 'win32', 'POSIX modes only')
+    def testDownloadTarballWithReadOnlyDirectory(self):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+            tarinfo = tarfile.TarInfo('dir')
+            tarinfo.type = tarfile.DIRTYPE
+            tarinfo.mode = 0o555
+            tarinfo.mtime = 1234
+            tar.addfile(tarinfo)
+            tarinfo = tarfile.TarInfo('dir/a')
+            tarinfo.size = 1
+            tar.addfile(tarinfo, io.BytesIO(b'a'))
+        contents = buf.getvalue()
+        self.addObject('dir.tar.gz', contents)
+        dep = self.createDep('dir.tar.gz', contents)
+
+        dep.DownloadGoogleStorage()
+
+        extracted_dir = os.path.join('src', 'gcs', 'dir')
+        with open(os.path.join(extracted_dir, 'a')) as f:
+            self.assertEqual('a', f.read())
+        st = os.stat(extracted_dir)
+        self.assertEqual(0o555, stat.S_IMODE(st.st_mode))
+        self.assertEqual(1234, st.st_mtime)
+
+    def testDownloadFile(self):
+        self.addObject('clang-format', b'binary',
+                       {'x-goog-meta-executable': '1'})
+        dep = self.createDep('clang-format', b'binary', 'clang-format')
+
+        dep.DownloadGoogleStorage()
+
+        with open(os.path.join('src', 'gcs', 'clang-format'), 'rb') as f:
+            self.assertEqual(b'binary', f.read())
+        if sys.platform != 'win32':
+            self.assertTrue(
+                os.access(os.path.join('src', 'gcs', 'clang-format'), os.X_OK))
+        self.assertFalse(dep.IsDownloadNeeded())
+
+    def testHashMismatch(self):
+        contents = self.makeTarball({'dir/a': b'a'})
+        self.addObject('dir.tar.gz', contents)
+        dep = self.createDep('dir.tar.gz', contents)
+        dep.sha256sum = 'deadbeef'
+
+        with self.assertRaisesRegex(Exception, 'sha256sum does not match'):
+            dep.DownloadGoogleStorage()
+        # Nothing from the tarball was extracted.
+        self.assertEqual([], [
+            name for name in os.listdir(os.path.join('src', 'gcs'))
+            if not name.startswith('.')
+        ])
+        self.assertTrue(dep.IsDownloadNeeded())
+
+    def testInvalidTarball(self):
+        contents = self.makeTarball({'dir/a': b'a'}, links={'dir/b': '/etc'})
+        self.addObject('dir.tar.gz', contents)
+        dep = self.createDep('dir.tar.gz', contents)
+
+        with self.assertRaisesRegex(Exception, 'invalid entries'):
+            dep.DownloadGoogleStorage()
+        self.assertFalse(os.path.exists(os.path.join('src', 'gcs', 'dir')))
+
+    def testMissingObject(self):
+        dep = self.createDep('missing', b'')
+
+        with self.assertRaisesRegex(Exception, '404'):
+            dep.DownloadGoogleStorage()
+
+    def testForbiddenFallsBackToGsutil(self):
+        self.server.forbidden.add('/bucket/private')
+        dep = self.createDep('private', b'private')
+
+        with mock.patch('subprocess2.Popen') as popen, \
+                mock.patch('download_from_google_storage.Gsutil') as gsutil:
+            gsutil.return_value.VPYTHON3 = 'vpython3'
+            gsutil.return_value.path = 'gsutil.py'
+            gsutil.return_value.check_call.return_value = (0, '', '')
+            popen.return_value.stdout = io.BytesIO(b'private')
+            popen.return_value.wait.return_value = 0
+            dep.DownloadGoogleStorage()
+
+        self.assertEqual(
+            ['vpython3', 'gsutil.py', 'cat', 'gs://bucket/private'],
+            popen.call_args[0][0])
+        with open(dep.artifact_output_file, 'rb') as f:
+            self.assertEqual(b'private', f.read())
+        self.assertNotEqual(subprocess2.PIPE, popen.call_args[1]['stderr'])
+
+    def testUnreachableFallsBackToGsutil(self):
+        dep = self.createDep('private', b'private')
+
+        def fake_popen(_cmd, stderr, **_kwargs):
+            stderr.write(b'AccessDeniedException: 403')
+            proc = mock.Mock()
+            proc.stdout = io.BytesIO(b'')
+            proc.wait.return_value = 1
+            return proc
+
+        with mock.patch('urllib.request.urlopen',
+                        side_effect=urllib.error.URLError('unreachable')), \
+                mock.patch('subprocess2.Popen', side_effect=fake_popen), \
+                mock.patch('download_from_google_storage.Gsutil'):
+            with self.assertRaisesRegex(Exception, '1: AccessDenied'):
+                dep.DownloadGoogleStorage()
+
 
 class MergeVarsTest(unittest.TestCase):
     def test_merge_vars(self):
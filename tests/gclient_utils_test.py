@@ -5,8 +5,12 @@
 # found in the LICENSE file.
 
 import io
+import json
 import os
 import sys
+import tempfile
+import threading
+import time
 import unittest
 from unittest import mock
 
@@ -301,6 +305,286 @@ class ExtracRefNameTest(unittest.TestCase):
         self.assertIsNone(gclient_utils.ExtractRefName('origin', 'abcbbb1234'))
 
 
+class ExecutionQueueTest(unittest.TestCase):
+    class Item(gclient_utils.WorkItem):
+        def __init__(self, name, requirements=(), resources=(), children=()):
+            super(ExecutionQueueTest.Item, self).__init__(name)
+            self.requirements = list(requirements)
+            self.resources = list(resources)
+            self.children = list(children)
+
+        def run(self, ran, work_queue):
+            with self.lock:
+                ran.append(self.name)
+            for child in self.children:
+                work_queue.enqueue(child)
+
+    def _flush(self, items, jobs=1):
+        ran = []
+        work_queue = gclient_utils.ExecutionQueue(jobs, None, False)
+        for item in items:
+            work_queue.enqueue(item)
+        work_queue.flush(ran)
+        self.assertEqual(sorted(ran), sorted(work_queue.ran))
+        return ran
+
+    def testInsertionOrder(self):
+        items = [
+            self.Item('c', requirements=['a']),
+            self.Item('a'),
+            self.Item('d', requirements=['c']),
+            self.Item('b'),
+        ]
+        # Same as scanning the queue in order: the earliest enqueued runnable
+        # item goes first.
+        self.assertEqual(['a', 'c', 'd', 'b'], self._flush(items))
+
+    def testRequirementsEnqueuedLater(self):
+        b = self.Item('a/b', requirements=['a', 'c'])
+        items = [
+            self.Item('a', children=[b]),
+            self.Item('c'),
+        ]
+        self.assertEqual(['a', 'c', 'a/b'], self._flush(items))
+
+    def testRequirementsGrowWhileReady(self):
+        child = self.Item('x/y')
+
+        class Item(self.Item):
+            def run(self, ran, work_queue):
+                super(Item, self).run(ran, work_queue)
+                # A parent of an item that is already ready shows up.
+                child.requirements.append('x')
+
+        items = [Item('first', children=[self.Item('x')]), child]
+        self.assertEqual(['first', 'x', 'x/y'], self._flush(items))
+
+    def testParallel(self):
+        leaves = [
+            self.Item('root/%d' % i, requirements=['root']) for i in range(50)
+        ]
+        ran = self._flush([self.Item('root', children=leaves)], jobs=8)
+        self.assertEqual('root', ran[0])
+        self.assertEqual(51, len(ran))
+
+    def testOnDone(self):
+        for jobs in (1, 4):
+            items = [self.Item('a'), self.Item('b', requirements=['a'])]
+            done = []
+            work_queue = gclient_utils.ExecutionQueue(
+                jobs,
+                None,
+                False,
+                on_done=lambda item: done.append(
+                    (item.name, threading.current_thread())))
+            for item in items:
+                work_queue.enqueue(item)
+            work_queue.flush([])
+            self.assertEqual([('a', threading.current_thread()),
+                              ('b', threading.current_thread())], done)
+
+    def testPriorities(self):
+        items = [
+            self.Item('a'),
+            self.Item('b'),
+            self.Item('c', requirements=['a']),
+            self.Item('d'),
+        ]
+        priorities = {'b': 1, 'd': 2, 'c': 3}
+        work_queue = gclient_utils.ExecutionQueue(1,
+                                                  None,
+                                                  False,
+                                                  priorities=priorities)
+        for item in items:
+            work_queue.enqueue(item)
+        ran = []
+        work_queue.flush(ran)
+        self.assertEqual(['d', 'b', 'a', 'c'], ran)
+        durations, requirements = work_queue.timings()
+        self.assertEqual(['a', 'b', 'c', 'd'], sorted(durations))
+        self.assertEqual({'a': [], 'b': [], 'c': ['a'], 'd': []}, requirements)
+
+    def testWorkersAreReused(self):
+        threads = set()
+
+        class Item(self.Item):
+            def run(self, ran, work_queue):
+                threads.add(threading.current_thread().ident)
+                super(Item, self).run(ran, work_queue)
+
+        leaves = [Item('root/%d' % i, requirements=['root']) for i in range(50)]
+        self._flush([Item('root', children=leaves)], jobs=4)
+        self.assertLessEqual(len(threads), 4)
+
+    def testWorkerException(self):
+        class Item(self.Item):
+            def run(self, ran, work_queue):
+                raise gclient_utils.Error('boom')
+
+        with mock.patch('sys.stderr', io.StringIO()):
+            with self.assertRaises(gclient_utils.Error):
+                self._flush(
+                    [Item('a'), self.Item('b', requirements=['a'])], jobs=2)
+
+    def testResourceConflict(self):
+        running = []
+
+        class Item(self.Item):
+            def run(self, ran, work_queue):
+                with self.lock:
+                    self_conflicts = [i for i in running if i in self.resources]
+                    running.extend(self.resources)
+                    ran.append(self.name)
+                assert not self_conflicts, self_conflicts
+                time.sleep(0.01)
+                with self.lock:
+                    for r in self.resources:
+                        running.remove(r)
+
+        items = [Item(str(i), resources=['url%d' % (i % 2)]) for i in range(6)]
+        self.assertEqual(6, len(self._flush(items, jobs=4)))
+
+    def testLargeTree(self):
+        # Synthetic 5,000 node tree: 50 solutions with 99 deps each. Scanning
+        # the queue for every scheduling decision makes this quadratic.
+        solutions = []
+        for i in range(50):
+            deps = [
+                self.Item('s%d/d%d' % (i, j), requirements=['s%d' % i])
+                for j in range(99)
+            ]
+            solutions.append(self.Item('s%d' % i, children=deps))
+        start = time.time()
+        ran = self._flush(solutions)
+        self.assertEqual(5000, len(ran))
+        self.assertEqual(['s%d' % i for i in range(50)], ran[:50])
+        self.assertLess(time.time() - start, 10)
+
+
+    def testTrace(self):
+        recorder = gclient_utils.StartTracing()
+        self.addCleanup(gclient_utils.StopTracing)
+        items = [self.Item('a'), self.Item('b', requirements=['a'])]
+        self._flush(items, jobs=2)
+        spans = [e for e in recorder.events if e['ph'] == 'X']
+        self.assertEqual(['a', 'b'], [e['name'] for e in spans])
+        self.assertEqual({'dependency'}, {e['cat'] for e in spans})
+        self.assertLessEqual(spans[0]['ts'] + spans[0]['dur'], spans[1]['ts'])
+
+class CriticalPathTest(unittest.TestCase):
+    def testEmpty(self):
+        self.assertEqual({}, gclient_utils.CriticalPathLengths({}, {}))
+        self.assertEqual([], gclient_utils.CriticalPath({}, {}))
+
+    def testLengths(self):
+        durations = {'src': 10, 'src/a': 5, 'src/b': 30, 'src/b/c': 1, 'x': 2}
+        requirements = {
+            'src/a': ['src'],
+            'src/b': ['src'],
+            'src/b/c': ['src', 'src/b'],
+        }
+        self.assertEqual(
+            {
+                'src': 41,
+                'src/a': 5,
+                'src/b': 31,
+                'src/b/c': 1,
+                'x': 2
+            }, gclient_utils.CriticalPathLengths(durations, requirements))
+        self.assertEqual(['src', 'src/b', 'src/b/c'],
+                         gclient_utils.CriticalPath(durations, requirements))
+
+    def testCycle(self):
+        durations = {'a': 1, 'b': 2}
+        requirements = {'a': ['b'], 'b': ['a']}
+        lengths = gclient_utils.CriticalPathLengths(durations, requirements)
+        self.assertEqual(['a', 'b'], sorted(lengths))
+        self.assertEqual(
+            2, len(gclient_utils.CriticalPath(durations, requirements)))
+
+
+class TraceTest(unittest.TestCase):
+    def setUp(self):
+        self.recorder = gclient_utils.StartTracing()
+        self.addCleanup(gclient_utils.StopTracing)
+
+    def _spans(self):
+        return [e for e in self.recorder.events if e['ph'] == 'X']
+
+    def testSpan(self):
+        with gclient_utils.TraceSpan('git fetch', 'git',
+                                     argv=['git', 'fetch']) as span:
+            span.args['extra'] = 1
+        [event] = self._spans()
+        self.assertEqual('git fetch', event['name'])
+        self.assertEqual('git', event['cat'])
+        self.assertEqual({'argv': ['git', 'fetch'], 'extra': 1}, event['args'])
+        self.assertGreaterEqual(event['dur'], 0)
+
+    def testSpanError(self):
+        with self.assertRaises(ValueError):
+            with gclient_utils.TraceSpan('hook', 'hook'):
+                raise ValueError()
+        [event] = self._spans()
+        self.assertEqual({'error': 'ValueError'}, event['args'])
+
+    def testDecorator(self):
+        @gclient_utils.TraceSpan('fetch', 'phase')
+        def fetch(value):
+            return value
+
+        self.assertEqual(1, fetch(1))
+        self.assertEqual(2, fetch(2))
+        self.assertEqual(['fetch', 'fetch'], [e['name'] for e in self._spans()])
+
+    def testThreads(self):
+        with gclient_utils.TraceSpan('main', 'test'):
+            pass
+        thread = threading.Thread(target=self._traceInThread)
+        thread.start()
+        thread.join()
+        tids = {e['name']: e['tid'] for e in self._spans()}
+        self.assertEqual({'main': 0, 'worker': 1}, tids)
+        names = [
+            e['args']['name'] for e in self.recorder.events if e['ph'] == 'M'
+        ]
+        self.assertEqual(['main', 'worker 1'], names)
+
+    def _traceInThread(self):
+        with gclient_utils.TraceSpan('worker', 'test'):
+            pass
+
+    def testDisabled(self):
+        gclient_utils.StopTracing()
+        with gclient_utils.TraceSpan('ignored', 'test'):
+            pass
+        self.assertEqual([], self.recorder.events)
+
+    def testWrite(self):
+        with gclient_utils.TraceSpan('span', 'test'):
+            pass
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'trace.json')
+            self.recorder.write(path)
+            with open(path) as f:
+                trace = json.load(f)
+        self.assertEqual(self.recorder.events, trace['traceEvents'])
+
+    def testCommandName(self):
+        self.assertEqual(
+            'git fetch',
+            gclient_utils.TraceCommandName(
+                ['git', '-c', 'core.deltaBaseCacheLimit=2g', 'fetch',
+                 'origin']))
+        self.assertEqual(
+            'git status',
+            gclient_utils.TraceCommandName(
+                ['git', '-C', 'src', '--no-pager', 'status']))
+        self.assertEqual(
+            'python3 hook.py',
+            gclient_utils.TraceCommandName(['/usr/bin/python3', 'hook.py']))
+        self.assertEqual('git', gclient_utils.TraceCommandName(['git']))
+
 class GClientUtilsTest(trial_dir.TestCase):
     def testHardToDelete(self):
         # Use the fact that tearDown will delete the directory to make it hard
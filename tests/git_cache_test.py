@@ -128,6 +128,287 @@ class GitCacheTest(unittest.TestCase):
 
         mirror.populate()
 
+    def testContainsRevisions(self):
+        self.git(['init', '-q'])
+        with open(os.path.join(self.origin_dir, 'foo'), 'w') as f:
+            f.write('touched\n')
+        self.git(['add', 'foo'])
+        self.git([
+            '-c', 'user.name=Test user', '-c', 'user.email=joj@test.com',
+            'commit', '-m', 'foo'
+        ])
+        head = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=self.origin_dir).decode().strip()
+        tree = subprocess.check_output(['git', 'rev-parse', 'HEAD^{tree}'],
+                                       cwd=self.origin_dir).decode().strip()
+        missing = 'f' * 40
+
+        mirror = git_cache.Mirror(self.origin_dir)
+        self.assertEqual({head: False}, mirror.contains_revisions([head]))
+        mirror.populate()
+
+        self.assertEqual({
+            head: True,
+            tree: False,
+            missing: False
+        }, mirror.contains_revisions([head, tree, missing]))
+        self.assertTrue(os.path.exists(mirror.mirror_path + '.revisions'))
+
+        # Known revisions are served from the cache, in memory or on disk.
+        with mock.patch('subprocess.run') as run:
+            self.assertEqual({
+                head: True,
+                missing: False
+            }, mirror.contains_revisions([head, missing]))
+            git_cache.Mirror._revision_cache.clear()
+            self.assertTrue(mirror.contains_revision(head))
+        run.assert_not_called()
+
+        self.assertEqual({(mirror.mirror_path, head): True},
+                         git_cache.Mirror.batch_contains_revisions([
+                             (mirror, head),
+                             (git_cache.Mirror(self.origin_dir), head)
+                         ]))
+
+    def testContainsRevisionsInvalidatedByFetch(self):
+        self.git(['init', '-q'])
+        with open(os.path.join(self.origin_dir, 'foo'), 'w') as f:
+            f.write('touched\n')
+        self.git(['add', 'foo'])
+        self.git([
+            '-c', 'user.name=Test user', '-c', 'user.email=joj@test.com',
+            'commit', '-m', 'foo'
+        ])
+        mirror = git_cache.Mirror(self.origin_dir)
+        mirror.populate()
+
+        self.git([
+            '-c', 'user.name=Test user', '-c', 'user.email=joj@test.com',
+            'commit', '--allow-empty', '-m', 'bar'
+        ])
+        head = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=self.origin_dir).decode().strip()
+        self.assertFalse(mirror.contains_revision(head))
+
+        mirror.populate()
+        self.assertTrue(mirror.contains_revision(head))
+
+    def testPopulateFetchesOnce(self):
+        self.git(['init', '-q'])
+        self.git([
+            '-c', 'user.name=Test user', '-c', 'user.email=joj@test.com',
+            'commit', '--allow-empty', '-m', 'foo'
+        ])
+        self.git(['tag', 'v1'])
+        self.git(['branch', 'branch-heads/1'])
+        head = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=self.origin_dir).decode().strip()
+
+        mirror = git_cache.Mirror(self.origin_dir,
+                                  refs=['refs/tags/*'],
+                                  commits=[head])
+        mirror.populate()
+
+        with mock.patch.object(mirror, 'RunGit',
+                               wraps=mirror.RunGit) as run_git:
+            mirror.populate()
+        fetches = [
+            args[0] for args, _ in run_git.call_args_list
+            if args[0][0] == 'fetch'
+        ]
+        # The commit is already in the mirror and isn't fetched again.
+        self.assertEqual(1, len(fetches))
+        self.assertIn('+refs/tags/*:refs/tags/*', fetches[0])
+        self.assertNotIn(head, fetches[0])
+
+    @mock.patch('gclient_utils.RETRY_INITIAL_SLEEP', 0)
+    def testPopulateFetchesMissingCommits(self):
+        self.git(['init', '-q'])
+        self.git([
+            '-c', 'user.name=Test user', '-c', 'user.email=joj@test.com',
+            'commit', '--allow-empty', '-m', 'foo'
+        ])
+        self.git([
+            '-c', 'user.name=Test user', '-c', 'user.email=joj@test.com',
+            'commit', '--allow-empty', '-m', 'bar'
+        ])
+        # A commit that isn't reachable from the fetched refs.
+        self.git(['update-ref', 'refs/other/bar', 'HEAD'])
+        other = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                        cwd=self.origin_dir).decode().strip()
+        self.git(['reset', '-q', '--hard', 'HEAD~'])
+        missing = '1' * 40
+
+        def commit_fetches(mirror, **kwargs):
+            with mock.patch.object(mirror, 'RunGit',
+                                   wraps=mirror.RunGit) as run_git:
+                mirror.populate(**kwargs)
+            return [
+                args[0] for args, _ in run_git.call_args_list
+                if args[0][:2] == ['fetch', 'origin']
+            ]
+
+        # The commits are fetched without the flags of the refspec fetch.
+        mirror = git_cache.Mirror(self.origin_dir, commits=[other])
+        self.assertEqual([['fetch', 'origin', other]],
+                         commit_fetches(mirror, depth=1, no_fetch_tags=True))
+        self.assertTrue(mirror.contains_revision(other))
+
+        # Only the missing commits are fetched, and fetched again one by one
+        # on failure.
+        mirror = git_cache.Mirror(self.origin_dir, commits=[other, missing])
+        self.assertEqual([['fetch', 'origin', missing]] * 2,
+                         commit_fetches(mirror))
+
+    @mock.patch('gclient_utils.RETRY_INITIAL_SLEEP', 0)
+    def testPopulateFetchFallsBackToOneByOne(self):
+        self.git(['init', '-q'])
+        self.git([
+            '-c', 'user.name=Test user', '-c', 'user.email=joj@test.com',
+            'commit', '--allow-empty', '-m', 'foo'
+        ])
+        head = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=self.origin_dir).decode().strip()
+
+        # The missing ref makes the fetch of all refspecs at once fail.
+        mirror = git_cache.Mirror(self.origin_dir, refs=['refs/missing/ref'])
+        mirror.populate()
+        self.assertTrue(mirror.contains_revision(head))
+
+    def testSetFetchJobs(self):
+        self.addCleanup(git_cache.Mirror.SetFetchJobs, None)
+        git_cache.Mirror.SetFetchJobs(1)
+        mirror = git_cache.Mirror(self.origin_dir)
+        with mirror._fetch_slot():
+            self.assertFalse(
+                git_cache.Mirror._fetch_semaphore.acquire(blocking=False))
+        self.assertTrue(
+            git_cache.Mirror._fetch_semaphore.acquire(blocking=False))
+
+    def testReadManifest(self):
+        path = os.path.join(self.cache_dir, 'manifest')
+        with open(path, 'w') as f:
+            f.write('# Repos to cache.\n'
+                    'https://example.com/foo\n'
+                    '\n'
+                    '  https://example.com/bar@%s\n' % ('1' * 40))
+        self.assertEqual([('https://example.com/foo', None),
+                          ('https://example.com/bar', '1' * 40)],
+                         git_cache.ReadManifest(path))
+
+    def testReadGclientEntries(self):
+        path = os.path.join(self.cache_dir, '.gclient_entries')
+        with open(path, 'w') as f:
+            f.write('entries = {\n'
+                    '  "src": "https://example.com/src@refs/heads/main",\n'
+                    '  "src/file_only": None,\n'
+                    '  "src/cipd": "https://chrome-infra-packages.appspot.com/'
+                    'foo@latest",\n'
+                    '  "src/gcs": "gs://bucket/object",\n'
+                    '}\n')
+        self.assertEqual([('https://example.com/src', 'refs/heads/main')],
+                         git_cache.ReadGclientEntries(path))
+
+    def testMirrorsForEntries(self):
+        mirrors = git_cache.MirrorsForEntries([
+            ('https://example.com/foo', '1' * 40),
+            ('https://example.com/foo.git', 'refs/branch-heads/1'),
+            ('https://example.com/foo', 'main'),
+            ('https://example.com/bar', None),
+        ])
+        self.assertEqual(['https://example.com/foo', 'https://example.com/bar'],
+                         [m.url for m in mirrors])
+        self.assertEqual({'1' * 40}, mirrors[0].fetch_commits)
+        self.assertEqual(
+            {('+refs/branch-heads/1:refs/branch-heads/1',
+              r'\+refs/branch-heads/1:.*')}, mirrors[0].fetch_specs)
+        self.assertEqual(set(), mirrors[1].fetch_commits)
+        self.assertEqual(set(), mirrors[1].fetch_specs)
+
+    def testPopulateMirrors(self):
+        self.git(['init', '-q'])
+        self.git([
+            '-c', 'user.name=Test user', '-c', 'user.email=joj@test.com',
+            'commit', '--allow-empty', '-m', 'foo'
+        ])
+        mirrors = git_cache.MirrorsForEntries(
+            [(self.origin_dir, None), ('https://example.com/foo', None)],
+            print_func=lambda _: None)
+
+        error = subprocess.CalledProcessError(128, ['git', 'fetch'])
+        with mock.patch.object(mirrors[1], 'populate', side_effect=error):
+            results = git_cache.PopulateMirrors(mirrors,
+                                                jobs=2,
+                                                jobs_per_host=1)
+
+        self.assertEqual(mirrors, [mirror for mirror, _, _ in results])
+        self.assertIsNone(results[0][2])
+        self.assertTrue(mirrors[0].exists())
+        self.assertEqual(error, results[1][2])
+
+    @mock.patch('sys.stdout', StringIO())
+    @mock.patch('git_cache.PopulateMirrors', return_value=[])
+    @mock.patch('git_cache.Mirror.SetFetchJobs')
+    def testPopulateFetchJobs(self, mockSetFetchJobs, mockPopulateMirrors):
+        path = os.path.join(self.cache_dir, 'manifest')
+        with open(path, 'w') as f:
+            f.write('https://example.com/foo\n')
+
+        self.assertEqual(
+            0,
+            git_cache.main(
+                ['populate', '--manifest', path, '--fetch-jobs', '2']))
+        mockSetFetchJobs.assert_called_once_with(2)
+        mockPopulateMirrors.assert_called_once()
+
+    def _makeManyPacks(self, mirror, count):
+        """Populates |mirror| with at least |count| pack files."""
+        self.git(['init', '-q'])
+        mirror.populate()
+        # Keep each fetch in its own pack.
+        mirror.RunGit(['config', 'fetch.unpackLimit', '1'])
+        for i in range(count):
+            with open(os.path.join(self.origin_dir, 'foo'), 'w') as f:
+                f.write('%d\n' % i)
+            self.git(['add', 'foo'])
+            self.git([
+                '-c', 'user.name=Test user', '-c', 'user.email=joj@test.com',
+                'commit', '-m',
+                'foo %d' % i
+            ])
+            mirror.populate()
+        self.assertGreaterEqual(len(mirror._pack_files()), count)
+
+    @mock.patch('sys.stdout', StringIO())
+    def testMaintain(self):
+        mirror = git_cache.Mirror(self.origin_dir)
+        self._makeManyPacks(mirror, 8)
+        head = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=self.origin_dir).decode().strip()
+
+        mirror.maintain()
+
+        self.assertLess(len(mirror._pack_files()), 3)
+        objects = os.path.join(mirror.mirror_path, 'objects')
+        self.assertTrue(
+            os.path.exists(os.path.join(objects, 'pack', 'multi-pack-index')))
+        self.assertTrue(
+            os.path.exists(
+                os.path.join(objects, 'info', 'commit-graphs',
+                             'commit-graph-chain')))
+        self.assertTrue(mirror.contains_revision(head))
+
+    @mock.patch('sys.stdout', StringIO())
+    def testPopulateMaintainsInsteadOfBootstrapping(self):
+        mirror = git_cache.Mirror(self.origin_dir)
+        self._makeManyPacks(mirror, 4)
+
+        with mock.patch('git_cache.GC_AUTOPACKLIMIT', 2), \
+                mock.patch.object(mirror, 'bootstrap_repo') as bootstrap_repo:
+            mirror.populate(bootstrap=True)
+        bootstrap_repo.assert_not_called()
+        self.assertLessEqual(len(mirror._pack_files()), 2)
+
     @mock.patch('sys.stdout', StringIO())
     def testPruneRequired(self):
         self.git(['init', '-q'])
@@ -653,7 +653,7 @@ class TestGitCl(unittest.TestCase):
         mock.patch('scm.GIT.IsValidRevision', return_value=True).start()
         mock.patch('scm.GIT.FetchUpstreamTuple',
                    return_value=('origin', 'refs/heads/main')).start()
-        mock.patch('scm.GIT.CaptureStatus',
+        mock.patch('scm.GIT.IterStatus',
                    return_value=[('M', 'foo.txt')]).start()
         # It's important to reset settings to not have inter-tests interference.
         git_cl.settings = git_cl.Settings()
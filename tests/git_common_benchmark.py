@@ -0,0 +1,75 @@
+#!/usr/bin/env vpython3
+# Copyright (c) 2026 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Benchmarks git_common.ObjectReader against one git process per object.
+
+This is not a test and is not run by the presubmit. Run it by hand when
+changing how git_common reads objects.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import git_common
+
+
+def make_repo(path, num_files):
+    """Creates a repository with |num_files| files in a single commit."""
+    subprocess.check_call(['git', 'init', '-q', path])
+    for i in range(num_files):
+        with open(os.path.join(path, 'file%d' % i), 'w') as f:
+            f.write('contents of file %d\n' % i * 100)
+    subprocess.check_call(['git', 'add', '.'], cwd=path)
+    subprocess.check_call([
+        'git', '-c', 'user.name=Benchmark', '-c', 'user.email=b@example.com',
+        'commit', '-q', '-m', 'files'
+    ],
+                          cwd=path)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    options = parser.parse_args(args)
+
+    path = tempfile.mkdtemp()
+    try:
+        make_repo(path, options.files)
+        revs = ['HEAD:file%d' % i for i in range(options.files)]
+
+        def per_call():
+            for rev in revs:
+                git_common.run('cat-file',
+                               '-p',
+                               rev,
+                               cwd=path,
+                               autostrip=False,
+                               decode=False)
+
+        def batched():
+            with git_common.ObjectReader(path) as reader:
+                for rev in revs:
+                    reader.read(rev)
+
+        for name, func in (
+            ('git cat-file per object', per_call),
+            ('ObjectReader', batched),
+        ):
+            best = min(timeit.repeat(func, number=1, repeat=options.repeat))
+            print('%-24s %.3fs' % (name, best))
+    finally:
+        shutil.rmtree(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
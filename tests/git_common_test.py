@@ -8,11 +8,13 @@
 import binascii
 import collections
 import datetime
+import io
 import os
 import shutil
 import signal
 import sys
 import tempfile
+import threading
 import time
 import unittest
 
@@ -93,6 +95,16 @@ class Support(GitCommonTestBase):
 
         self.assertEqual(testlist, ['dog'])
 
+    def testIterNulDelimited(self):
+        data = b'M\0a file\0A\0new\nline\0\0D\0last'
+        for chunk_size in (1, 3, 1024):
+            self.assertEqual(
+                [b'M', b'a file', b'A', b'new\nline', b'D', b'last'],
+                list(
+                    self.gc.iter_nul_delimited(io.BytesIO(data),
+                                               chunk_size=chunk_size)))
+        self.assertEqual([], list(self.gc.iter_nul_delimited(io.BytesIO())))
+
 
 def slow_square(i):
     """Helper for ScopedPoolTest.
@@ -405,6 +417,12 @@ class GitReadOnlyFunctionsTest(git_test_utils.GitRepoReadOnlyTestBase,
         tree = self.repo.run(self.gc.tree, 'main:wat')
         self.assertEqual(tree, None)
 
+        # Commits are peeled to their tree, blobs aren't trees.
+        tree = self.repo.run(self.gc.tree, 'main')
+        self.assertEqual(tree['some'][:2], ('040000', 'tree'))
+        tree = self.repo.run(self.gc.tree, 'main:some/files/file1')
+        self.assertEqual(tree, None)
+
     def testTreeRecursive(self):
         tree = self.repo.run(self.gc.tree, 'main:some', recurse=True)
         file1 = self.COMMIT_A['some/files/file1']['data']
@@ -424,6 +442,109 @@ class GitReadOnlyFunctionsTest(git_test_utils.GitRepoReadOnlyTestBase,
             tree['other/file'],
             ('100644', 'blob', git_test_utils.git_hash_data(other)))
 
+    def testObjectReader(self):
+        file1 = self.COMMIT_A['some/files/file1']['data']
+        with self.gc.ObjectReader(self.repo.repo_path) as reader:
+            self.assertEqual(('blob', file1),
+                             reader.read('main:some/files/file1'))
+            self.assertEqual(
+                (git_test_utils.git_hash_data(file1), 'blob', len(file1)),
+                reader.info('main:some/files/file1'))
+            self.assertEqual(self.repo['D'], reader.info('branch_D')[0])
+            self.assertEqual('commit', reader.read('branch_D')[0])
+            self.assertIsNone(reader.read('main:wat'))
+            self.assertIsNone(reader.info('main:some files'))
+            self.assertIsNone(reader.read('main:some files'))
+            # The processes are still usable after misses.
+            self.assertEqual(('blob', file1),
+                             reader.read('main:some/files/file1'))
+            with self.assertRaises(ValueError):
+                reader.read('main\n')
+
+    def testObjectReaderInfoBatch(self):
+        file1 = self.COMMIT_A['some/files/file1']['data']
+        # Enough revisions to fill the pipes if they weren't read concurrently.
+        revs = ['main:some/files/file1', 'main:wat'] * 5000
+        with self.gc.ObjectReader(self.repo.repo_path) as reader:
+            infos = reader.info_batch(revs)
+            self.assertEqual([
+                (git_test_utils.git_hash_data(file1), 'blob', len(file1)), None
+            ] * 5000, infos)
+            self.assertEqual(('blob', file1),
+                             reader.read('main:some/files/file1'))
+            self.assertEqual([], reader.info_batch([]))
+            with self.assertRaises(ValueError):
+                reader.info_batch(['main\n'])
+
+    def testObjectReaderInfoBatchError(self):
+        file1 = self.COMMIT_A['some/files/file1']['data']
+        revs = ['main:some/files/file1'] * 50000
+        reader = self.gc.ObjectReader(self.repo.repo_path)
+        self.addCleanup(reader.close)
+        errors = []
+
+        def info_batch():
+            # Stop reading after the first header, while git and the writer
+            # are still busy.
+            with mock.patch.object(self.gc.ObjectReader,
+                                   '_read_header',
+                                   side_effect=IOError('broken')):
+                try:
+                    reader.info_batch(revs)
+                except IOError as e:
+                    errors.append(e)
+
+        thread = threading.Thread(target=info_batch)
+        thread.daemon = True
+        thread.start()
+        thread.join(30)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(1, len(errors))
+        # A new process serves the next requests.
+        self.assertEqual(
+            (git_test_utils.git_hash_data(file1), 'blob', len(file1)),
+            reader.info('main:some/files/file1'))
+
+    def testObjectReaderThreads(self):
+        paths = ['some/files/file1', 'some/files/file3', 'some/other/file']
+        expected = [self.COMMIT_A[p]['data'] for p in paths] * 20
+        reader = self.gc.ObjectReader(self.repo.repo_path)
+        self.addCleanup(reader.close)
+        with self.gc.ScopedPool(kind='threads') as pool:
+            contents = pool.map(lambda p: reader.read('main:' + p)[1],
+                                paths * 20)
+        self.assertEqual(expected, contents)
+
+    def testSharedObjectReader(self):
+        reader = self.gc.object_reader(self.repo.repo_path)
+        self.assertIs(reader, self.gc.object_reader(self.repo.repo_path))
+        self.assertIs(reader, self.repo.run(self.gc.object_reader))
+
+    def testSharedObjectReaderRecreatedRepo(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        path = os.path.join(tempdir, 'repo')
+
+        def init_repo(data):
+            os.mkdir(path)
+            self.gc.run('init', '-q', path)
+            return self.gc.run('hash-object',
+                               '-w',
+                               '--stdin',
+                               indata=data.encode(),
+                               cwd=path)
+
+        first = init_repo('first')
+        reader = self.gc.object_reader(path)
+        self.assertEqual(('blob', b'first'), reader.read(first))
+        shutil.rmtree(path)
+        second = init_repo('second')
+        # The reader of the deleted repository isn't reused.
+        new_reader = self.gc.object_reader(path)
+        self.assertIsNot(reader, new_reader)
+        self.assertIsNone(new_reader.read(first))
+        self.assertEqual(('blob', b'second'), new_reader.read(second))
+
 
 class GitMutableFunctionsTest(git_test_utils.GitRepoReadWriteTestBase,
                               GitCommonTestBase):
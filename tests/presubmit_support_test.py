@@ -5,6 +5,8 @@
 
 import os.path
 import sys
+import threading
+import time
 import unittest
 from unittest import mock
 
@@ -12,7 +14,9 @@ ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, ROOT_DIR)
 
 import gclient_utils
+import git_common
 import presubmit_support
+import scm
 import subprocess2
 from testing_support import fake_repos
 
@@ -113,6 +117,70 @@ index 0000000..9daeafb
             change._affected_files[0].OldContents()
 
 
+class GitChangeOldContentsTest(fake_repos.FakeReposTestBase):
+
+    FAKE_REPOS_CLASS = ProvidedDiffChangeFakeRepo
+
+    def setUp(self):
+        super(GitChangeOldContentsTest, self).setUp()
+        self.enabled = self.FAKE_REPOS.set_up_git()
+        if not self.enabled:
+            self.skipTest('git fake repos not available')
+        self.repo = os.path.join(self.FAKE_REPOS.git_base, 'repo_1')
+        # Don't share the object readers with the other tests.
+        git_common.close_object_readers()
+        self.addCleanup(git_common.close_object_readers)
+        files = [('M', 'to_be_modified'), ('D', 'to_be_deleted'),
+                 ('M', 'somewhere/else'), ('A', 'added')]
+        self.change = presubmit_support.GitChange('name',
+                                                  'description',
+                                                  self.repo,
+                                                  files,
+                                                  0,
+                                                  0,
+                                                  None,
+                                                  upstream='HEAD~',
+                                                  end_commit='HEAD')
+
+    def test_old_contents_are_fetched_at_once(self):
+        expected = {
+            'to_be_modified': ['please change me'],
+            'to_be_deleted': ['delete', 'me'],
+            'somewhere/else': ['not a top level file!'],
+            'added': [],
+        }
+        with mock.patch('scm.GIT.GetOldBlobIds',
+                        wraps=scm.GIT.GetOldBlobIds) as get_old_blob_ids, \
+                mock.patch('scm.GIT.ReadBlob',
+                           wraps=scm.GIT.ReadBlob) as read_blob:
+            for _ in range(2):
+                for f in self.change._affected_files:
+                    self.assertEqual(expected[f.LocalPath()], f.OldContents())
+        get_old_blob_ids.assert_called_once()
+        # Blobs are read lazily, once each.
+        self.assertEqual(3, read_blob.call_count)
+
+    def test_diff_is_generated_once_across_threads(self):
+        generate_diff = scm.GIT.GenerateDiff
+
+        def slow_generate_diff(*args, **kwargs):
+            # Give the other threads time to ask for the diff too.
+            time.sleep(0.1)
+            return generate_diff(*args, **kwargs)
+
+        with mock.patch('scm.GIT.GenerateDiff',
+                        side_effect=slow_generate_diff) as mock_generate_diff:
+            threads = [
+                threading.Thread(target=f.GenerateScmDiff)
+                for f in self.change._affected_files
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        mock_generate_diff.assert_called_once()
+
+
 class TestParseDiff(unittest.TestCase):
     """A suite of tests related to diff parsing and processing."""
 
@@ -6,6 +6,7 @@
 
 # pylint: disable=no-member,E1103
 
+import concurrent.futures
 import functools
 import io
 import itertools
@@ -19,6 +20,7 @@ import tempfile
 import threading
 import time
 import unittest
+import weakref
 
 from io import StringIO
 from unittest import mock
@@ -1056,10 +1058,10 @@ def CheckChangeOnCommit(input_api, output_api):
                                                        options.recursive)
 
     @mock.patch('presubmit_support.GitChange', mock.Mock())
-    @mock.patch('scm.GIT.CaptureStatus', mock.Mock())
+    @mock.patch('scm.GIT.IterStatus', mock.Mock())
     def testParseChange_NoFilesAndGit(self):
         scm.determine_scm.return_value = 'git'
-        scm.GIT.CaptureStatus.return_value = [('A', 'added.txt')]
+        scm.GIT.IterStatus.return_value = [('A', 'added.txt')]
         options = mock.Mock(all_files=False, files=[], diff_file='')
 
         change = presubmit._parse_change(None, options)
@@ -1073,9 +1075,9 @@ def CheckChangeOnCommit(input_api, output_api):
             options.author,
             upstream=options.upstream,
             end_commit=options.end_commit)
-        scm.GIT.CaptureStatus.assert_called_once_with(options.root,
-                                                      options.upstream,
-                                                      ignore_submodules=False)
+        scm.GIT.IterStatus.assert_called_once_with(options.root,
+                                                   options.upstream,
+                                                   ignore_submodules=False)
 
     @mock.patch('presubmit_support.GitChange', mock.Mock())
     @mock.patch('scm.GIT.GetAllFiles', mock.Mock())
@@ -1728,6 +1730,73 @@ class OutputApiUnittest(PresubmitTestsBase):
                 '  return []\n', fake_presubmit))
         self.assertEqual(['chromium-reviews@chromium.org'], executer.more_cc)
 
+    @mock.patch('multiprocessing.cpu_count', return_value=2)
+    def testExecPresubmitScriptParallelChecks(self, _cpu_count):
+        fake_presubmit = os.path.join(self.fake_root_dir, 'PRESUBMIT.py')
+        change = presubmit.Change('mychange', 'description', self.fake_root_dir,
+                                  [], 0, 0, None)
+        # Both checks must be running at the same time to get past the barrier.
+        script = ('import threading\n'
+                  'barrier = threading.Barrier(2, timeout=10)\n'
+                  '\n'
+                  'def CheckFirst(input_api, output_api):\n'
+                  '  barrier.wait()\n'
+                  "  output_api.AppendCC('b@chromium.org')\n"
+                  "  return [output_api.PresubmitError('first')]\n"
+                  '\n'
+                  'def CheckSecond(input_api, output_api):\n'
+                  '  barrier.wait()\n'
+                  "  output_api.AppendCC('a@chromium.org')\n"
+                  "  return [output_api.PresubmitError('second')]\n")
+
+        executer = presubmit.PresubmitExecuter(change,
+                                               True,
+                                               None,
+                                               presubmit.GerritAccessor(),
+                                               parallel_checks=True)
+        results = executer.ExecPresubmitScript(
+            "PRESUBMIT_VERSION = '2.0.0'\n" + script, fake_presubmit)
+        self.assertEqual(['first', 'second'], [r._message for r in results])
+        self.assertEqual(['a@chromium.org', 'b@chromium.org'], executer.more_cc)
+
+        # PRESUBMIT_VERSION 3.0.0 opts in to running checks in parallel.
+        executer = presubmit.PresubmitExecuter(change, True, None,
+                                               presubmit.GerritAccessor())
+        results = executer.ExecPresubmitScript(
+            "PRESUBMIT_VERSION = '3.0.0'\n" + script, fake_presubmit)
+        self.assertEqual(['first', 'second'], [r._message for r in results])
+
+    def testExecPresubmitScriptParallelChecksThreadPools(self):
+        fake_presubmit = os.path.join(self.fake_root_dir, 'PRESUBMIT.py')
+        change = presubmit.Change('mychange', 'description', self.fake_root_dir,
+                                  [], 0, 0, None)
+        script = ('def CheckFirst(input_api, output_api):\n'
+                  '  return [output_api.PresubmitError(\n'
+                  '      "", items=[input_api.thread_pool])]\n'
+                  '\n'
+                  'def CheckSecond(input_api, output_api):\n'
+                  '  return [output_api.PresubmitError(\n'
+                  '      "", items=[input_api.thread_pool])]\n')
+        thread_pool = presubmit.ThreadPool(3, timeout=42)
+        executer = presubmit.PresubmitExecuter(change,
+                                               True,
+                                               None,
+                                               presubmit.GerritAccessor(),
+                                               thread_pool=thread_pool,
+                                               parallel_checks=True)
+        with mock.patch('concurrent.futures.ThreadPoolExecutor',
+                        wraps=concurrent.futures.ThreadPoolExecutor) as pool:
+            results = executer.ExecPresubmitScript(
+                "PRESUBMIT_VERSION = '2.0.0'\n" + script, fake_presubmit)
+        pool.assert_called_once_with(max_workers=3)
+        first, second = [r._items[0] for r in results]
+        self.assertIsNot(first, second)
+        for pool in (first, second):
+            self.assertEqual(42, pool.timeout)
+            self.assertEqual(3, pool._pool_size)
+        self.assertIsNotNone(first._test_slots)
+        self.assertIs(first._test_slots, second._test_slots)
+
     def testOutputApiHandling(self):
         presubmit.OutputApi.PresubmitError('!!!').handle()
         self.assertIsNotNone(sys.stdout.getvalue().count('!!!'))
@@ -1752,14 +1821,59 @@ class OutputApiUnittest(PresubmitTestsBase):
 
 
 class AffectedFileUnittest(PresubmitTestsBase):
-    def testAffectedFile(self):
-        gclient_utils.FileRead.return_value = 'whatever\ncookie'
+    @mock.patch('presubmit_support._Lines.FromFile')
+    def testAffectedFile(self, from_file):
+        from_file.return_value = presubmit._Lines('whatever\ncookie')
         af = presubmit.GitAffectedFile('foo/blat.cc', 'M', self.fake_root_dir,
                                        None)
         self.assertEqual(presubmit.normpath('foo/blat.cc'), af.LocalPath())
         self.assertEqual('M', af.Action())
         self.assertEqual(['whatever', 'cookie'], af.NewContents())
 
+    def testLines(self):
+        for text in ('', '\n', 'a', 'a\n', 'a\r\nb\rc\n\nd', 'a\r\r\nb\n\n',
+                     'a\x0bb\x0cc\x1cd\x85e\u2028f\u2029g\u00e9'):
+            lines = presubmit._Lines(text)
+            self.assertEqual(text.splitlines(), lines.ToList())
+            self.assertEqual(len(text.splitlines()), len(lines))
+
+    def testContentsCache(self):
+        cache = presubmit._ContentsCache(max_files=2, max_size=10)
+        cache.Set('a', 'A', 1)
+        cache.Set('b', 'B', 1)
+        self.assertEqual('A', cache.Get('a'))
+        # 'b' is the least recently used entry.
+        cache.Set('c', 'C', 1)
+        self.assertIsNone(cache.Get('b'))
+        self.assertEqual('A', cache.Get('a'))
+        self.assertEqual('C', cache.Get('c'))
+        # Entries are also evicted to stay within the size limit.
+        cache.Set('d', 'D', 9)
+        self.assertIsNone(cache.Get('a'))
+        self.assertEqual('D', cache.Get('d'))
+        # Entries larger than the limit are not kept.
+        cache.Set('e', 'E', 11)
+        self.assertIsNone(cache.Get('e'))
+
+    @mock.patch('presubmit_support._Lines.FromFile')
+    def testContentsCacheIsPerChange(self, from_file):
+        from_file.return_value = presubmit._Lines('old')
+        af = presubmit.AffectedFile('foo.cc', 'M', self.fake_root_dir,
+                                    presubmit._DiffCache())
+        self.assertEqual(['old'], af.NewContents())
+
+        # The files of another change don't share the cached contents.
+        from_file.return_value = presubmit._Lines('new')
+        other = presubmit.AffectedFile('foo.cc', 'M', self.fake_root_dir,
+                                       presubmit._DiffCache())
+        self.assertEqual(['new'], other.NewContents())
+        self.assertEqual(['old'], af.NewContents())
+
+        # The cached contents don't keep the file alive.
+        ref = weakref.ref(af)
+        del af
+        self.assertIsNone(ref())
+
     def testAffectedFileNotExists(self):
         notfound = 'notfound.cc'
         gclient_utils.FileRead.side_effect = IOError
@@ -3379,6 +3493,72 @@ the current line as well!
                          results[0]._message)
         self.checkstdout('')
 
+        # Checks replaced in canned_checks, e.g. by --skip_canned, are used.
+        with presubmit.canned_check_filter(['CheckChangeHasNoStrayWhitespace']):
+            results = presubmit_canned_checks.PanProjectChecks(
+                input_api,
+                presubmit.OutputApi,
+                excluded_paths=None,
+                text_files=None,
+                license_header=None,
+                project_name=None,
+                owners_check=False)
+        self.assertEqual(1, len(results))
+        self.assertNotEqual('Found line ending with white spaces in:',
+                            results[0]._message)
+
+    def testFindNewViolationsOfRules(self):
+        affected_file = mock.MagicMock(presubmit.GitAffectedFile)
+        affected_file.LocalPath.return_value = 'foo.cc'
+        affected_file.NewContents.return_value = [
+            'ok', 'tab\there', 'trailing '
+        ]
+        affected_file.ChangedContents.return_value = [(2, 'tab\there'),
+                                                      (3, 'trailing ')]
+        clean_file = mock.MagicMock(presubmit.GitAffectedFile)
+        clean_file.LocalPath.return_value = 'bar.cc'
+        clean_file.NewContents.return_value = ['ok']
+
+        rules = [
+            presubmit_canned_checks._LineRule(lambda _, line: '\t' not in line,
+                                              [(affected_file, 'cc'),
+                                               (clean_file, 'cc')], None),
+            presubmit_canned_checks._LineRule(
+                lambda _, line: line.rstrip() == line, [(affected_file, 'cc')],
+                None),
+            presubmit_canned_checks._LineRule(lambda _, line: 'x' not in line,
+                                              [(affected_file, 'cc')], None),
+        ]
+        self.assertEqual(
+            [['foo.cc:2'], ['foo.cc:3'], []],
+            presubmit_canned_checks._FindNewViolationsOfRules(rules))
+        # Each file is only read once, whatever the number of rules.
+        affected_file.NewContents.assert_called_once_with()
+        affected_file.ChangedContents.assert_called_once_with()
+        clean_file.NewContents.assert_called_once_with()
+        clean_file.ChangedContents.assert_not_called()
+
+    def testFindNewViolationsOfRulesFileOrder(self):
+        files = []
+        for path in ('a.cc', 'b.cc'):
+            affected_file = mock.MagicMock(presubmit.GitAffectedFile)
+            affected_file.LocalPath.return_value = path
+            affected_file.NewContents.return_value = ['x']
+            affected_file.ChangedContents.return_value = [(1, 'x')]
+            files.append(affected_file)
+
+        rule = lambda _, line: 'x' not in line
+        rules = [
+            presubmit_canned_checks._LineRule(rule, [(files[0], 'cc'),
+                                                     (files[1], 'cc')], None),
+            presubmit_canned_checks._LineRule(rule, [(files[1], 'cc'),
+                                                     (files[0], 'cc')], None),
+        ]
+        # The errors of each rule follow the order of its own files.
+        self.assertEqual(
+            [['a.cc:1', 'b.cc:1'], ['b.cc:1', 'a.cc:1']],
+            presubmit_canned_checks._FindNewViolationsOfRules(rules))
+
     def testCheckCIPDManifest_file(self):
         input_api = self.MockInputApi(None, False)
 
@@ -3535,6 +3715,135 @@ class ThreadPoolTest(unittest.TestCase):
             messages[1])
         self.assertEqual('5\n5 (0.00s) failed\nstdout', messages[2])
 
+    def testCallCommandSharesTestSlots(self):
+        running = []
+        concurrency = []
+        lock = threading.Lock()
+
+        def run_with_timeout(*_args):
+            with lock:
+                running.append(None)
+                concurrency.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.pop()
+            return 0, ''
+
+        test_slots = threading.BoundedSemaphore(2)
+        pools = [
+            presubmit.ThreadPool(4, test_slots=test_slots) for _ in range(2)
+        ]
+        for pool in pools:
+            pool.AddTests([
+                presubmit.CommandData(name=str(i),
+                                      cmd=[str(i)],
+                                      kwargs={},
+                                      message=lambda x, **kwargs: x)
+                for i in range(8)
+            ])
+        with mock.patch.object(presubmit.ThreadPool,
+                               '_RunWithTimeout',
+                               side_effect=run_with_timeout):
+            threads = [threading.Thread(target=p.RunAsync) for p in pools]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(16, len(concurrency))
+        self.assertLessEqual(max(concurrency), 2)
+
+
+class PresubmitResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        super(PresubmitResultCacheTest, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(gclient_utils.rmtree, self.root)
+        self.counter = os.path.join(self.root, 'counter')
+        gclient_utils.FileWrite(os.path.join(self.root, 'foo.cc'), 'foo\n')
+        self.presubmit_path = os.path.join(self.root, 'PRESUBMIT.py')
+        self.script = (
+            'def CheckChangeOnUpload(input_api, output_api):\n'
+            '  with open(%r, "a") as f:\n'
+            '    f.write("x")\n'
+            '  output_api.AppendCC("a@chromium.org")\n'
+            '  return [output_api.PresubmitPromptWarning(\n'
+            '      "warning", items=["foo.cc"], long_text="long")]\n' %
+            self.counter)
+
+    def _cache(self, skip_canned=()):
+        change = presubmit.Change('mychange', 'description', self.root,
+                                  [('M', 'foo.cc')], 0, 0, None)
+        return change, presubmit.PresubmitResultCache(
+            change, os.path.join(self.root, 'cache'), skip_canned)
+
+    def _run(self, script, skip_canned=()):
+        change, cache = self._cache(skip_canned)
+        executer = presubmit.PresubmitExecuter(change,
+                                               False,
+                                               None,
+                                               None,
+                                               result_cache=cache)
+        results = executer.ExecPresubmitScript(script, self.presubmit_path)
+        self.assertEqual(['a@chromium.org'], executer.more_cc)
+        self.assertEqual([{
+            'message': 'warning',
+            'items': ['foo.cc'],
+            'long_text': 'long',
+            'fatal': False
+        }], [r.json_format() for r in results])
+        self.assertIsInstance(results[0], presubmit._PresubmitPromptWarning)
+        return gclient_utils.FileRead(self.counter)
+
+    def testReplay(self):
+        self.assertEqual('x', self._run(self.script))
+        self.assertEqual('x', self._run(self.script))
+
+        # Changing an affected file invalidates the results.
+        gclient_utils.FileWrite(os.path.join(self.root, 'foo.cc'), 'bar\n')
+        self.assertEqual('xx', self._run(self.script))
+        self.assertEqual('xx', self._run(self.script))
+
+        # So does changing the presubmit script.
+        self.assertEqual('xxx', self._run(self.script + '\n'))
+
+    def testSkip(self):
+        script = ("PRESUBMIT_RESULT_CACHE_SKIP = ['CheckChangeOnUpload']\n" +
+                  self.script)
+        self.assertEqual('x', self._run(script))
+        self.assertEqual('xx', self._run(script))
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'cache')))
+
+    def testSkipCanned(self):
+        self.assertEqual('x', self._run(self.script))
+        # Skipping other canned checks invalidates the results.
+        self.assertEqual('xx',
+                         self._run(self.script, skip_canned=['CheckOwners']))
+        self.assertEqual('xx',
+                         self._run(self.script, skip_canned=['CheckOwners']))
+        self.assertEqual('xx', self._run(self.script))
+
+    def testNetworkCannedCheck(self):
+        script = self.script.replace(
+            '  output_api.AppendCC',
+            '  input_api.canned_checks.CheckTreeIsOpen(\n'
+            '      input_api, output_api, json_url="https://example.com")\n'
+            '  output_api.AppendCC')
+        self.assertEqual('x', self._run(script))
+        self.assertEqual('xx', self._run(script))
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'cache')))
+
+    def testSetUnserializable(self):
+        _, cache = self._cache()
+        cache.Set('key', [], [object()])
+        self.assertIsNone(cache.Get('key'))
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'cache')))
+
+    def testGetReadOnlyEntry(self):
+        _, cache = self._cache()
+        cache.Set('key', [], ['a@chromium.org'])
+        with mock.patch('os.utime', side_effect=OSError('read-only')):
+            self.assertEqual(([], ['a@chromium.org']), cache.Get('key'))
+
 
 if __name__ == '__main__':
     import unittest
@@ -19,6 +19,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from testing_support import fake_repos
 
+import gclient_utils
 import scm
 import subprocess
 import subprocess2
@@ -188,6 +189,38 @@ class RealGitTest(fake_repos.FakeReposTestBase):
         self.assertTrue(scm.GIT.IsValidRevision(cwd=self.cwd, rev=first_rev))
         self.assertTrue(scm.GIT.IsValidRevision(cwd=self.cwd, rev='HEAD'))
 
+    def testGetOldContents(self):
+        self.assertEqual(
+            'git/repo_1@1\n',
+            scm.GIT.GetOldContents(self.cwd,
+                                   'origin',
+                                   branch=self.githash('repo_1', 1)))
+        self.assertEqual(
+            '',
+            scm.GIT.GetOldContents(self.cwd,
+                                   'missing',
+                                   branch=self.githash('repo_1', 1)))
+
+    def testCaptureStatus(self):
+        self.assertEqual([('M      ', 'DEPS'), ('M      ', 'origin')],
+                         scm.GIT.CaptureStatus(self.cwd,
+                                               self.githash('repo_1', 1),
+                                               end_commit=self.githash(
+                                                   'repo_1', 2)))
+        with self.assertRaises(subprocess2.CalledProcessError) as cm:
+            scm.GIT.CaptureStatus(self.cwd, 'zebra')
+        self.assertIn(b'zebra', cm.exception.stderr)
+
+    def testCaptureStatusTrace(self):
+        recorder = gclient_utils.StartTracing()
+        self.addCleanup(gclient_utils.StopTracing)
+        scm.GIT.CaptureStatus(self.cwd,
+                              self.githash('repo_1', 1),
+                              end_commit=self.githash('repo_1', 2))
+        spans = [e for e in recorder.events if e['ph'] == 'X']
+        self.assertEqual(['git diff'], [e['name'] for e in spans])
+        self.assertEqual(self.cwd, spans[0]['args']['cwd'])
+
     def testIsAncestor(self):
         self.assertTrue(
             scm.GIT.IsAncestor(self.githash('repo_1', 1),
@@ -410,6 +443,128 @@ class RealGitTest(fake_repos.FakeReposTestBase):
         scm.GIT.Capture(['checkout', 'main'], cwd=self.cwd)
 
 
+class GitConfigSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(gclient_utils.rmtree, self.tmp)
+        self.root = os.path.join(self.tmp, 'repo')
+        subprocess.check_call(['git', 'init', '-q', self.root])
+        env = {
+            scm.GitConfigStateReal.SNAPSHOT_ENV_VAR: '1',
+            'HOME': self.tmp,
+            'XDG_CACHE_HOME': os.path.join(self.tmp, 'cache'),
+            'XDG_CONFIG_HOME': os.path.join(self.tmp, 'config'),
+            'GIT_CONFIG_NOSYSTEM': '1',
+        }
+        mock.patch.dict(os.environ, env).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def git_config(self, *args):
+        subprocess.check_call(['git', 'config'] + list(args), cwd=self.root)
+
+    def load_config(self):
+        return scm.GitConfigStateReal(self.root).load_config()
+
+    def test_snapshot_is_reused(self):
+        self.git_config('section.key', 'value')
+        cfg = self.load_config()
+        self.assertEqual(['value'], cfg['local']['section.key'])
+        self.assertTrue(
+            os.path.exists(
+                scm.GitConfigStateReal(self.root)._snapshot_path()))
+
+        with mock.patch('scm.GIT.Capture') as capture, \
+                mock.patch('git_common.get_git_version') as get_git_version:
+            self.assertEqual(cfg, self.load_config())
+        capture.assert_not_called()
+        get_git_version.assert_not_called()
+
+    def test_snapshot_disabled(self):
+        os.environ.pop(scm.GitConfigStateReal.SNAPSHOT_ENV_VAR)
+        self.assertIsNone(scm.GitConfigStateReal(self.root)._snapshot_path())
+        self.load_config()
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'cache')))
+
+    def test_set_config_drops_snapshot(self):
+        state = scm.GitConfigStateReal(self.root)
+        state.load_config()
+        state.set_config('section.key', 'new', append=False, scope='local')
+        self.assertFalse(os.path.exists(state._snapshot_path()))
+        self.assertEqual(['new'], self.load_config()['local']['section.key'])
+
+    def test_snapshot_invalidated_by_other_writers(self):
+        self.load_config()
+        self.git_config('section.key', 'local')
+        self.assertEqual(['local'], self.load_config()['local']['section.key'])
+
+        # The global config did not exist when the snapshot was made.
+        self.git_config('--global', 'section.key', 'global')
+        self.assertEqual(['global'],
+                         self.load_config()['global']['section.key'])
+
+        include = os.path.join(self.tmp, 'included')
+        with open(include, 'w') as f:
+            f.write('[section]\n\tincluded = 1\n')
+        self.git_config('include.path', include)
+        self.assertEqual(['1'], self.load_config()['local']['section.included'])
+        with open(include, 'w') as f:
+            f.write('[section]\n\tincluded = 22\n')
+        self.assertEqual(['22'],
+                         self.load_config()['local']['section.included'])
+
+    def test_snapshot_not_written_for_config_changed_while_read(self):
+        self.git_config('section.key', 'old')
+        capture = scm.GIT.Capture
+
+        def capture_and_write(args, **kwargs):
+            result = capture(args, **kwargs)
+            if args[:2] == ['config', '--list']:
+                self.git_config('section.key', 'newer')
+            return result
+
+        with mock.patch('scm.GIT.Capture', side_effect=capture_and_write):
+            self.assertEqual(['old'],
+                             self.load_config()['local']['section.key'])
+        self.assertFalse(
+            os.path.exists(scm.GitConfigStateReal(self.root)._snapshot_path()))
+        self.assertEqual(['newer'], self.load_config()['local']['section.key'])
+
+    def test_snapshot_invalidated_by_new_system_config(self):
+        os.environ.pop('GIT_CONFIG_NOSYSTEM')
+        system_config = os.path.join(self.tmp, 'gitconfig')
+        os.environ['GIT_CONFIG_SYSTEM'] = system_config
+        self.assertEqual({}, self.load_config()['system'])
+
+        subprocess.check_call(
+            ['git', 'config', '--file', system_config, 'section.key', 'system'])
+        self.assertEqual(['system'],
+                         self.load_config()['system']['section.key'])
+
+    def test_snapshot_invalidated_by_new_worktree_config(self):
+        self.git_config('extensions.worktreeConfig', 'true')
+        self.load_config()
+        self.git_config('--worktree', 'section.key', 'worktree')
+        self.assertEqual(['worktree'],
+                         self.load_config()['worktree']['section.key'])
+
+    @mock.patch('git_common.get_git_version', return_value=(2, 45))
+    @mock.patch('scm.GIT.Capture')
+    def test_snapshot_unknown_scope(self, mock_capture, _):
+        def capture(args, **_kwargs):
+            if args[:2] == ['config', '--list']:
+                return ('future\x00blob:abc\x00section.future\nf\x00'
+                        'local\x00file:.git/config\x00section.key\nv\x00')
+            raise subprocess2.CalledProcessError(1, args, None, b'', b'')
+
+        mock_capture.side_effect = capture
+        cfg = self.load_config()
+        self.assertEqual(['f'], cfg['future']['section.future'])
+        self.assertEqual(['v'], cfg['local']['section.key'])
+        self.assertEqual(
+            ['f', 'v'],
+            [value for values in cfg['default'].values() for value in values])
+
+
 class DiffTestCase(unittest.TestCase):
 
     def setUp(self):